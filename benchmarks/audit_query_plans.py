@@ -0,0 +1,137 @@
+"""Проверка планов запросов частых методов MovieDatabase: регрессия к полному просмотру movies.
+
+Строит базу генератором datagen.py (--rows фильмов, по умолчанию 20 000 -
+достаточно, чтобы планировщик выбирал индексы как на настоящей базе), выполняет
+ANALYZE и вызывает частые методы (QueryLog.HOT_METHODS) со всеми фильтрами,
+курсорами страниц и вариантами поиска через MovieDatabase.timed_call в строгом
+режиме QueryLog. Кэш фильмов выключен: выполняются сами запросы.
+
+Для каждого вида запроса выводится план; полный просмотр таблицы movies
+отмечается "SCAN", просмотр всего индекса - "index", сортировка во временном
+B-дереве - "sort". Код возврата 1, если хотя бы один запрос частого метода
+просматривает всю таблицу, - проверка для CI после изменения запросов или индексов.
+
+    python benchmarks/audit_query_plans.py
+    python benchmarks/audit_query_plans.py --rows 100000 --verbose
+"""
+import os
+import sys
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import load_bot  # noqa: E402
+from datagen import Dataset  # noqa: E402
+
+
+def build_cases(database, dataset: Dataset, rng: random.Random) -> list:
+    """Вызовы частых методов: (метод, вариант, args, kwargs)"""
+    user_id = rng.choice(dataset.user_ids(power=False))
+    power_id = rng.choice(dataset.user_ids(power=True) or dataset.user_ids(power=False))
+    genre = dataset.genre(rng)
+    query = dataset.title(rng).lower().split()[0][:5]
+
+    cases = []
+    for scope, uid in (('regular', user_id), ('power', power_id)):
+        movies = database.get_user_movies(uid)
+        first = movies[len(movies) // 2] if movies else {'id': 0, 'priority': 3, 'added_date': '2023-01-01'}
+        cursor = (first['priority'], first['added_date'], first['id'])
+        cases += [
+            ('get_user_movies', f'{scope} all', (uid,), {}),
+            ('get_user_movies', f'{scope} page', (uid,), {'limit': 10}),
+            ('get_user_movies', f'{scope} status', (uid,), {'status': 'want_to_watch', 'limit': 10}),
+            ('get_user_movies', f'{scope} genre', (uid,), {'genre': genre, 'limit': 10}),
+            ('get_user_movies', f'{scope} year', (uid,), {'year': 2020, 'limit': 10}),
+            ('get_user_movies', f'{scope} priority', (uid,), {'priority': 5, 'limit': 10}),
+            ('get_user_movies', f'{scope} public only', (uid,), {'include_private': False, 'limit': 10}),
+            ('get_user_movies', f'{scope} after', (uid,), {'limit': 10, 'after': cursor}),
+            ('get_user_movies', f'{scope} before', (uid,), {'limit': 10, 'before': cursor}),
+            ('get_user_movies', f'{scope} status after', (uid,),
+             {'status': 'watched', 'limit': 10, 'after': cursor}),
+            ('get_top_rated_movies', scope, (uid, 10), {}),
+            ('get_top_rated_movies', f'{scope} after', (uid, 10), {'after': (7, first['id'])}),
+            ('get_top_rated_movies', f'{scope} before', (uid, 10), {'before': (7, first['id'])}),
+            ('get_movies_overview', scope, (uid,), {}),
+            ('get_movies_overview', f'{scope} genre', (uid,), {'genre': genre}),
+            ('get_movies_overview', f'{scope} year', (uid,), {'year': 2020}),
+            ('get_random_movie', scope, (uid,), {}),
+            ('get_random_movie', f'{scope} watched', (uid,), {'status': 'watched'}),
+            ('search_movies', scope, (uid, query), {}),
+            ('fuzzy_search_movies', scope, (uid, query + 'ъ'), {}),
+            ('get_user_stats', scope, (uid,), {}),
+            ('get_user_genres', scope, (uid,), {}),
+        ]
+        if movies:
+            movie_id = first['id']
+            cases += [
+                ('get_movie_by_id', scope, (uid, movie_id), {}),
+                ('update_movie', f'{scope} priority', (uid, movie_id), {'priority': 4}),
+                ('mark_as_watched', scope, (uid, movie_id), {'rating': 8}),
+                ('toggle_movie_privacy', scope, (uid, movie_id), {}),
+                ('toggle_movie_privacy', f'{scope} back', (uid, movie_id), {}),
+            ]
+
+    public = database.get_public_movies(limit=50)
+    cursor = (public[-1]['added_date'], public[-1]['id']) if public else ('2023-01-01', 0)
+    cases += [
+        ('get_public_movies', 'page', (), {'limit': 10}),
+        ('get_public_movies', 'genre', (), {'genre': genre, 'limit': 10}),
+        ('get_public_movies', 'year', (), {'year': 2020, 'limit': 10}),
+        ('get_public_movies', 'after', (), {'limit': 10, 'after': cursor}),
+        ('get_public_movies', 'before', (), {'limit': 10, 'before': cursor}),
+        ('get_public_movies', 'genre after', (), {'genre': genre, 'limit': 10, 'after': cursor}),
+        ('search_movies', 'public', (user_id, query), {'search_in_public': True}),
+        ('get_global_stats', '', (), {}),
+        ('get_top_genres', '', (), {'limit': 10}),
+        ('get_public_version', '', (), {}),
+        ('add_movie', '', (user_id, 'Проверка планов', genre, 2020), {}),
+    ]
+    added = database.conn.execute('SELECT MAX(id) FROM movies WHERE user_id = ?', (user_id,)).fetchone()[0]
+    cases.append(('delete_movie', '', (user_id, added), {}))
+    return cases
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=20_000, help='фильмов в проверочной базе')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--verbose', action='store_true', help='выводить текст каждого вида запроса')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bot = load_bot(os.path.join(tmp, 'bot.db'))
+        path = os.path.join(tmp, 'audit.db')
+        dataset = Dataset(args.rows, args.seed, power_size=max(100, args.rows // 20))
+        database = bot.MovieDatabase(path, reader_connections=0, movie_cache_bytes=0)
+        dataset.populate(database)
+        database.conn.execute('ANALYZE')
+        database.close()
+
+        database = bot.MovieDatabase(path, reader_connections=1, movie_cache_bytes=0,
+                                     slow_query_ms=0, strict_query_plans=True)
+        failures = []
+        for method, case, call_args, kwargs in build_cases(database, dataset, random.Random(args.seed)):
+            try:
+                database.timed_call(method, call_args, kwargs)
+            except bot.QueryPlanError as e:
+                failures.append(f"{method} {case}: {str(e).splitlines()[0]}")
+
+        for (method, sql), (plan, problems) in sorted(database.query_log.plans().items()):
+            marks = ['SCAN' if problem.endswith(bot.QueryLog.FULL_SCAN) else
+                     'index' if problem.endswith('просмотр всего индекса') else 'sort' for problem in problems]
+            print(f"{method:<22}{','.join(sorted(set(marks))) or 'ok':<11}{'; '.join(plan)}")
+            if args.verbose:
+                print(f"{'':<33}{sql[:300]}")
+        database.close()
+
+    if failures:
+        print(f"\nПолный просмотр movies в частых методах ({len(failures)}):")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+    print("\nПолных просмотров movies в частых методах нет")
+
+
+if __name__ == '__main__':
+    main()
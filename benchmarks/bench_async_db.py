@@ -0,0 +1,108 @@
+"""Задержка обработчиков при синхронном и асинхронном доступе к базе.
+
+Моделирует N одновременных пользователей, которые присылают обновления со
+случайными паузами. Большая часть обновлений выполняет те же запросы, что и
+/my (активность, два списка, статистика, жанры), иногда с добавлением фильма,
+остальные - легкие (/help без базы). После запросов обработчик "отправляет
+ответ" (asyncio.sleep с задержкой сети).
+
+    python benchmarks/bench_async_db.py --users 200 --requests 20
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import load_bot, populate, percentile  # noqa: E402
+
+
+async def handler_sync(database, user_id: int, step: int, send_delay: float):
+    """Обработчик в старом стиле: запросы прямо в цикле событий"""
+    database.update_user_activity(user_id)
+    if step % 5 == 0:
+        database.add_movie(user_id, f"Новый фильм {user_id}-{step}", 'драма', 2020)
+    database.get_user_movies(user_id, status='want_to_watch')
+    database.get_user_movies(user_id, status='watched')
+    database.get_user_stats(user_id)
+    database.get_user_genres(user_id)
+    await asyncio.sleep(send_delay)
+
+
+async def handler_async(database, user_id: int, step: int, send_delay: float):
+    """Обработчик с AsyncMovieDatabase"""
+    await database.update_user_activity(user_id)
+    if step % 5 == 0:
+        await database.add_movie(user_id, f"Новый фильм {user_id}-{step}", 'драма', 2020)
+    await database.get_user_movies(user_id, status='want_to_watch')
+    await database.get_user_movies(user_id, status='watched')
+    await database.get_user_stats(user_id)
+    await database.get_user_genres(user_id)
+    await asyncio.sleep(send_delay)
+
+
+async def handler_light(send_delay: float):
+    """Обработчик без обращения к базе (/help)"""
+    await asyncio.sleep(send_delay)
+
+
+async def simulate(handler, database, users: int, requests: int, send_delay: float, think_time: float):
+    latencies = {'heavy': [], 'light': []}
+    rng = random.Random(1)
+
+    async def user_session(user_id: int):
+        for step in range(requests):
+            await asyncio.sleep(rng.expovariate(1 / think_time))
+            kind = 'light' if rng.random() < 0.3 else 'heavy'
+            start = time.perf_counter()
+            if kind == 'heavy':
+                await handler(database, user_id, step, send_delay)
+            else:
+                await handler_light(send_delay)
+            latencies[kind].append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user_session(user_id) for user_id in range(1, users + 1)))
+    return latencies, time.perf_counter() - start
+
+
+def report(name: str, latencies, elapsed: float):
+    total = latencies['heavy'] + latencies['light']
+    print(f"{name:<8} handlers={len(total):>6}  throughput={len(total) / elapsed:8.1f}/s")
+    for kind, values in (('all', total), ('heavy', latencies['heavy']), ('light', latencies['light'])):
+        print(f"  {kind:<6} p50={percentile(values, 50) * 1000:8.2f}ms  "
+              f"p95={percentile(values, 95) * 1000:8.2f}ms  "
+              f"p99={percentile(values, 99) * 1000:8.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--requests', type=int, default=20, help='обработчиков на пользователя')
+    parser.add_argument('--movies', type=int, default=200, help='фильмов на пользователя')
+    parser.add_argument('--send-delay', type=float, default=0.05, help='задержка ответа Telegram, с')
+    parser.add_argument('--think-time', type=float, default=2.0, help='средняя пауза между обновлениями, с')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bot = load_bot(os.path.join(tmp, 'bot.db'))
+        for name in ('before', 'after'):
+            database = bot.MovieDatabase(os.path.join(tmp, f'{name}.db'))
+            populate(database.conn, args.users, args.movies)
+            if name == 'before':
+                latencies, elapsed = asyncio.run(
+                    simulate(handler_sync, database, args.users, args.requests, args.send_delay, args.think_time))
+            else:
+                async_database = bot.AsyncMovieDatabase(database)
+                latencies, elapsed = asyncio.run(
+                    simulate(handler_async, async_database, args.users, args.requests,
+                             args.send_delay, args.think_time))
+                async_database.close()
+            report(name, latencies, elapsed)
+
+
+if __name__ == '__main__':
+    main()
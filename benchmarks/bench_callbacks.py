@@ -0,0 +1,128 @@
+"""Разбор нажатий кнопок: прежняя цепочка if/elif против callback_router.
+
+before - прежний разбор callback_data (сравнения и startswith по порядку,
+split аргументов), скопирован сюда для сравнения; after - callback_router.resolve
+для данных нового формата. Обработчики не вызываются, замеряется только выбор
+обработчика и разбор аргументов. Для каждого типа кнопки выводится среднее
+время в наносекундах и размер callback_data в байтах.
+
+    python benchmarks/bench_callbacks.py --repeat 200000
+"""
+import os
+import sys
+import timeit
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import load_bot  # noqa: E402
+
+
+def legacy_dispatch(data):
+    if data == "main_menu":
+        return 'main_menu', []
+    elif data == "my_movies":
+        return 'my_movies', []
+    elif data == "watched":
+        return 'watched', []
+    elif data == "random_movie":
+        return 'random_movie', []
+    elif data == "search_movies":
+        return 'search_movies', []
+    elif data == "search_public_menu":
+        return 'search_public_menu', []
+    elif data == "search_public":
+        return 'search_public', []
+    elif data == "public_list":
+        return 'public_list', []
+    elif data == "stats":
+        return 'stats', []
+    elif data == "add_movie":
+        return 'add_movie', []
+    elif data == "help":
+        return 'help', []
+    elif data == "show_genres":
+        return 'show_genres', []
+    elif data == "my_genres":
+        return 'my_genres', []
+    elif data.startswith("filter_genre_"):
+        return 'filter_genre', [data.replace("filter_genre_", "")]
+    elif data == "top_rated":
+        return 'top_rated', []
+    elif data.startswith("watch_"):
+        return 'watch', [int(data.split('_')[1])]
+    elif data.startswith("private_"):
+        return 'private', [int(data.split('_')[1])]
+    elif data.startswith("delete_"):
+        return 'delete', [int(data.split('_')[1])]
+    elif data.startswith("priority_"):
+        return 'priority', [int(part) for part in data.split("_")[1:]]
+    elif data.startswith("rate_"):
+        parts = data.split("_")
+        return 'rate', [int(parts[1]), int(parts[2])]
+    elif data.startswith("movie_back_"):
+        return 'movie_back', [int(data.split("_")[2])]
+    return None, []
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=200_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bot = load_bot(os.path.join(tmp, 'bot.db'))
+        movie_id, genre_id = 1_234_567, 42
+        genre = 'научная фантастика'
+
+        # (кнопка, прежний формат, новый формат)
+        cases = [
+            ('main_menu', 'main_menu', bot.CB_MAIN_MENU),
+            ('my_movies', 'my_movies', bot.CB_MY_MOVIES),
+            ('watched', 'watched', bot.CB_WATCHED),
+            ('random_movie', 'random_movie', bot.CB_RANDOM),
+            ('search_movies', 'search_movies', bot.CB_SEARCH),
+            ('search_public_menu', 'search_public_menu', bot.CB_SEARCH_PUBLIC_MENU),
+            ('search_public', 'search_public', bot.CB_SEARCH_PUBLIC),
+            ('public_list', 'public_list', bot.CB_PUBLIC_LIST),
+            ('stats', 'stats', bot.CB_STATS),
+            ('add_movie', 'add_movie', bot.CB_ADD_MOVIE),
+            ('help', 'help', bot.CB_HELP),
+            ('show_genres', 'show_genres', bot.CB_SHOW_GENRES),
+            ('my_genres', 'my_genres', bot.CB_MY_GENRES),
+            ('top_rated', 'top_rated', bot.CB_TOP_RATED),
+            ('filter_genre', f'filter_genre_{genre}', bot.pack_callback(bot.OP_FILTER_GENRE, genre_id)),
+            ('watch', f'watch_{movie_id}', bot.pack_callback(bot.OP_WATCH, movie_id)),
+            ('private', f'private_{movie_id}', bot.pack_callback(bot.OP_PRIVATE, movie_id)),
+            ('delete', f'delete_{movie_id}', bot.pack_callback(bot.OP_DELETE, movie_id)),
+            ('priority menu', f'priority_{movie_id}', bot.pack_callback(bot.OP_PRIORITY, movie_id)),
+            ('priority set', f'priority_{movie_id}_5', bot.pack_callback(bot.OP_PRIORITY, movie_id, 5)),
+            ('rate', f'rate_{movie_id}_10', bot.pack_callback(bot.OP_RATE, movie_id, 10)),
+            ('movie_back', f'movie_back_{movie_id}', bot.pack_callback(bot.OP_MOVIE_CARD, movie_id)),
+        ]
+
+        resolve = bot.callback_router.resolve
+
+        # Курсор страницы: дата до 1970 года дает отрицательное время (оно кодируется со знаком)
+        for added_date in ('2024-05-01 12:30:00', '1965-01-01 00:00:00', '0001-01-01 00:00:00'):
+            cursor = bot.encode_page_cursor({'added_date': added_date, 'priority': 3, 'id': movie_id})
+            handler, page_args = resolve(bot.page_callback('want', bot.PAGE_NEXT, cursor))
+            assert handler is bot.handle_movie_page, added_date
+            assert bot.decode_page_cursor(page_args[4:]) == (3, added_date, movie_id), added_date
+        print(f"{'button':<20}{'before ns':>11}{'after ns':>10}{'legacy ns':>11}{'bytes':>7}{'new':>5}")
+        totals = [0.0, 0.0]
+        for name, old, new in cases:
+            assert resolve(new)[0] is not None and resolve(old)[0] is resolve(new)[0], name
+            results = []
+            for dispatch, data in ((legacy_dispatch, old), (resolve, new), (resolve, old)):
+                results.append(min(timeit.repeat(lambda: dispatch(data), number=args.repeat, repeat=3))
+                               / args.repeat * 1e9)
+            totals[0] += results[0]
+            totals[1] += results[1]
+            print(f"{name:<20}{results[0]:>11.0f}{results[1]:>10.0f}{results[2]:>11.0f}"
+                  f"{len(old.encode()):>7}{len(new.encode()):>5}")
+        print(f"{'mean':<20}{totals[0] / len(cases):>11.0f}{totals[1] / len(cases):>10.0f}")
+
+
+if __name__ == '__main__':
+    main()
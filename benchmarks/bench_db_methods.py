@@ -0,0 +1,216 @@
+"""Методы MovieDatabase на разных объемах данных с сохранением результатов в JSON.
+
+Для каждого размера из --sizes строит базу генератором datagen.py (Ципф,
+активные пользователи, кириллица) или берет ее из --data-dir, если она уже
+сгенерирована, и замеряет методы MovieDatabase: get_user_movies,
+get_public_movies, get_global_stats, get_top_genres, search_movies,
+get_random_movie, add_movie, update_movie - для обычных и для активных
+(10 000 фильмов) пользователей, где это различается. Кэш фильмов выключен:
+замеряются запросы. Аргументы вызовов зависят только от --seed, поэтому
+замеры разных коммитов сравнимы.
+
+Результаты записываются в --output (JSON: условия запуска и по строке на
+размер/метод/вариант с p50/p95/p99/средним в миллисекундах). С --baseline
+выводится отношение p50 к сохраненному ранее файлу, замедление больше
+--threshold раз отмечается "!".
+
+    python benchmarks/bench_db_methods.py --sizes 10000,100000,1000000 --output before.json
+    python benchmarks/bench_db_methods.py --sizes 10000,100000,1000000 --baseline before.json
+    python benchmarks/bench_db_methods.py --sizes 10000000 --data-dir ~/.cache/movie_bot_bench
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import sqlite3
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import ROOT_DIR, load_bot, percentile  # noqa: E402
+from datagen import DATAGEN_VERSION, Dataset, describe  # noqa: E402
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def build_cases(database, dataset: Dataset, rng: random.Random, calls: int) -> list:
+    """Варианты замеров: (метод, вариант, список аргументов вызовов)"""
+    regular = dataset.user_ids(power=False)
+    power = dataset.user_ids(power=True) or regular
+
+    def users(ids):
+        return [rng.choice(ids) for _ in range(calls)]
+
+    def search_query():
+        # Начало одного-двух слов популярного названия, как их набирают пользователи
+        words = dataset.title(rng).lower().replace(':', '').split()
+        query = rng.choice(words)[:rng.randint(3, 8)]
+        if len(words) > 1 and rng.random() < 0.3:
+            query += ' ' + rng.choice(words)[:4]
+        return query
+
+    # Фильмы для update_movie: собственные фильмы выбранных пользователей
+    def own_movies(ids):
+        result = []
+        for user_id in ids:
+            row = database.conn.execute('SELECT id FROM movies WHERE user_id = ? ORDER BY id LIMIT 1 OFFSET ?',
+                                        (user_id, rng.randrange(50))).fetchone()
+            if row is None:
+                row = database.conn.execute('SELECT id FROM movies WHERE user_id = ? LIMIT 1', (user_id,)).fetchone()
+            result.append((user_id, row[0]))
+        return result
+
+    cases = []
+    for scope, ids in (('regular', regular), ('power', power)):
+        cases += [
+            ('get_user_movies', f'{scope} want page', [
+                ((user_id,), {'status': 'want_to_watch', 'limit': 10}) for user_id in users(ids)]),
+            ('get_user_movies', f'{scope} all', [((user_id,), {}) for user_id in users(ids)]),
+            ('get_user_movies', f'{scope} genre', [
+                ((user_id,), {'genre': dataset.genre(rng), 'limit': 10}) for user_id in users(ids)]),
+            ('search_movies', f'{scope} personal', [
+                ((user_id, search_query()), {}) for user_id in users(ids)]),
+            ('get_random_movie', scope, [((user_id,), {}) for user_id in users(ids)]),
+        ]
+    cases += [
+        ('get_public_movies', 'page', [((), {'limit': 10}) for _ in range(calls)]),
+        ('get_public_movies', 'genre', [((), {'genre': dataset.genre(rng), 'limit': 10}) for _ in range(calls)]),
+        ('get_public_movies', 'year', [((), {'year': max(1950, 2025 - int(rng.expovariate(1 / 15))), 'limit': 10})
+                                       for _ in range(calls)]),
+        ('search_movies', 'public', [((rng.choice(regular), search_query()), {'search_in_public': True})
+                                     for _ in range(calls)]),
+        ('get_global_stats', '', [((), {}) for _ in range(calls)]),
+        ('get_top_genres', '', [((), {'limit': 10}) for _ in range(calls)]),
+    ]
+    # Изменяющие методы - последними, чтобы не влиять на остальные замеры
+    for scope, ids in (('regular', regular), ('power', power)):
+        cases += [
+            ('add_movie', scope, [((user_id, f'{dataset.title(rng)} (бенчмарк {index})', dataset.genre(rng)), {})
+                                  for index, user_id in enumerate(users(ids))]),
+            ('update_movie', f'{scope} priority', [((user_id, movie_id), {'priority': rng.randint(1, 5)})
+                                                   for user_id, movie_id in own_movies(users(ids))]),
+        ]
+    return cases
+
+
+def measure(database, cases: list) -> list:
+    results = []
+    for method, case, calls in cases:
+        function = getattr(database, method)
+        latencies, returned = [], 0
+        for args, kwargs in calls:
+            start = time.perf_counter()
+            result = function(*args, **kwargs)
+            latencies.append(time.perf_counter() - start)
+            returned += len(result) if isinstance(result, list) else result is not None
+        results.append({
+            'method': method,
+            'case': case,
+            'calls': len(calls),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 4),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 4),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 4),
+            'mean_ms': round(sum(latencies) / len(latencies) * 1000, 4),
+            'rows_per_call': round(returned / len(calls), 2),
+        })
+    return results
+
+
+def prepare_database(bot, dataset: Dataset, path: str, data_dir: str) -> dict:
+    """База для замеров в path: генерация или копия сохраненной в data_dir"""
+    start = time.perf_counter()
+    cached = None
+    if data_dir:
+        os.makedirs(data_dir, exist_ok=True)
+        cached = os.path.join(data_dir, f'movies_v{DATAGEN_VERSION}_{dataset.rows}_{dataset.seed}.db')
+    if cached and os.path.exists(cached):
+        shutil.copyfile(cached, path)
+        source = 'cache'
+    else:
+        database = bot.MovieDatabase(path, reader_connections=0, movie_cache_bytes=0)
+        dataset.populate(database)
+        database.conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        database.close()
+        if cached:
+            shutil.copyfile(path, cached)
+        source = 'generated'
+    return {'source': source, 'seconds': round(time.perf_counter() - start, 1),
+            'bytes': os.path.getsize(path)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='10000,100000,1000000', help='число фильмов в базе через запятую')
+    parser.add_argument('--calls', type=int, default=200, help='вызовов на вариант')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-dir', help='каталог для сгенерированных баз (повторные запуски их не строят)')
+    parser.add_argument('--output', default='db_methods.json')
+    parser.add_argument('--baseline', help='JSON прежнего запуска для сравнения')
+    parser.add_argument('--threshold', type=float, default=1.5, help='замедление p50, отмечаемое "!"')
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            for row in json.load(f)['results']:
+                baseline[(row['rows'], row['method'], row['case'])] = row['p50_ms']
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'seed': args.seed,
+            'calls': args.calls,
+            'datagen_version': DATAGEN_VERSION,
+        },
+        'datasets': [],
+        'results': [],
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bot = load_bot(os.path.join(tmp, 'bot.db'))
+        print(f"{'rows':>9} {'method':<18}{'case':<20}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'rows':>8}"
+              + (f"{'vs base':>9}" if baseline else ''))
+        for size in (int(value) for value in args.sizes.split(',')):
+            dataset = Dataset(size, args.seed)
+            path = os.path.join(tmp, f'movies_{size}.db')
+            info = prepare_database(bot, dataset, path, args.data_dir)
+            database = bot.MovieDatabase(path, reader_connections=1, movie_cache_bytes=0)
+            report['datasets'].append({**describe(database.conn), **info,
+                                       'power_users': dataset.power_users})
+
+            rng = random.Random(f'bench-{args.seed}-{size}')
+            for row in measure(database, build_cases(database, dataset, rng, args.calls)):
+                row = {'rows': size, **row}
+                report['results'].append(row)
+                line = (f"{size:>9} {row['method']:<18}{row['case']:<20}{row['p50_ms']:>9.3f}"
+                        f"{row['p95_ms']:>9.3f}{row['p99_ms']:>9.3f}{row['rows_per_call']:>8.1f}")
+                base = baseline.get((size, row['method'], row['case']))
+                if base:
+                    ratio = row['p50_ms'] / base
+                    line += f"{ratio:>8.2f}x" + (' !' if ratio > args.threshold else '')
+                print(line)
+            database.close()
+            os.remove(path)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Результаты: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
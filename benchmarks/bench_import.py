@@ -0,0 +1,82 @@
+"""Импорт списка фильмов: add_movie на каждую строку против add_movies_batch.
+
+Генерирует CSV с --rows фильмами (часть строк повторяется, как в выгрузках
+с пересмотрами), разбирает его iter_import_records и записывает в базу с
+уже заполненной таблицей movies. Время разбора и время базы считаются
+отдельно; before - прежний путь (отдельный commit на фильм).
+
+    python benchmarks/bench_import.py --rows 10000
+"""
+import io
+import os
+import sys
+import csv
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import load_bot, populate, make_title, GENRES  # noqa: E402
+
+
+def make_csv(rows: int, seed: int = 21) -> str:
+    rng = random.Random(seed)
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(['title', 'genre', 'year', 'rating', 'status', 'priority'])
+    titles = [make_title(rng, 10_000_000 + index) for index in range(rows)]
+    for index in range(rows):
+        # Каждая двадцатая строка повторяет уже встреченное название
+        title = titles[rng.randrange(index)] if index and rng.random() < 0.05 else titles[index]
+        watched = rng.random() < 0.4
+        writer.writerow([title, rng.choice(GENRES), rng.randint(1950, 2024),
+                         rng.randint(1, 10) if watched else '', 'watched' if watched else 'want_to_watch',
+                         rng.randint(1, 5)])
+    return out.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=10_000)
+    parser.add_argument('--users', type=int, default=10_000, help='пользователей в базе до импорта')
+    parser.add_argument('--movies-per-user', type=int, default=50)
+    args = parser.parse_args()
+
+    data = make_csv(args.rows)
+    with tempfile.TemporaryDirectory() as tmp:
+        bot = load_bot(os.path.join(tmp, 'bot.db'))
+
+        start = time.perf_counter()
+        records = list(bot.iter_import_records(io.StringIO(data, newline=''), 'list.csv'))
+        parse_time = time.perf_counter() - start
+        movies = [record for record in records if record is not None]
+        print(f"Разбор {len(records)} строк: {parse_time * 1000:.1f} мс, негодных {len(records) - len(movies)}")
+
+        # Даты до 1970 года и из будущего отбрасываются: фильм получает текущее время добавления
+        dated = 'title,date\nДо 1970,1965-01-01\nИз будущего,2999-01-01\nГод 1,0001-01-01\nОбычный,2021-03-04\n'
+        dates = [record[8] for record in bot.iter_import_records(io.StringIO(dated, newline=''), 'dated.csv')]
+        assert dates == [None, None, None, '2021-03-04 00:00:00'], dates
+
+        print(f"{'variant':<8}{'db s':>8}{'rows/s':>10}{'added':>8}")
+        for name in ('before', 'after'):
+            database = bot.MovieDatabase(os.path.join(tmp, f'{name}.db'), movie_cache_bytes=0)
+            populate(database.conn, args.users, args.movies_per_user)
+            user_id = args.users + 1
+            start = time.perf_counter()
+            if name == 'before':
+                added = sum(1 for movie in movies
+                            if database.add_movie(user_id, movie[0], movie[1], movie[2], priority=movie[6]))
+            else:
+                added = 0
+                for offset in range(0, len(movies), bot.IMPORT_CHUNK_ROWS):
+                    added += database.add_movies_batch(user_id, movies[offset:offset + bot.IMPORT_CHUNK_ROWS])
+            elapsed = time.perf_counter() - start
+            stats = database.get_user_stats(user_id)
+            assert stats['want_count'] + stats['watched_count'] == added
+            print(f"{name:<8}{elapsed:>8.3f}{len(movies) / elapsed:>10.0f}{added:>8}")
+            database.close()
+
+
+if __name__ == '__main__':
+    main()
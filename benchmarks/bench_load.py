@@ -0,0 +1,276 @@
+"""Нагрузочный тест бота целиком: --users пользователей против заглушки Bot API.
+
+Бот собирается так же, как в main() (build_application: все обработчики,
+ограничения, база данных), но обращается к заглушке Bot API (fake_bot_api.py)
+вместо Telegram - тест работает без выхода в интернет. База заранее
+заполняется --db-users пользователями по --movies-per-user фильмов.
+
+Каждый виртуальный пользователь работает по замкнутому циклу: отправляет
+запрос, ждет, пока бот его полностью обработает (все ответы Bot API получены),
+и после паузы (в среднем --think секунд) отправляет следующий. Запросы
+выбираются по весам --mix из /add, /my, "Мои фильмы", "🎲 Случайный фильм",
+оценки фильма и публичного списка. Обновления доставляются долгим опросом
+(--mode polling) или вебхуком (--mode webhook). Для каждого запроса выводятся
+число выполненных, ошибки, пропускная способность и задержка p50/p95/p99 от
+появления обновления до конца его обработки; в конце - число вызовов методов
+Bot API.
+
+Ограничение частоты запросов пользователей выключено (его стоимость
+измеряет bench_throttle.py); --limits включает лимиты Telegram в заглушке и
+SendScheduler в боте.
+
+    python benchmarks/bench_load.py --users 200 --seconds 30
+    python benchmarks/bench_load.py --users 500 --think 0.5 --rtt 0.05 --mode webhook
+    python benchmarks/bench_load.py --rtt 0.05 --concurrent-updates 64
+"""
+import os
+import sys
+import time
+import json
+import random
+import asyncio
+import logging
+import argparse
+import tempfile
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import load_bot, make_title, percentile, populate  # noqa: E402
+from fake_bot_api import FakeBotAPI  # noqa: E402
+
+ACTIONS = ('add', 'my', 'my_movies', 'random', 'rate', 'public_list')
+DEFAULT_MIX = 'add=15,my=20,my_movies=15,random=20,rate=15,public_list=15'
+WEBHOOK_SECRET = 'benchmark-secret'
+
+
+def parse_mix(text: str) -> dict:
+    mix = {}
+    for item in text.split(','):
+        name, _, weight = item.partition('=')
+        if name not in ACTIONS:
+            raise argparse.ArgumentTypeError(f"неизвестный запрос {name!r}, возможны: {', '.join(ACTIONS)}")
+        mix[name] = float(weight)
+    return mix
+
+
+def user_payload(user_id: int) -> dict:
+    return {'id': user_id, 'is_bot': False, 'first_name': f'Пользователь {user_id}', 'username': f'user{user_id}'}
+
+
+def command_update(user_id: int, text: str) -> dict:
+    command = text.split(maxsplit=1)[0]
+    return {'message': {
+        'message_id': 1, 'date': int(time.time()), 'text': text,
+        'chat': {'id': user_id, 'type': 'private'}, 'from': user_payload(user_id),
+        'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(command)}],
+    }}
+
+
+def callback_update(user_id: int, data: str) -> dict:
+    return {'callback_query': {
+        'id': f'{user_id}-{time.perf_counter_ns()}', 'from': user_payload(user_id),
+        'chat_instance': str(user_id), 'data': data,
+        'message': {'message_id': 1, 'date': int(time.time()), 'text': 'Меню',
+                    'chat': {'id': user_id, 'type': 'private'}},
+    }}
+
+
+def load_want_movies(conn, user_ids) -> dict:
+    """Непросмотренные фильмы каждого пользователя - для оценок"""
+    want = defaultdict(list)
+    for user_id, movie_id in conn.execute(
+            f"SELECT user_id, id FROM movies WHERE status = 'want_to_watch' "
+            f"AND user_id IN ({','.join('?' * len(user_ids))})", user_ids):
+        want[user_id].append(movie_id)
+    return want
+
+
+async def webhook_connection(port: int, queue: asyncio.Queue):
+    """"Telegram": одно соединение с вебхуком, обновления по одному"""
+    from movie_bot import WebhookServer
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    while (body := await queue.get()) is not None:
+        writer.write(f'POST /hook HTTP/1.1\r\nHost: bot\r\nContent-Type: application/json\r\n'
+                     f'{WebhookServer.SECRET_HEADER}: {WEBHOOK_SECRET}\r\n'
+                     f'Content-Length: {len(body)}\r\n\r\n'.encode() + body)
+        await reader.readline()
+        length = 0
+        while (line := await reader.readline()) != b'\r\n':
+            if line.lower().startswith(b'content-length:'):
+                length = int(line.split(b':')[1])
+        await reader.readexactly(length)
+    writer.close()
+
+
+async def run(bot_module, args):
+    from telegram import Update
+    from telegram.ext import TypeHandler
+
+    if args.limits:
+        api = FakeBotAPI(latency=args.rtt)
+        limiter = bot_module.SendScheduler()
+    else:
+        api = FakeBotAPI(global_rate=1e9, chat_rate=1e9, chat_burst=10**9, latency=args.rtt)
+        limiter = None
+    base_url = await api.start()
+    application = bot_module.build_application(bot_module.MovieBot(
+        '1:BENCHMARK', base_url=base_url,
+        request=bot_module.HTTPXRequest(connection_pool_size=256), rate_limiter=limiter
+    ))
+
+    # Обработка обновления закончена: группа после всех обработчиков бота
+    pending = {}
+    failed = set()
+
+    async def finished(update, context):
+        future = pending.pop(update.update_id, None)
+        if future is not None and not future.done():
+            future.set_result(update.update_id not in failed)
+
+    async def on_error(update, context):
+        if isinstance(update, Update):
+            failed.add(update.update_id)
+
+    application.add_handler(TypeHandler(Update, finished), group=100)
+    application.add_error_handler(on_error)
+
+    await application.initialize()
+    await application.start()
+    server = None
+    connections = []
+    webhook_queue = asyncio.Queue()
+    if args.mode == 'polling':
+        await application.updater.start_polling(poll_interval=0, timeout=10)
+    else:
+        server = bot_module.WebhookServer(application, '/hook', WEBHOOK_SECRET)
+        port = await server.start('127.0.0.1', 0)
+        connections = [asyncio.create_task(webhook_connection(port, webhook_queue))
+                       for _ in range(args.connections)]
+
+    rng = random.Random(args.seed)
+    user_ids = rng.sample(range(1, args.db_users + 1), args.users)
+    want = load_want_movies(bot_module.db.sync.conn, user_ids)
+    actions, weights = zip(*args.mix.items())
+    results = defaultdict(list)
+    errors = defaultdict(int)
+    next_update_id = [0]
+    titles = [0]
+
+    def make_request(user_id: int, action: str) -> dict:
+        if action == 'add':
+            titles[0] += 1
+            return command_update(user_id, f'/add {make_title(rng, 10**7 + titles[0])}, '
+                                           f'{rng.choice(("драма", "комедия", "фантастика"))}')
+        if action == 'my':
+            return command_update(user_id, '/my')
+        if action == 'my_movies':
+            return callback_update(user_id, bot_module.CB_MY_MOVIES)
+        if action == 'random':
+            return callback_update(user_id, bot_module.CB_RANDOM)
+        if action == 'rate':
+            movies = want[user_id]
+            movie_id = movies.pop(rng.randrange(len(movies))) if movies else 1
+            return callback_update(user_id, bot_module.pack_callback(bot_module.OP_RATE, movie_id,
+                                                                     rng.randint(1, 10)))
+        return callback_update(user_id, bot_module.CB_PUBLIC_LIST)
+
+    async def send(payload: dict) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        if args.mode == 'polling':
+            # update_id назначает заглушка; до ближайшего await обновление никто не заберет
+            pending[api.push_update(payload)] = future
+        else:
+            next_update_id[0] += 1
+            pending[next_update_id[0]] = future
+            webhook_queue.put_nowait(json.dumps({**payload, 'update_id': next_update_id[0]}).encode())
+        return future
+
+    async def virtual_user(user_id: int, deadline: float):
+        # Пользователи начинают не одновременно
+        await asyncio.sleep(rng.uniform(0, args.think))
+        while time.perf_counter() < deadline:
+            action = rng.choices(actions, weights)[0]
+            start = time.perf_counter()
+            future = await send(make_request(user_id, action))
+            try:
+                ok = await asyncio.wait_for(future, timeout=args.timeout)
+            except asyncio.TimeoutError:
+                ok = False
+            if ok:
+                results[action].append(time.perf_counter() - start)
+            else:
+                errors[action] += 1
+            think = rng.expovariate(1 / args.think) if args.think else 0
+            await asyncio.sleep(min(think, max(0.0, deadline - time.perf_counter())))
+
+    api.requests.clear()
+    start = time.perf_counter()
+    await asyncio.gather(*(virtual_user(user_id, start + args.seconds) for user_id in user_ids))
+    elapsed = time.perf_counter() - start
+    requests = dict(api.requests)
+
+    for _ in connections:
+        webhook_queue.put_nowait(None)
+    await asyncio.gather(*connections)
+    if server is not None:
+        await server.stop()
+    else:
+        await application.updater.stop()
+    await application.stop()
+    await application.shutdown()
+    await api.stop()
+    return results, errors, elapsed, requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=200, help='одновременно работающих пользователей')
+    parser.add_argument('--db-users', type=int, default=2000, help='пользователей в базе')
+    parser.add_argument('--movies-per-user', type=int, default=50)
+    parser.add_argument('--seconds', type=float, default=20, help='длительность теста')
+    parser.add_argument('--think', type=float, default=1.0, help='средняя пауза пользователя, секунды')
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX, help=f'веса запросов ({DEFAULT_MIX})')
+    parser.add_argument('--mode', choices=('polling', 'webhook'), default='polling')
+    parser.add_argument('--connections', type=int, default=40, help='соединений вебхука')
+    parser.add_argument('--rtt', type=float, default=0.0, help='задержка ответа Bot API, секунды')
+    parser.add_argument('--limits', action='store_true', help='лимиты Telegram и SendScheduler')
+    parser.add_argument('--concurrent-updates', type=int, help='CONCURRENT_UPDATES бота (по умолчанию - как в боте)')
+    parser.add_argument('--timeout', type=float, default=30, help='запрос без ответа дольше - ошибка')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    if args.users > args.db_users:
+        parser.error('--users больше --db-users')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['USER_RATE_LIMIT'] = '0'
+        os.environ['CALLBACK_DEBOUNCE_SECONDS'] = '0'
+        if args.concurrent_updates:
+            os.environ['CONCURRENT_UPDATES'] = str(args.concurrent_updates)
+        bot = load_bot(os.path.join(tmp, 'bot.db'))
+        # Журнал каждого HTTP-запроса искажает замеры
+        for name in ('httpx', 'telegram', 'apscheduler'):
+            logging.getLogger(name).setLevel(logging.WARNING)
+        populate(bot.db.sync.conn, args.db_users, args.movies_per_user, seed=args.seed)
+        bot.db.sync.rebuild_user_stats()
+        bot.db.sync.reconcile_global_stats()
+
+        results, errors, elapsed, requests = asyncio.run(run(bot, args))
+
+        print(f"{args.users} пользователей, {elapsed:.1f} с, режим {args.mode}, rtt {args.rtt * 1000:.0f} мс, "
+              f"concurrent_updates {bot.CONCURRENT_UPDATES}")
+        print(f"{'request':<13}{'done':>7}{'errors':>8}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+        everything = []
+        for action in args.mix:
+            latencies = results[action]
+            everything.extend(latencies)
+            print(f"{action:<13}{len(latencies):>7}{errors[action]:>8}{len(latencies) / elapsed:>8.1f}"
+                  f"{percentile(latencies, 50) * 1000:>9.1f}{percentile(latencies, 95) * 1000:>9.1f}"
+                  f"{percentile(latencies, 99) * 1000:>9.1f}")
+        print(f"{'total':<13}{len(everything):>7}{sum(errors.values()):>8}{len(everything) / elapsed:>8.1f}"
+              f"{percentile(everything, 50) * 1000:>9.1f}{percentile(everything, 95) * 1000:>9.1f}"
+              f"{percentile(everything, 99) * 1000:>9.1f}")
+        print('Bot API: ' + ', '.join(f'{method} {count}' for method, count in sorted(requests.items())))
+
+
+if __name__ == '__main__':
+    main()
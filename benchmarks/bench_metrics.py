@@ -0,0 +1,104 @@
+"""Накладные расходы метрик: запись замеров, обертка запросов к базе и выдача /metrics.
+
+update - определение меток обновления (MovieApplication.update_labels) и запись
+времени обработки для команды и нажатия кнопки, в наносекундах. db - вызов
+метода базы через AsyncMovieDatabase: прежняя обертка (run_in_executor без
+замера) против текущей (MovieDatabase.timed_call с журналом медленных запросов
++ metrics.observe_db), в микросекундах на вызов. render - время metrics.render()
+после --updates обработанных обновлений разных видов и размер ответа.
+
+    python benchmarks/bench_metrics.py --repeat 200000
+"""
+import os
+import sys
+import time
+import asyncio
+import timeit
+import argparse
+import functools
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import load_bot  # noqa: E402
+from bench_load import callback_update, command_update  # noqa: E402
+
+
+async def db_call_cost(bot, calls: int):
+    """Микросекунд на вызов get_global_stats: без замера и с замером"""
+    database = bot.db
+    executor = database._readers
+    method = database.sync.get_global_stats
+    loop = asyncio.get_running_loop()
+
+    async def before():
+        return await loop.run_in_executor(executor, functools.partial(method))
+
+    async def after():
+        result, seconds = await loop.run_in_executor(executor, database.sync.timed_call,
+                                                     'get_global_stats', (), {})
+        bot.metrics.observe_db('get_global_stats', seconds, result)
+        return result
+
+    results = {}
+    for _ in range(2):
+        for name, call in (('before', before), ('after', after)):
+            start = time.perf_counter()
+            for _ in range(calls):
+                await call()
+            cost = (time.perf_counter() - start) / calls * 1e6
+            results[name] = min(results.get(name, cost), cost)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=200_000)
+    parser.add_argument('--db-calls', type=int, default=5000)
+    parser.add_argument('--updates', type=int, default=100_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bot = load_bot(os.path.join(tmp, 'bot.db'))
+        application = bot.build_application(bot.MovieBot('1:BENCHMARK'))
+        telegram_bot = application.bot
+        updates = {
+            'command': bot.Update.de_json({**command_update(1, '/my'), 'update_id': 1}, telegram_bot),
+            'callback': bot.Update.de_json(
+                {**callback_update(1, bot.pack_callback(bot.OP_RATE, 12345, 8)), 'update_id': 2}, telegram_bot),
+        }
+
+        print(f"{'update':<10}{'labels ns':>11}{'observe ns':>12}")
+        for name, update in updates.items():
+            labels = application.update_labels(update)
+            label_cost = min(timeit.repeat(lambda: application.update_labels(update),
+                                           number=args.repeat, repeat=3)) / args.repeat * 1e9
+            observe_cost = min(timeit.repeat(lambda: bot.metrics.observe_update(*labels, 0.004),
+                                             number=args.repeat, repeat=3)) / args.repeat * 1e9
+            print(f"{name:<10}{label_cost:>11.0f}{observe_cost:>12.0f}")
+
+        costs = asyncio.run(db_call_cost(bot, args.db_calls))
+        print(f"db call: before {costs['before']:.1f} мкс, after {costs['after']:.1f} мкс "
+              f"(+{costs['after'] - costs['before']:.1f})")
+
+        commands = sorted(application.command_names)
+        buttons = [bot.CB_MY_MOVIES, bot.CB_RANDOM, bot.CB_PUBLIC_LIST, bot.CB_STATS,
+                   bot.pack_callback(bot.OP_RATE, 1, 5), bot.pack_callback(bot.OP_WATCH, 1)]
+        for index in range(args.updates):
+            if index % 2:
+                update = bot.Update.de_json({**command_update(1, '/' + commands[index % len(commands)]),
+                                             'update_id': index}, telegram_bot)
+            else:
+                update = bot.Update.de_json({**callback_update(1, buttons[index % len(buttons)]),
+                                             'update_id': index}, telegram_bot)
+            bot.metrics.observe_update(*application.update_labels(update), (index % 100) / 1000)
+        for method in bot.AsyncMovieDatabase.WRITE_METHODS | {'get_user_movies', 'get_public_movies',
+                                                                'search_movies', 'get_random_movie'}:
+            bot.metrics.observe_db(method, 0.0005, [])
+        render_cost = min(timeit.repeat(bot.metrics.render, number=50, repeat=3)) / 50 * 1000
+        text = bot.metrics.render()
+        print(f"render: {render_cost:.2f} мс, {len(text.encode()) / 1024:.0f} КБ, "
+              f"{sum(1 for line in text.splitlines() if not line.startswith('#'))} рядов")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""Кэш фильмов пользователей: переходы между карточкой фильма и клавиатурами.
+
+Моделирует сессии: пользователь открывает первую страницу списка, затем
+несколько раз переходит между карточкой фильма, выбором приоритета и
+оценки (get_movie_by_id), иногда меняя приоритет (update_movie). Каждый
+вариант (off - без кэша, on - с кэшем) выполняет одинаковую
+последовательность; колонка hit% - доля чтений из кэша.
+
+    python benchmarks/bench_movie_cache.py --users 2000 --sessions 3000
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import load_bot, populate, percentile  # noqa: E402
+
+
+def run_sessions(database, users: int, sessions: int, flips: int):
+    rng = random.Random(3)
+    latencies = []
+    for _ in range(sessions):
+        user_id = rng.randint(1, users)
+        start = time.perf_counter()
+        movies = database.get_user_movies(user_id, status='want_to_watch', limit=11)
+        latencies.append(time.perf_counter() - start)
+        if not movies:
+            continue
+        movie_id = rng.choice(movies)['id']
+        for _ in range(flips):
+            start = time.perf_counter()
+            if rng.random() < 0.1:
+                database.update_movie(user_id, movie_id, priority=rng.randint(1, 5))
+            database.get_movie_by_id(user_id, movie_id)
+            latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--movies-per-user', type=int, default=200)
+    parser.add_argument('--sessions', type=int, default=3000)
+    parser.add_argument('--flips', type=int, default=8, help='переходов за сессию')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bot = load_bot(os.path.join(tmp, 'bot.db'))
+        print(f"{'cache':<7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'ops/s':>10}{'hit%':>8}")
+        for name, cache_bytes in (('off', 0), ('on', bot.MOVIE_CACHE_MAX_BYTES)):
+            database = bot.MovieDatabase(os.path.join(tmp, f'{name}.db'), movie_cache_bytes=cache_bytes)
+            populate(database.conn, args.users, args.movies_per_user)
+            start = time.perf_counter()
+            latencies = run_sessions(database, args.users, args.sessions, args.flips)
+            elapsed = time.perf_counter() - start
+            stats = database.movie_cache_stats()
+            print(f"{name:<7}{percentile(latencies, 50) * 1000:>10.3f}"
+                  f"{percentile(latencies, 95) * 1000:>10.3f}"
+                  f"{percentile(latencies, 99) * 1000:>10.3f}"
+                  f"{len(latencies) / elapsed:>10.0f}"
+                  f"{stats.get('hit_ratio', 0.0) * 100:>8.1f}")
+            database.close()
+
+        # Изменение из другого процесса (второе подключение) сбрасывает кэш
+        path = os.path.join(tmp, 'on.db')
+        database = bot.MovieDatabase(path)
+        other = bot.MovieDatabase(path, reader_connections=0)
+        movie = database.get_user_movies(1, limit=1)[0]
+        database.get_movie_by_id(1, movie['id'])
+        other.update_movie(1, movie['id'], notes='изменено извне')
+        time.sleep(bot.DATA_VERSION_CHECK_INTERVAL)
+        notes = database.get_movie_by_id(1, movie['id'])['notes']
+        print(f"внешнее изменение видно через {bot.DATA_VERSION_CHECK_INTERVAL:.1f} с: {notes == 'изменено извне'}")
+        other.close()
+        database.close()
+
+
+if __name__ == '__main__':
+    main()
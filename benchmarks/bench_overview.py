@@ -0,0 +1,101 @@
+"""Экран "Мои фильмы": отдельные запросы против одного составного.
+
+before - как раньше: два полных списка get_user_movies, get_user_stats и
+get_user_genres (только ради кнопки "Мои жанры"). after - один вызов
+get_movies_overview. Оба варианта идут через AsyncMovieDatabase, как в боте;
+--concurrency одновременных отрисовок конкурируют за потоки-читатели.
+Колонки calls и sql - обращения к пулу потоков и SQL-запросы на одну отрисовку.
+
+    python benchmarks/bench_overview.py --movies-per-user 200
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import load_bot, populate, percentile  # noqa: E402
+
+
+async def render_before(database, user_id: int):
+    want = await database.get_user_movies(user_id, status='want_to_watch')
+    watched = await database.get_user_movies(user_id, status='watched')
+    await database.get_user_stats(user_id)
+    await database.get_user_genres(user_id)
+    return want[:11], watched[:11], 4
+
+
+async def render_after(database, user_id: int):
+    overview = await database.get_movies_overview(user_id, 11, 11)
+    return overview['want'], overview['watched'], 1
+
+
+async def run(render, database, users: int, renders: int, concurrency: int):
+    rng = random.Random(5)
+    latencies = []
+    calls = 0
+
+    async def worker():
+        nonlocal calls
+        for _ in range(renders // concurrency):
+            start = time.perf_counter()
+            *_, used = await render(database, rng.randint(1, users))
+            latencies.append(time.perf_counter() - start)
+            calls += used
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, calls / len(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--movies-per-user', type=int, default=200)
+    parser.add_argument('--renders', type=int, default=4000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bot = load_bot(os.path.join(tmp, 'bot.db'))
+        # Кэш фильмов выключен: сравниваются сами запросы
+        database = bot.MovieDatabase(os.path.join(tmp, 'overview.db'), movie_cache_bytes=0)
+        populate(database.conn, args.users, args.movies_per_user)
+
+        # Подсчет SQL-запросов на подключениях читателей
+        statements = [0]
+
+        def count_statement(_):
+            statements[0] += 1
+
+        for conn in list(database._reader_pool.queue):
+            conn.set_trace_callback(count_statement)
+
+        async_database = bot.AsyncMovieDatabase(database)
+
+        # Оба варианта должны показывать одно и то же
+        for user_id in (1, args.users // 2, args.users):
+            before = asyncio.run(render_before(async_database, user_id))
+            after = asyncio.run(render_after(async_database, user_id))
+            assert [m['id'] for m in before[0]] == [m['id'] for m in after[0]]
+            assert [m['id'] for m in before[1]] == [m['id'] for m in after[1]]
+
+        print(f"{'variant':<8}{'calls':>7}{'sql':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'renders/s':>12}")
+        for name, render in (('before', render_before), ('after', render_after)):
+            statements[0] = 0
+            start = time.perf_counter()
+            latencies, calls = asyncio.run(
+                run(render, async_database, args.users, args.renders, args.concurrency))
+            elapsed = time.perf_counter() - start
+            print(f"{name:<8}{calls:>7.0f}{statements[0] / len(latencies):>7.1f}"
+                  f"{percentile(latencies, 50) * 1000:>10.2f}"
+                  f"{percentile(latencies, 95) * 1000:>10.2f}"
+                  f"{percentile(latencies, 99) * 1000:>10.2f}"
+                  f"{len(latencies) / elapsed:>12.0f}")
+        async_database.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""Пропускная способность чтения и записи для профилей SQLite.
+
+Строит таблицу movies нужного размера один раз, затем для каждого профиля
+(legacy - прежний режим с одним подключением, остальные - WAL с пулом
+читателей) копирует базу и измеряет:
+  * read  - потоки-читатели выполняют get_user_movies + get_user_stats;
+  * write - один писатель добавляет фильмы (каждый - отдельный commit);
+  * mixed - читатели и писатель одновременно.
+
+    python benchmarks/bench_pragma_profiles.py --rows 1000000
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import load_bot, populate  # noqa: E402
+
+
+def run_readers(database, users: int, threads: int, stop: threading.Event, counter: list):
+    def worker(seed: int):
+        rng = random.Random(seed)
+        done = 0
+        while not stop.is_set():
+            user_id = rng.randint(1, users)
+            database.get_user_movies(user_id, status='want_to_watch', limit=20)
+            database.get_user_stats(user_id)
+            done += 1
+        counter.append(done)
+
+    workers = [threading.Thread(target=worker, args=(seed,)) for seed in range(threads)]
+    for thread in workers:
+        thread.start()
+    return workers
+
+
+def run_writer(database, users: int, stop: threading.Event, counter: list):
+    def worker():
+        rng = random.Random(42)
+        done = 0
+        while not stop.is_set():
+            database.add_movie(rng.randint(1, users), f"Бенчмарк {time.perf_counter_ns()}", 'драма', 2020)
+            done += 1
+        counter.append(done)
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    return [thread]
+
+
+def measure(database, users: int, threads: int, duration: float, readers: bool, writer: bool):
+    stop = threading.Event()
+    read_counter, write_counter = [], []
+    workers = []
+    if readers:
+        workers += run_readers(database, users, threads, stop, read_counter)
+    if writer:
+        workers += run_writer(database, users, stop, write_counter)
+    time.sleep(duration)
+    stop.set()
+    for thread in workers:
+        thread.join()
+    return sum(read_counter) / duration, sum(write_counter) / duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--users', type=int, default=10_000)
+    parser.add_argument('--threads', type=int, default=4, help='потоков-читателей')
+    parser.add_argument('--duration', type=float, default=5.0, help='длительность замера, с')
+    parser.add_argument('--profiles', default=None, help='профили через запятую (по умолчанию все)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bot = load_bot(os.path.join(tmp, 'bot.db'))
+        profiles = args.profiles.split(',') if args.profiles else list(bot.PRAGMA_PROFILES)
+
+        base_path = os.path.join(tmp, 'base.db')
+        start = time.perf_counter()
+        base = bot.MovieDatabase(base_path, pragma_profile='fast', reader_connections=0)
+        populate(base.conn, args.users, max(1, args.rows // args.users))
+        base.conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        base.close()
+        print(f"Подготовлено {args.rows} строк за {time.perf_counter() - start:.1f} с")
+
+        print(f"{'profile':<10}{'read/s':>12}{'write/s':>12}{'mixed read/s':>15}{'mixed write/s':>15}")
+        for profile in profiles:
+            path = os.path.join(tmp, f'{profile}.db')
+            shutil.copy(base_path, path)
+            # Кэш фильмов выключен: измеряется работа SQLite
+            database = bot.MovieDatabase(path, pragma_profile=profile, reader_connections=args.threads,
+                                          movie_cache_bytes=0)
+            read_only, _ = measure(database, args.users, args.threads, args.duration, True, False)
+            _, write_only = measure(database, args.users, args.threads, args.duration, False, True)
+            mixed_read, mixed_write = measure(database, args.users, args.threads, args.duration, True, True)
+            database.close()
+            os.remove(path)
+            print(f"{profile:<10}{read_only:>12.0f}{write_only:>12.0f}{mixed_read:>15.0f}{mixed_write:>15.0f}")
+
+
+if __name__ == '__main__':
+    main()
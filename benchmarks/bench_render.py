@@ -0,0 +1,119 @@
+"""Время отрисовки экранов: прежние построители против текущих.
+
+before - прежние реализации (сложение строк и новая клавиатура на каждый
+вызов), скопированы сюда для сравнения; after - функции movie_bot.
+Для каждого экрана выводится среднее время одной отрисовки в микросекундах.
+
+    python benchmarks/bench_render.py --repeat 20000
+"""
+import os
+import sys
+import random
+import timeit
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import load_bot, make_title, GENRES  # noqa: E402
+
+
+def legacy_format_movie_list(movies, show_status=True, show_privacy=False, show_priority=False):
+    if not movies:
+        return "Список пуст."
+
+    text = ""
+    for i, movie in enumerate(movies[:50], 1):
+        line = f"{i}. "
+        if show_priority and movie.get('priority'):
+            line += f"⭐" * movie['priority'] + " "
+        if show_privacy:
+            line += "👁️ " if movie.get('is_public', True) else "🔒 "
+        line += movie['title']
+        if movie.get('genre'):
+            line += f" ({movie['genre']})"
+        if movie.get('year'):
+            line += f" [{movie['year']}]"
+        if show_status and movie.get('status') == 'watched':
+            line += " ✅"
+            if movie.get('rating'):
+                line += f" ⭐{movie['rating']}/10"
+        text += line + "\n"
+
+    if len(movies) > 50:
+        text += f"\n... и еще {len(movies) - 50} фильмов"
+    return text
+
+
+def legacy_public_page(movies):
+    text = "👁️ **Публичные фильмы**\n\n"
+    for movie in movies:
+        user_name = movie['first_name'] or f"User_{movie['user_id']}"
+        status_icon = "✅" if movie['status'] == 'watched' else "📝"
+        text += f"{status_icon} {movie['title']}"
+        if movie.get('genre'):
+            text += f" ({movie['genre']})"
+        if movie.get('year'):
+            text += f" [{movie['year']}]"
+        text += f" — {user_name}\n"
+    return text
+
+
+def legacy_genres(genres):
+    text = "🏷️ **Популярные жанры:**\n\n"
+    for genre, count in genres:
+        text += f"• {genre}: {count} фильмов\n"
+    return text
+
+
+def make_movies(count: int, seed: int = 9):
+    rng = random.Random(seed)
+    return [{
+        'id': index, 'user_id': rng.randint(1, 1000), 'first_name': f'Пользователь {index}',
+        'title': make_title(rng, index), 'genre': rng.choice(GENRES), 'year': rng.randint(1950, 2024),
+        'status': rng.choice(('watched', 'want_to_watch')), 'rating': rng.randint(1, 10),
+        'priority': rng.randint(1, 5), 'is_public': rng.random() < 0.8,
+    } for index in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=20000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bot = load_bot(os.path.join(tmp, 'bot.db'))
+        page = make_movies(bot.PAGE_SIZE)
+        long_list = make_movies(60)
+        genres = [(genre, 100 - index) for index, genre in enumerate(GENRES)]
+        long_text = legacy_format_movie_list(make_movies(400))
+        legacy_rating_keyboard = bot.create_rating_keyboard.__wrapped__
+        legacy_main_keyboard = bot.create_main_keyboard.__wrapped__
+
+        screens = [
+            ('movie list (50)',
+             lambda: legacy_format_movie_list(long_list, show_privacy=True, show_priority=True),
+             lambda: bot.format_movie_list(long_list, show_privacy=True, show_priority=True)),
+            ('public page',
+             lambda: legacy_public_page(page),
+             lambda: "👁️ **Публичные фильмы**\n\n" + ''.join(
+                 [bot.format_public_movie_line(movie) for movie in page])),
+            ('genres', lambda: legacy_genres(genres),
+             lambda: "🏷️ **Популярные жанры:**\n\n" + bot.format_counts(genres, ' фильмов')),
+            ('rating keyboard', lambda: legacy_rating_keyboard(42), lambda: bot.create_rating_keyboard(42)),
+            ('main keyboard', legacy_main_keyboard, bot.create_main_keyboard),
+            ('split 4096', None, lambda: bot.split_message(long_text)),
+        ]
+
+        print(f"{'screen':<18}{'before us':>11}{'after us':>11}")
+        for name, before, after in screens:
+            results = []
+            for render in (before, after):
+                if render is None:
+                    results.append(float('nan'))
+                    continue
+                results.append(min(timeit.repeat(render, number=args.repeat, repeat=3)) / args.repeat * 1e6)
+            print(f"{name:<18}{results[0]:>11.2f}{results[1]:>11.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""Задержка поиска: прежний LIKE '%запрос%' против индекса FTS5.
+
+Для каждого размера таблицы строит базу и выполняет одинаковый набор
+запросов (начала слов в нижнем регистре, как их набирают пользователи)
+в личном и публичном списке. Колонка found показывает среднее число
+найденных фильмов: LIKE не находит "Матрица" по запросу "матрица".
+Строки fuzzy - нечеткий поиск по тем же словам с одной опечаткой.
+
+    python benchmarks/bench_search.py --sizes 100000,5000000
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import load_bot, populate, percentile, TITLE_WORDS  # noqa: E402
+
+
+def make_queries(count: int, seed: int = 7):
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        word = rng.choice(TITLE_WORDS).lower()
+        query = word[:rng.randint(3, len(word))]
+        if rng.random() < 0.3:
+            query += ' ' + rng.choice(TITLE_WORDS).lower()[:4]
+        queries.append(query)
+    return queries
+
+
+def make_typos(count: int, seed: int = 13):
+    """Полные слова из названий с одной опечаткой: пропуск, замена или перестановка букв"""
+    rng = random.Random(seed)
+    letters = 'абвгдеийклмнопрстуя'
+    queries = []
+    for _ in range(count):
+        word = rng.choice(TITLE_WORDS).lower()
+        pos = rng.randrange(1, len(word) - 1)
+        kind = rng.randrange(3)
+        if kind == 0:
+            word = word[:pos] + word[pos + 1:]
+        elif kind == 1:
+            word = word[:pos] + rng.choice(letters) + word[pos + 1:]
+        else:
+            word = word[:pos - 1] + word[pos] + word[pos - 1] + word[pos + 1:]
+        queries.append(word)
+    return queries
+
+
+def measure(search, queries, users: int, public: bool):
+    rng = random.Random(11)
+    latencies, found = [], 0
+    for query in queries:
+        start = time.perf_counter()
+        found += len(search(rng.randint(1, users), query, public))
+        latencies.append(time.perf_counter() - start)
+    return latencies, found / len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='100000,5000000', help='размеры таблицы через запятую')
+    parser.add_argument('--movies-per-user', type=int, default=100)
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    queries = make_queries(args.queries)
+    typos = make_typos(args.queries)
+    with tempfile.TemporaryDirectory() as tmp:
+        bot = load_bot(os.path.join(tmp, 'bot.db'))
+        print(f"{'rows':>9} {'scope':<8}{'engine':<6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'found':>8}")
+        for size in (int(value) for value in args.sizes.split(',')):
+            path = os.path.join(tmp, f'search_{size}.db')
+            database = bot.MovieDatabase(path, reader_connections=1)
+            users = max(1, size // args.movies_per_user)
+            populate(database.conn, users, args.movies_per_user)
+
+            for public in (False, True):
+                scope = 'public' if public else 'personal'
+                # Публичный LIKE на больших таблицах очень медленный, ограничиваем число запросов
+                like_queries = queries if not public or size <= 1_000_000 else queries[:20]
+                for engine, search, engine_queries in (
+                    ('like', database._search_movies_like, like_queries),
+                    ('fts', database.search_movies, queries),
+                    ('fuzzy', database.fuzzy_search_movies, typos),
+                ):
+                    latencies, found = measure(search, engine_queries, users, public)
+                    print(f"{size:>9} {scope:<8}{engine:<6}"
+                          f"{percentile(latencies, 50) * 1000:>10.2f}"
+                          f"{percentile(latencies, 95) * 1000:>10.2f}"
+                          f"{percentile(latencies, 99) * 1000:>10.2f}"
+                          f"{found:>8.1f}")
+            database.close()
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
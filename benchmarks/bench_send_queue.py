@@ -0,0 +1,87 @@
+"""Исходящие сообщения при всплеске: без планировщика против SendScheduler.
+
+Бот (MovieBot) отправляет сообщения в заглушку Bot API (fake_bot_api.py) с
+лимитами Telegram: одновременно --bulk фоновых сообщений (рассылка по --chats
+чатам, PRIORITY_BULK) и --interactive ответов пользователям, приходящих по
+одному каждые --interval секунд. before - без планировщика (как раньше: 429
+превращается в ошибку), after - с SendScheduler. Для каждой очереди выводятся
+доставленные сообщения, ошибки и задержка доставки.
+
+    python benchmarks/bench_send_queue.py --bulk 300 --interactive 60
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import load_bot, percentile  # noqa: E402
+from fake_bot_api import FakeBotAPI  # noqa: E402
+
+
+async def run(bot_module, limiter, args):
+    api = FakeBotAPI(global_rate=30, chat_rate=1, chat_burst=3)
+    base_url = await api.start()
+    bot = bot_module.MovieBot(
+        '1:BENCHMARK', base_url=base_url,
+        request=bot_module.HTTPXRequest(connection_pool_size=256), rate_limiter=limiter
+    )
+    await bot.initialize()
+    results = {'bulk': [], 'interactive': []}
+    errors = {'bulk': 0, 'interactive': 0}
+
+    async def send(lane, chat_id, text, priority):
+        start = time.perf_counter()
+        try:
+            if limiter is None:
+                await bot.send_message(chat_id, text)
+            else:
+                await bot.send_message(chat_id, text, rate_limit_args=priority)
+            results[lane].append(time.perf_counter() - start)
+        except bot_module.RetryAfter:
+            errors[lane] += 1
+
+    rng = random.Random(4)
+    start = time.perf_counter()
+    tasks = [asyncio.create_task(send('bulk', 1000 + index % args.chats, f'Рассылка {index}',
+                                      bot_module.PRIORITY_BULK))
+             for index in range(args.bulk)]
+    for index in range(args.interactive):
+        chat_id = rng.randint(1, 500)
+        tasks.append(asyncio.create_task(send('interactive', chat_id, f'Ответ {index}',
+                                              bot_module.PRIORITY_INTERACTIVE)))
+        await asyncio.sleep(args.interval)
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+
+    await bot.shutdown()
+    await api.stop()
+    return results, errors, elapsed, sum(api.rejected.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--bulk', type=int, default=300)
+    parser.add_argument('--chats', type=int, default=100, help='чатов в рассылке')
+    parser.add_argument('--interactive', type=int, default=60)
+    parser.add_argument('--interval', type=float, default=0.05)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bot = load_bot(os.path.join(tmp, 'bot.db'))
+        print(f"{'variant':<8}{'lane':<13}{'sent':>6}{'errors':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+              f"{'429':>6}{'total s':>9}")
+        for name, limiter in (('before', None), ('after', bot.SendScheduler())):
+            results, errors, elapsed, rejected = asyncio.run(run(bot, limiter, args))
+            for lane in ('interactive', 'bulk'):
+                latencies = results[lane] or [float('nan')]
+                print(f"{name:<8}{lane:<13}{len(results[lane]):>6}{errors[lane]:>8}"
+                      f"{percentile(latencies, 50) * 1000:>9.0f}{percentile(latencies, 95) * 1000:>9.0f}"
+                      f"{percentile(latencies, 99) * 1000:>9.0f}{rejected:>6}{elapsed:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""Ограничение частоты запросов: стоимость проверки и отсев "нажимающих без остановки".
+
+Первая часть - среднее время UserThrottle.check в наносекундах при --users
+отслеживаемых пользователях. Вторая - в реальном времени (--seconds) повторяет
+поток нажатий: один пользователь жмет "🎲 Другой фильм" и кнопки оценки
+--presses раз в секунду, обычные пользователи - раз в две секунды. before -
+сколько нажатий дошло бы до button_handler без ограничения, after - с ним.
+
+    python benchmarks/bench_throttle.py --seconds 5 --presses 30
+"""
+import os
+import sys
+import time
+import random
+import timeit
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import load_bot  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=10_000)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--presses', type=int, default=30, help='нажатий в секунду у "нажимающего"')
+    parser.add_argument('--normal-users', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bot = load_bot(os.path.join(tmp, 'bot.db'))
+
+        throttle = bot.UserThrottle(rate=1e9, burst=10**9)
+        user_ids = list(range(args.users))
+        for user_id in user_ids:
+            throttle.check(user_id)
+        rng = random.Random(1)
+        number = 200_000
+        cost = min(timeit.repeat(lambda: throttle.check(rng.choice(user_ids), '1x'),
+                                 number=number, repeat=3)) / number * 1e9
+        print(f"check(): {cost:.0f} нс при {args.users} пользователях")
+
+        throttle = bot.UserThrottle()
+        buttons = [bot.CB_RANDOM] * 3 + [bot.pack_callback(bot.OP_RATE, 1, rating) for rating in range(1, 11)]
+        sent = {'masher': 0, 'normal': 0}
+        passed = {'masher': 0, 'normal': 0}
+        interval = 1 / args.presses
+        next_normal = {user_id: rng.uniform(0, 2) for user_id in range(1, args.normal_users + 1)}
+        start = time.monotonic()
+        while (elapsed := time.monotonic() - start) < args.seconds:
+            sent['masher'] += 1
+            passed['masher'] += throttle.check(0, rng.choice(buttons)) is None
+            for user_id, due in next_normal.items():
+                if elapsed >= due:
+                    sent['normal'] += 1
+                    passed['normal'] += throttle.check(user_id, rng.choice(buttons)) is None
+                    next_normal[user_id] = due + 2
+            time.sleep(interval)
+
+        print(f"{'user':<8}{'before':>8}{'after':>8}{'after/s':>9}")
+        for name in ('masher', 'normal'):
+            print(f"{name:<8}{sent[name]:>8}{passed[name]:>8}{passed[name] / args.seconds:>9.1f}")
+        print(throttle.stats())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+"""Получение обновлений: долгий опрос (polling) против вебхука (WebhookServer).
+
+Заглушка Bot API (fake_bot_api.py) выдает --updates текстовых сообщений от
+--chats пользователей с частотой --rate в секунду (0 - все сразу); бот отвечает
+на каждое эхом. В режиме polling обновления забирает Updater через getUpdates,
+в режиме webhook их присылает "Telegram" - --connections одновременных
+соединений с секретным заголовком. --rtt - задержка ответа Bot API (и доставки
+вебхука в одну сторону - половина). Замеряется время от появления обновления до
+получения ответа заглушкой и итоговая пропускная способность.
+
+    python benchmarks/bench_webhook.py --updates 1000 --rtt 0.05
+    python benchmarks/bench_webhook.py --updates 500 --rate 50
+"""
+import os
+import sys
+import time
+import json
+import asyncio
+import logging
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import load_bot, percentile  # noqa: E402
+from fake_bot_api import FakeBotAPI  # noqa: E402
+
+
+def make_update(index: int, chat_id: int) -> dict:
+    return {'message': {
+        'message_id': index, 'date': int(time.time()), 'text': str(index),
+        'chat': {'id': chat_id, 'type': 'private'},
+        'from': {'id': chat_id, 'is_bot': False, 'first_name': f'Пользователь {chat_id}'},
+    }}
+
+
+async def run(bot_module, mode: str, args):
+    from telegram.ext import Application, MessageHandler, filters
+
+    api = FakeBotAPI(global_rate=1e9, chat_rate=1e9, chat_burst=10**9, latency=args.rtt)
+    base_url = await api.start()
+    application = (
+        Application.builder()
+        .bot(bot_module.MovieBot('1:BENCHMARK', base_url=base_url,
+                                 request=bot_module.HTTPXRequest(connection_pool_size=256)))
+        .update_queue(asyncio.Queue(maxsize=bot_module.UPDATE_QUEUE_SIZE))
+        .concurrent_updates(args.concurrency)
+        .build()
+    )
+
+    async def echo(update, context):
+        await update.message.reply_text(update.message.text)
+
+    application.add_handler(MessageHandler(filters.TEXT, echo))
+
+    created = {}
+    replied = {}
+    done = asyncio.Event()
+
+    def on_message(method, params):
+        if method == 'sendMessage':
+            replied[int(params['text'])] = time.perf_counter()
+            if len(replied) == args.updates:
+                done.set()
+
+    api.on_message = on_message
+    await application.initialize()
+    await application.start()
+
+    server = None
+    webhook_queue = asyncio.Queue()
+    if mode == 'polling':
+        await application.updater.start_polling(poll_interval=0, timeout=10)
+    else:
+        secret = 'benchmark-secret'
+        server = bot_module.WebhookServer(application, '/hook', secret)
+        port = await server.start('127.0.0.1', 0)
+
+    async def telegram_connection():
+        # "Telegram": одно соединение с вебхуком, следующее обновление - после ответа на предыдущее
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        while True:
+            body = await webhook_queue.get()
+            if body is None:
+                break
+            await asyncio.sleep(args.rtt / 2)
+            writer.write(f'POST /hook HTTP/1.1\r\nHost: bot\r\nContent-Type: application/json\r\n'
+                         f'{bot_module.WebhookServer.SECRET_HEADER}: {secret}\r\n'
+                         f'Content-Length: {len(body)}\r\n\r\n'.encode() + body)
+            status_line = await reader.readline()
+            assert b' 200 ' in status_line, status_line
+            length = 0
+            while (line := await reader.readline()) != b'\r\n':
+                if line.lower().startswith(b'content-length:'):
+                    length = int(line.split(b':')[1])
+            await reader.readexactly(length)
+        writer.close()
+
+    connections = [asyncio.create_task(telegram_connection())
+                   for _ in range(args.connections if mode == 'webhook' else 0)]
+
+    start = time.perf_counter()
+    for index in range(args.updates):
+        payload = make_update(index, 1 + index % args.chats)
+        created[index] = time.perf_counter()
+        if mode == 'polling':
+            api.push_update(payload)
+        else:
+            webhook_queue.put_nowait(json.dumps({**payload, 'update_id': index + 1}).encode())
+        if args.rate:
+            await asyncio.sleep(max(0.0, start + (index + 1) / args.rate - time.perf_counter()))
+    await asyncio.wait_for(done.wait(), timeout=300)
+    elapsed = time.perf_counter() - start
+
+    for _ in connections:
+        webhook_queue.put_nowait(None)
+    await asyncio.gather(*connections)
+    if mode == 'polling':
+        await application.updater.stop()
+    else:
+        await server.stop()
+    await application.stop()
+    await application.shutdown()
+    await api.stop()
+
+    latencies = [replied[index] - created[index] for index in created]
+    return latencies, elapsed, api.requests['getUpdates']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--updates', type=int, default=1000)
+    parser.add_argument('--chats', type=int, default=200)
+    parser.add_argument('--rate', type=float, default=0, help='обновлений в секунду (0 - все сразу)')
+    parser.add_argument('--rtt', type=float, default=0.05, help='задержка ответа Bot API, секунды')
+    parser.add_argument('--connections', type=int, default=40, help='соединений вебхука (max_connections)')
+    parser.add_argument('--concurrency', type=int, default=64, help='concurrent_updates приложения')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bot = load_bot(os.path.join(tmp, 'bot.db'))
+        # Журнал каждого HTTP-запроса искажает замеры
+        for name in ('httpx', 'telegram', 'apscheduler'):
+            logging.getLogger(name).setLevel(logging.WARNING)
+        print(f"{'mode':<9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'updates/s':>11}{'getUpdates':>12}")
+        for mode in ('polling', 'webhook'):
+            latencies, elapsed, polls = asyncio.run(run(bot, mode, args))
+            print(f"{mode:<9}{percentile(latencies, 50) * 1000:>9.0f}{percentile(latencies, 95) * 1000:>9.0f}"
+                  f"{percentile(latencies, 99) * 1000:>9.0f}{len(latencies) / elapsed:>11.0f}{polls:>12}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""Общие функции для бенчмарков бота.
+
+Бенчмарки запускаются из корня репозитория, например:
+    python benchmarks/bench_async_db.py
+"""
+import os
+import sys
+import random
+import logging
+import importlib
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+GENRES = ['драма', 'комедия', 'фантастика', 'триллер', 'ужасы', 'боевик',
+          'мультфильм', 'детектив', 'мелодрама', 'документальный']
+TITLE_WORDS = ['Матрица', 'Интерстеллар', 'Начало', 'Брат', 'Остров', 'Ночь',
+               'Город', 'Дорога', 'Звезда', 'Тень', 'Море', 'Война', 'Мир',
+               'Сталкер', 'Солярис', 'Зеркало', 'Легенда', 'Побег', 'Игра', 'Время']
+
+
+def load_bot(db_path: str):
+    """Импорт movie_bot с базой данных по указанному пути"""
+    os.environ.setdefault('BOT_TOKEN', '123456:BENCHMARK')
+    os.environ['DB_NAME'] = db_path
+    if ROOT_DIR not in sys.path:
+        sys.path.insert(0, ROOT_DIR)
+    module = importlib.import_module('movie_bot')
+    # Логи о каждом добавленном фильме искажают замеры
+    logging.getLogger('movie_bot').setLevel(logging.WARNING)
+    return module
+
+
+def make_title(rng: random.Random, index: int) -> str:
+    """Генерация названия фильма"""
+    return f"{rng.choice(TITLE_WORDS)} {rng.choice(TITLE_WORDS).lower()} {index}"
+
+
+def populate(conn, users: int, movies_per_user: int, seed: int = 0, batch: int = 50000):
+    """Быстрое заполнение таблиц пользователей и фильмов"""
+    rng = random.Random(seed)
+    conn.executemany(
+        'INSERT OR IGNORE INTO users (user_id, username, first_name) VALUES (?, ?, ?)',
+        [(user_id, f'user{user_id}', f'Пользователь {user_id}') for user_id in range(1, users + 1)]
+    )
+    rows = []
+    index = 0
+    for user_id in range(1, users + 1):
+        for _ in range(movies_per_user):
+            index += 1
+            watched = rng.random() < 0.4
+            rows.append((
+                user_id, make_title(rng, index), rng.choice(GENRES), rng.randint(1950, 2024),
+                rng.randint(1, 10) if watched else None,
+                'watched' if watched else 'want_to_watch',
+                1 if rng.random() < 0.8 else 0, rng.randint(1, 5)
+            ))
+            if len(rows) >= batch:
+                _insert_movies(conn, rows)
+                rows = []
+    if rows:
+        _insert_movies(conn, rows)
+    conn.commit()
+
+
+def _insert_movies(conn, rows):
+    conn.executemany('''
+        INSERT OR IGNORE INTO movies (user_id, title, genre, year, rating, status, is_public, priority)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', rows)
+
+
+def percentile(values, p: float) -> float:
+    """Перцентиль по методу ближайшего ранга"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
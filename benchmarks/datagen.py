@@ -0,0 +1,229 @@
+"""Детерминированный генератор синтетической базы фильмов с реалистичным перекосом.
+
+В отличие от common.populate (равномерные жанры, одинаковые списки), данные
+похожи на настоящие:
+  - названия - кириллица (в том числе с "ё", продолжения "Брат 2"), выбираются
+    из каталога по закону Ципфа: популярные фильмы есть в списках у многих;
+  - жанры тоже по Ципфу, у части фильмов жанр не указан;
+  - размер списка пользователя - распределение Парето (в среднем ~50 фильмов),
+    а --power-share строк принадлежит "активным" пользователям по --power-size
+    (10 000) фильмов;
+  - год, оценки, приоритет, видимость и даты добавления/просмотра.
+Одинаковые --rows и --seed всегда дают одну и ту же базу.
+
+    python benchmarks/datagen.py --rows 1000000 --out /tmp/movies_1m.db
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import itertools
+from collections import Counter
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import load_bot  # noqa: E402
+
+# Меняется при любом изменении генератора: по ней бенчмарки понимают, что сохраненная база устарела
+DATAGEN_VERSION = 1
+
+# Жанры в порядке популярности (вес по Ципфу - по месту в списке)
+GENRES_BY_POPULARITY = [
+    'драма', 'комедия', 'боевик', 'триллер', 'фантастика', 'мелодрама', 'ужасы',
+    'детектив', 'мультфильм', 'приключения', 'криминал', 'фэнтези', 'военный',
+    'научная фантастика', 'документальный', 'биография', 'исторический', 'мюзикл',
+    'вестерн', 'аниме', 'семейный', 'спорт', 'нуар', 'артхаус',
+]
+NOUNS = [
+    'Брат', 'Матрица', 'Сталкер', 'Солярис', 'Зеркало', 'Остров', 'Город', 'Дорога',
+    'Звезда', 'Тень', 'Море', 'Война', 'Мир', 'Легенда', 'Побег', 'Игра', 'Время',
+    'Ночь', 'Ёлка', 'Лёд', 'Экипаж', 'Притяжение', 'Движение', 'Метро', 'Кочегар',
+    'Левиафан', 'Возвращение', 'Елена', 'Изгнание', 'Дурак', 'Жмурки', 'Бумер',
+    'Географ', 'Стиляги', 'Адмирал', 'Викинг', 'Союз', 'Салют', 'Вызов', 'Сердце',
+    'Орда', 'Царь', 'Поп', 'Майор', 'Холоп', 'Пассажир', 'Наследник', 'Колония',
+    'Граница', 'Пустыня', 'Гроза', 'Ветер', 'Осень', 'Весна', 'Зима', 'Лето',
+    'Берег', 'Маяк', 'Поезд', 'Самолёт', 'Капитан', 'Шпион', 'Доктор', 'Учитель',
+]
+ADJECTIVES = [
+    'Белый', 'Чёрный', 'Красный', 'Зелёный', 'Последний', 'Первый', 'Тёмный', 'Светлый',
+    'Далёкий', 'Тихий', 'Холодный', 'Горячий', 'Большой', 'Маленький', 'Старый', 'Новый',
+    'Золотой', 'Серебряный', 'Железный', 'Ледяной', 'Огненный', 'Забытый', 'Потерянный',
+    'Северный', 'Южный', 'Великий', 'Странный', 'Вечный', 'Одинокий', 'Счастливый',
+    'Безумный', 'Стальной', 'Небесный', 'Морской', 'Лесной', 'Ночной',
+]
+NOTES = [
+    'Посоветовал друг', 'Смотреть с семьей', 'Пересмотреть', 'Говорят, шедевр',
+    'Есть в онлайн-кинотеатре', 'После книги', 'На выходные', 'Режиссерская версия',
+]
+
+
+class ZipfSampler:
+    """Выбор номера 0..n-1 с вероятностью, пропорциональной 1 / (номер + 1) ** exponent"""
+
+    def __init__(self, n: int, exponent: float = 1.0):
+        self.n = n
+        self.cum_weights = list(itertools.accumulate(1 / (rank + 1) ** exponent for rank in range(n)))
+        self.population = range(n)
+
+    def sample(self, rng: random.Random, k: int = 1) -> list:
+        return rng.choices(self.population, cum_weights=self.cum_weights, k=k)
+
+
+def make_catalog(size: int, seed: int = 0) -> list:
+    """Каталог из size разных названий; место в списке - популярность"""
+    rng = random.Random(f'catalog-{seed}')
+    catalog = []
+    seen = set()
+    while len(catalog) < size:
+        kind = rng.random()
+        if kind < 0.15:
+            title = rng.choice(NOUNS)
+        elif kind < 0.5:
+            title = f"{rng.choice(ADJECTIVES)} {rng.choice(NOUNS).lower()}"
+        elif kind < 0.7:
+            title = f"{rng.choice(NOUNS)} и {rng.choice(NOUNS).lower()}"
+        elif kind < 0.9:
+            title = f"{rng.choice(NOUNS)}: {rng.choice(ADJECTIVES).lower()} {rng.choice(NOUNS).lower()}"
+        else:
+            title = f"{rng.choice(ADJECTIVES)} {rng.choice(NOUNS).lower()} {rng.choice(NOUNS).lower()}"
+        # Повтор - продолжение: "Брат", "Брат 2", "Брат 3"...
+        base, part = title, 1
+        while title in seen:
+            part += 1
+            title = f"{base} {part}"
+        seen.add(title)
+        catalog.append(title)
+    return catalog
+
+
+class Dataset:
+    """Синтетическая база на rows фильмов.
+
+    Пользователи с ID 1..power_users - "активные" (по power_size фильмов),
+    остальные - обычные. Все случайные величины зависят только от seed.
+    """
+
+    def __init__(self, rows: int, seed: int = 0, zipf: float = 1.0,
+                 power_share: float = 0.1, power_size: int = 10_000):
+        self.rows = rows
+        self.seed = seed
+        self.catalog = make_catalog(min(1_000_000, max(50_000, rows // 4)), seed)
+        self.titles = ZipfSampler(len(self.catalog), zipf)
+        self.genres = ZipfSampler(len(GENRES_BY_POPULARITY), 1.1)
+
+        rng = random.Random(f'users-{seed}')
+        power_size = min(power_size, max(1, int(rows * power_share)))
+        self.power_users = int(rows * power_share) // power_size
+        self.list_sizes = [power_size] * self.power_users
+        remaining = rows - sum(self.list_sizes)
+        while remaining > 0:
+            size = min(remaining, 2000, int(rng.paretovariate(1.2) * 8))
+            self.list_sizes.append(size)
+            remaining -= size
+        self.users = len(self.list_sizes)
+
+    def user_ids(self, power: bool) -> range:
+        return range(1, self.power_users + 1) if power else range(self.power_users + 1, self.users + 1)
+
+    def title(self, rng: random.Random) -> str:
+        return self.catalog[self.titles.sample(rng)[0]]
+
+    def genre(self, rng: random.Random) -> str:
+        return GENRES_BY_POPULARITY[self.genres.sample(rng)[0]]
+
+    def _user_movies(self, rng: random.Random, size: int, start: datetime) -> list:
+        """Фильмы одного пользователя в порядке BATCH_COLUMNS"""
+        titles = []
+        seen = set()
+        # Длинный хвост каталога почти не повторяется, так что повторные выборки редки
+        while len(titles) < size:
+            for index in self.titles.sample(rng, size - len(titles)):
+                if index not in seen:
+                    seen.add(index)
+                    titles.append(self.catalog[index])
+
+        movies = []
+        added = start
+        for title in titles:
+            added += timedelta(seconds=rng.randint(60, 3 * 86400))
+            watched = rng.random() < 0.4
+            rating = rng.choices(range(1, 11), weights=(1, 1, 2, 3, 5, 8, 12, 12, 8, 5))[0] \
+                if watched and rng.random() < 0.85 else None
+            year = max(1920, 2025 - int(rng.expovariate(1 / 15)))
+            movies.append((
+                title,
+                self.genre(rng) if rng.random() < 0.85 else None,
+                year if rng.random() < 0.7 else None,
+                rating,
+                'watched' if watched else 'want_to_watch',
+                1 if rng.random() < 0.8 else 0,
+                rng.choices(range(1, 6), weights=(1, 2, 6, 2, 1))[0],
+                rng.choice(NOTES) if rng.random() < 0.05 else None,
+                added.strftime('%Y-%m-%d %H:%M:%S'),
+                (added + timedelta(days=rng.randint(1, 60))).strftime('%Y-%m-%d %H:%M:%S') if watched else None,
+            ))
+        return movies
+
+    def populate(self, database) -> int:
+        """Заполнение MovieDatabase: возвращает число добавленных фильмов"""
+        rng = random.Random(f'movies-{self.seed}')
+        database.conn.executemany(
+            'INSERT OR IGNORE INTO users (user_id, username, first_name) VALUES (?, ?, ?)',
+            [(user_id, f'user{user_id}', f'Пользователь {user_id}') for user_id in range(1, self.users + 1)]
+        )
+        database.conn.commit()
+        epoch = datetime(2022, 1, 1)
+        added = 0
+        for user_id, size in enumerate(self.list_sizes, 1):
+            start = epoch + timedelta(days=rng.randint(0, 365))
+            added += max(0, database.add_movies_batch(user_id, self._user_movies(rng, size, start)))
+        return added
+
+
+def describe(conn) -> dict:
+    """Показатели перекоса готовой базы"""
+    total = conn.execute('SELECT COUNT(*) FROM movies').fetchone()[0]
+    sizes = sorted((row[0] for row in conn.execute('SELECT COUNT(*) FROM movies GROUP BY user_id')),
+                   reverse=True)
+    genres = Counter(dict(conn.execute('SELECT genre, COUNT(*) FROM movies WHERE genre IS NOT NULL GROUP BY genre')))
+    top_title = conn.execute('SELECT title, COUNT(*) AS n FROM movies GROUP BY title ORDER BY n DESC LIMIT 1').fetchone()
+    return {
+        'rows': total,
+        'users': len(sizes),
+        'max_list': sizes[0] if sizes else 0,
+        'median_list': sizes[len(sizes) // 2] if sizes else 0,
+        'top_genre': genres.most_common(1)[0] if genres else None,
+        'top_genre_share': round(genres.most_common(1)[0][1] / total, 3) if genres else 0.0,
+        'top_title': tuple(top_title) if top_title else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--zipf', type=float, default=1.0, help='показатель закона Ципфа для названий')
+    parser.add_argument('--power-share', type=float, default=0.1, help='доля строк активных пользователей')
+    parser.add_argument('--power-size', type=int, default=10_000, help='фильмов у активного пользователя')
+    parser.add_argument('--out', required=True, help='файл базы данных (перезаписывается)')
+    args = parser.parse_args()
+
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(args.out + suffix):
+            os.remove(args.out + suffix)
+    with tempfile.TemporaryDirectory() as tmp:
+        bot = load_bot(os.path.join(tmp, 'bot.db'))
+        database = bot.MovieDatabase(args.out, reader_connections=0, movie_cache_bytes=0)
+        start = time.perf_counter()
+        dataset = Dataset(args.rows, args.seed, args.zipf, args.power_share, args.power_size)
+        added = dataset.populate(database)
+        print(f"{added} фильмов, {dataset.users} пользователей ({dataset.power_users} активных) "
+              f"за {time.perf_counter() - start:.1f} с")
+        print(describe(database.conn))
+        database.close()
+
+
+if __name__ == '__main__':
+    main()
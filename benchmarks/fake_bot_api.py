@@ -0,0 +1,211 @@
+"""Заглушка Bot API: локальный HTTP-сервер с лимитами сообщений Telegram.
+
+Отвечает на методы, которыми пользуется бот (getMe, getUpdates, sendMessage,
+editMessageText, answerCallbackQuery, sendDocument и т.д.), и, как Telegram,
+возвращает 429 с retry_after при превышении общего лимита и лимита чата.
+Обновления для бота добавляются push_update и выдаются долгим опросом getUpdates.
+Используется бенчмарками через FakeBotAPI; отдельным процессом позволяет
+запустить самого бота без выхода в интернет:
+
+    python benchmarks/fake_bot_api.py --port 8081
+    BOT_TOKEN=1:TEST BOT_API_BASE_URL=http://127.0.0.1:8081/bot python movie_bot.py
+"""
+import json
+import time
+import asyncio
+import argparse
+from collections import Counter
+from email.parser import BytesParser
+from email import policy
+from urllib.parse import parse_qs
+
+# Методы, на которые распространяются лимиты сообщений
+LIMITED_METHODS = frozenset({
+    'sendMessage', 'editMessageText', 'editMessageReplyMarkup', 'editMessageCaption',
+    'sendDocument', 'sendPhoto', 'copyMessage', 'forwardMessage',
+})
+
+
+class FakeBotAPI:
+    """Сервер-заглушка Bot API с лимитами: global_rate сообщений в секунду всего,
+    chat_rate в секунду в один чат (с запасом chat_burst); latency - задержка ответа
+    (время его доставки боту)"""
+
+    def __init__(self, global_rate: float = 30, chat_rate: float = 1, chat_burst: int = 3,
+                 latency: float = 0.0, retry_after: int = 1):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.latency = latency
+        self.retry_after = retry_after
+        self._global = [float(global_rate), time.monotonic()]
+        self._chats = {}
+        self._message_id = 0
+        self._server = None
+        # Обновления для getUpdates (push_update) и вызов on_message(method, params)
+        # на каждое доставленное сообщение - для замеров задержки ответа
+        self._updates = []
+        self._next_update_id = 1
+        self._updates_ready = asyncio.Event()
+        self.on_message = None
+        self.requests = Counter()
+        self.rejected = Counter()
+        self.messages_per_chat = Counter()
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        """Запуск сервера; возвращает base_url для бота"""
+        self._server = await asyncio.start_server(self._serve, host, port)
+        port = self._server.sockets[0].getsockname()[1]
+        return f'http://{host}:{port}/bot'
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    def push_update(self, update: dict) -> int:
+        """Новое обновление для getUpdates; возвращает его update_id"""
+        update_id = self._next_update_id
+        self._next_update_id += 1
+        self._updates.append({**update, 'update_id': update_id})
+        self._updates_ready.set()
+        return update_id
+
+    async def _get_updates(self, params: dict) -> list:
+        """Долгий опрос: подтвержденные (update_id < offset) удаляются, новые ждутся до timeout"""
+        offset = int(params.get('offset', 0))
+        self._updates = [update for update in self._updates if update['update_id'] >= offset]
+        if not self._updates:
+            self._updates_ready.clear()
+            try:
+                await asyncio.wait_for(self._updates_ready.wait(), float(params.get('timeout', 0)))
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:int(params.get('limit', 100))]
+
+    @staticmethod
+    def _take(bucket, rate: float, burst: float) -> bool:
+        now = time.monotonic()
+        bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+        if bucket[0] < 1:
+            return False
+        bucket[0] -= 1
+        return True
+
+    def _allowed(self, chat_id) -> bool:
+        if not self._take(self._global, self.global_rate, self.global_rate):
+            return False
+        if chat_id is None:
+            return True
+        bucket = self._chats.setdefault(chat_id, [float(self.chat_burst), time.monotonic()])
+        return self._take(bucket, self.chat_rate, self.chat_burst)
+
+    def _message(self, params: dict) -> dict:
+        self._message_id += 1
+        chat_id = int(params.get('chat_id', 0))
+        message = {
+            'message_id': int(params.get('message_id', self._message_id)),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private' if chat_id > 0 else 'group'},
+        }
+        if 'text' in params:
+            message['text'] = params['text']
+        return message
+
+    async def call(self, method: str, params: dict):
+        """Ответ на вызов метода: (HTTP-статус, тело ответа)"""
+        self.requests[method] += 1
+        status, payload = await self._call(method, params)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return status, payload
+
+    async def _call(self, method: str, params: dict):
+        if method in LIMITED_METHODS:
+            chat_id = params.get('chat_id')
+            if not self._allowed(chat_id):
+                self.rejected[method] += 1
+                return 429, {
+                    'ok': False, 'error_code': 429,
+                    'description': f'Too Many Requests: retry after {self.retry_after}',
+                    'parameters': {'retry_after': self.retry_after},
+                }
+            self.messages_per_chat[chat_id] += 1
+            if self.on_message is not None:
+                self.on_message(method, params)
+
+        if method == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'Fake', 'username': 'fake_bot',
+                      'can_join_groups': False, 'can_read_all_group_messages': False,
+                      'supports_inline_queries': False}
+        elif method == 'getUpdates':
+            result = await self._get_updates(params)
+        elif method in ('sendMessage', 'editMessageText', 'editMessageReplyMarkup', 'editMessageCaption'):
+            result = self._message(params)
+        elif method == 'sendDocument':
+            result = {**self._message(params),
+                      'document': {'file_id': f'doc{self._message_id}', 'file_unique_id': f'u{self._message_id}'}}
+        else:
+            result = True
+        return 200, {'ok': True, 'result': result}
+
+    @staticmethod
+    def _parse_body(content_type: str, body: bytes) -> dict:
+        if content_type.startswith('multipart/form-data'):
+            message = BytesParser(policy=policy.HTTP).parsebytes(
+                b'Content-Type: ' + content_type.encode() + b'\r\n\r\n' + body)
+            params = {}
+            for part in message.iter_parts():
+                if part.get_filename() is None:
+                    params[part.get_param('name', header='content-disposition')] = part.get_content()
+            return params
+        if content_type.startswith('application/json'):
+            return json.loads(body or b'{}')
+        return {key: values[0] for key, values in parse_qs(body.decode()).items()}
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                _, path, _ = request_line.decode().split(' ', 2)
+                headers = {}
+                while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    name, _, value = line.decode().partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                params = self._parse_body(headers.get('content-type', ''), body)
+                status, payload = await self.call(path.rsplit('/', 1)[-1], params)
+                data = json.dumps(payload).encode()
+                writer.write(f'HTTP/1.1 {status} {"OK" if status == 200 else "Too Many Requests"}\r\n'
+                             f'Content-Type: application/json\r\nContent-Length: {len(data)}\r\n\r\n'.encode()
+                             + data)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            # CancelledError - остановка сервера во время долгого опроса
+            pass
+        finally:
+            writer.close()
+
+
+async def serve_forever(port: int):
+    api = FakeBotAPI()
+    base_url = await api.start(port=port)
+    print(f"Заглушка Bot API: {base_url}")
+    await asyncio.Event().wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8081)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve_forever(args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
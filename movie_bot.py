@@ -1,16 +1,45 @@
 import os
+import re
+import io
 import sys
+import csv
+import gzip
+import json
+import asyncio
+import bisect
+import functools
+import heapq
+import hmac
+import inspect
 import logging
 import sqlite3
-from datetime import datetime
-from typing import Optional, List, Dict, Tuple
+import time
+import queue
+import random
+import secrets
+import shutil
+import signal
+import tempfile
+import threading
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Optional, List, Dict, Tuple, Callable, Iterator
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import RetryAfter
+from telegram.request import HTTPXRequest
 from telegram.ext import (
     Application,
     CommandHandler,
     MessageHandler,
     CallbackQueryHandler,
+    TypeHandler,
+    ApplicationHandlerStop,
     ContextTypes,
+    ExtBot,
+    BaseRateLimiter,
     filters
 )
 
@@ -22,7 +51,78 @@ if not TOKEN:
     print("Пожалуйста, установите BOT_TOKEN на Render.com в разделе Environment")
     sys.exit(1)
 
-DB_NAME = 'movies.db'
+DB_NAME = os.environ.get('DB_NAME', 'movies.db')
+# Количество потоков-читателей базы данных (писатель всегда один)
+DB_READER_THREADS = int(os.environ.get('DB_READER_THREADS', '4'))
+# Буфер активности: период сброса (секунды) и размер, при котором сброс выполняется досрочно
+ACTIVITY_FLUSH_INTERVAL = float(os.environ.get('ACTIVITY_FLUSH_INTERVAL', '30'))
+ACTIVITY_BUFFER_SIZE = int(os.environ.get('ACTIVITY_BUFFER_SIZE', '1000'))
+# Профиль настроек SQLite (см. PRAGMA_PROFILES)
+DB_PRAGMA_PROFILE = os.environ.get('DB_PRAGMA_PROFILE', 'balanced')
+# Период сверки глобальной статистики с таблицей фильмов (секунды)
+STATS_RECONCILE_INTERVAL = float(os.environ.get('STATS_RECONCILE_INTERVAL', '3600'))
+# Администраторы бота (ID через запятую)
+ADMIN_IDS = {int(user_id) for user_id in os.environ.get('ADMIN_IDS', '').split(',') if user_id.strip()}
+# Предельный объем кэша готовых экранов (байты)
+RENDER_CACHE_MAX_BYTES = int(os.environ.get('RENDER_CACHE_MAX_BYTES', str(4 * 1024 * 1024)))
+# Бюджет времени нечеткого поиска по названиям (миллисекунды)
+FUZZY_SEARCH_BUDGET_MS = float(os.environ.get('FUZZY_SEARCH_BUDGET_MS', '50'))
+# Предельный объем кэша фильмов пользователей (байты, 0 - кэш выключен)
+MOVIE_CACHE_MAX_BYTES = int(os.environ.get('MOVIE_CACHE_MAX_BYTES', str(8 * 1024 * 1024)))
+# Период проверки изменений базы другими процессами (PRAGMA data_version), секунды; 0 - не проверять
+DATA_VERSION_CHECK_INTERVAL = float(os.environ.get('DATA_VERSION_CHECK_INTERVAL', '1'))
+# Импорт списков: предельный размер файла (Bot API отдает ботам файлы до 20 МБ),
+# фильмов в одной транзакции и период обновления сообщения о ходе импорта (секунды)
+IMPORT_MAX_BYTES = int(os.environ.get('IMPORT_MAX_BYTES', str(20 * 1024 * 1024)))
+IMPORT_CHUNK_ROWS = int(os.environ.get('IMPORT_CHUNK_ROWS', '2000'))
+IMPORT_PROGRESS_INTERVAL = float(os.environ.get('IMPORT_PROGRESS_INTERVAL', '2'))
+# Экспорт: предельный размер отправляемого файла (Bot API принимает от ботов файлы до 50 МБ)
+EXPORT_MAX_UPLOAD_BYTES = int(os.environ.get('EXPORT_MAX_UPLOAD_BYTES', str(50 * 1024 * 1024)))
+# Ограничение частоты запросов пользователя: запросов в секунду и запас на короткий всплеск
+# (0 - без ограничения), окно отсева повторных нажатий одной и той же кнопки (секунды, 0 - не отсеивать)
+USER_RATE_LIMIT = float(os.environ.get('USER_RATE_LIMIT', '2'))
+USER_RATE_BURST = int(os.environ.get('USER_RATE_BURST', '6'))
+CALLBACK_DEBOUNCE_SECONDS = float(os.environ.get('CALLBACK_DEBOUNCE_SECONDS', '1'))
+# Адрес Bot API (для локального сервера Bot API или заглушки в бенчмарках)
+BOT_API_BASE_URL = os.environ.get('BOT_API_BASE_URL', 'https://api.telegram.org/bot')
+BOT_API_BASE_FILE_URL = os.environ.get('BOT_API_BASE_FILE_URL', 'https://api.telegram.org/file/bot')
+# Лимиты исходящих сообщений Telegram: всего в секунду, в один чат в секунду (с запасом на
+# короткий всплеск), в одну группу в минуту; повторов запроса после ответа 429 (RetryAfter)
+TELEGRAM_GLOBAL_RATE = float(os.environ.get('TELEGRAM_GLOBAL_RATE', '30'))
+TELEGRAM_CHAT_RATE = float(os.environ.get('TELEGRAM_CHAT_RATE', '1'))
+TELEGRAM_CHAT_BURST = int(os.environ.get('TELEGRAM_CHAT_BURST', '3'))
+TELEGRAM_GROUP_RATE_PER_MINUTE = float(os.environ.get('TELEGRAM_GROUP_RATE_PER_MINUTE', '20'))
+TELEGRAM_MAX_RETRIES = int(os.environ.get('TELEGRAM_MAX_RETRIES', '3'))
+# Получение обновлений: polling (getUpdates) или webhook - Telegram сам присылает обновления на
+# WEBHOOK_URL, бот слушает WEBHOOK_LISTEN:WEBHOOK_PORT (на Render.com порт задается в PORT)
+BOT_MODE = os.environ.get('BOT_MODE', 'polling')
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL', '')
+WEBHOOK_LISTEN = os.environ.get('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.environ.get('WEBHOOK_PORT', os.environ.get('PORT', '8443')))
+# Секрет из заголовка X-Telegram-Bot-Api-Secret-Token (пусто - случайный при каждом запуске)
+WEBHOOK_SECRET_TOKEN = os.environ.get('WEBHOOK_SECRET_TOKEN', '')
+# Одновременных соединений Telegram с вебхуком (1-100)
+WEBHOOK_MAX_CONNECTIONS = int(os.environ.get('WEBHOOK_MAX_CONNECTIONS', '40'))
+# Очередь полученных обновлений: предельный размер и сколько вебхук ждет места в ней,
+# прежде чем ответить 503 (Telegram повторит доставку позже), секунды
+UPDATE_QUEUE_SIZE = int(os.environ.get('UPDATE_QUEUE_SIZE', '1000'))
+WEBHOOK_ENQUEUE_TIMEOUT = float(os.environ.get('WEBHOOK_ENQUEUE_TIMEOUT', '2'))
+# Соединение вебхука закрывается, если клиент дольше WEBHOOK_IDLE_TIMEOUT не начинает запрос
+# или дольше WEBHOOK_READ_TIMEOUT передает заголовки либо тело запроса, секунды
+WEBHOOK_IDLE_TIMEOUT = float(os.environ.get('WEBHOOK_IDLE_TIMEOUT', '60'))
+WEBHOOK_READ_TIMEOUT = float(os.environ.get('WEBHOOK_READ_TIMEOUT', '10'))
+# Обновлений, обрабатываемых одновременно (1 - строго по очереди)
+CONCURRENT_UPDATES = int(os.environ.get('CONCURRENT_UPDATES', '1'))
+# Метрики в формате Prometheus: адрес и порт HTTP-сервера (GET /metrics, 0 - сервер не запускается)
+# и период замера задержки цикла событий (секунды)
+METRICS_LISTEN = os.environ.get('METRICS_LISTEN', '127.0.0.1')
+METRICS_PORT = int(os.environ.get('METRICS_PORT', '0'))
+LOOP_LAG_INTERVAL = float(os.environ.get('LOOP_LAG_INTERVAL', '1'))
+# Журнал медленных запросов SQLite: порог времени запроса (миллисекунды, 0 - журнал выключен).
+# QUERY_PLAN_STRICT=1 - проверять план каждого запроса частых методов и считать ошибкой
+# полный просмотр таблицы movies (для тестов и бенчмарков, не для работы бота)
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', '100'))
+QUERY_PLAN_STRICT = os.environ.get('QUERY_PLAN_STRICT', '') == '1'
 # ==================================
 
 # Настройка логирования
@@ -34,14 +134,340 @@ logger = logging.getLogger(__name__)
 
 
 # ========== КЛАСС ДЛЯ РАБОТЫ С БАЗОЙ ДАННЫХ ==========
+# Профили настроек SQLite. legacy - прежний режим (rollback journal), оставлен для сравнения
+PRAGMA_PROFILES = {
+    'legacy': {
+        'journal_mode': 'DELETE', 'synchronous': 'FULL', 'cache_size': -2000,
+        'mmap_size': 0, 'temp_store': 'DEFAULT', 'busy_timeout': 5000,
+    },
+    'safe': {
+        'journal_mode': 'WAL', 'synchronous': 'FULL', 'cache_size': -16000,
+        'mmap_size': 0, 'temp_store': 'DEFAULT', 'busy_timeout': 5000,
+    },
+    'balanced': {
+        'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'cache_size': -64000,
+        'mmap_size': 268435456, 'temp_store': 'MEMORY', 'busy_timeout': 5000,
+    },
+    'fast': {
+        'journal_mode': 'WAL', 'synchronous': 'OFF', 'cache_size': -256000,
+        'mmap_size': 1073741824, 'temp_store': 'MEMORY', 'busy_timeout': 10000,
+    },
+}
+
+
+class LRUCache:
+    """Кэш с вытеснением давно не использованных записей при превышении лимита объема"""
+    
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, key, is_valid: Callable = None):
+        """Значение по ключу или None; запись, не прошедшая проверку is_valid, удаляется"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and is_valid is not None and not is_valid(entry[0]):
+                self._remove(key)
+                entry = None
+            
+            if entry is None:
+                self.misses += 1
+                return None
+            
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+    
+    def put(self, key, value, size: int):
+        """Сохранение значения размером size байт"""
+        with self._lock:
+            self._remove(key)
+            if size > self.max_bytes:
+                return
+            
+            self._entries[key] = (value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+    
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+    
+    def stats(self) -> Dict:
+        """Счетчики кэша"""
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self.bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+
+class QueryPlanError(RuntimeError):
+    """Запрос частого метода выполняется полным просмотром таблицы movies (QUERY_PLAN_STRICT)"""
+
+
+class QueryLog:
+    """Журнал медленных запросов SQLite и проверка их планов.
+
+    Обратный вызов set_trace_callback отмечает время начала каждого запроса
+    подключения. Внутри окна begin() / finish() (вызов метода MovieDatabase
+    через timed_call) время запроса - промежуток до начала следующего запроса
+    или до конца метода. Запросы дольше threshold_ms записываются в журнал
+    вместе с EXPLAIN QUERY PLAN; полный просмотр таблицы movies (SCAN без
+    индекса) и сортировка во временном B-дереве отмечаются отдельно.
+
+    В строгом режиме план каждого запроса методов из HOT_METHODS проверяется
+    (один раз на вид запроса), и полный просмотр movies вызывает QueryPlanError.
+    """
+    
+    # Методы, вызываемые на каждое действие пользователя: полный просмотр в них - регрессия
+    HOT_METHODS = frozenset({
+        'get_user_movies', 'get_movies_overview', 'get_movie_by_id', 'get_public_movies',
+        'get_random_movie', 'search_movies', 'fuzzy_search_movies', 'get_user_stats',
+        'get_user_genres', 'get_global_stats', 'get_top_genres', 'add_movie', 'update_movie',
+        'mark_as_watched', 'delete_movie', 'toggle_movie_privacy', 'get_public_version',
+        'get_top_rated_movies',
+    })
+    # Сколько запросов запоминается за один вызов метода и сколько видов запросов - в строгом режиме
+    MAX_STATEMENTS = 256
+    MAX_PLANS = 1024
+    # Литералы в тексте запроса: по тексту без них запросы объединяются в виды
+    LITERAL_PATTERN = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+    # Таблица movies (но не movies_fts и другие таблицы поиска) и ее псевдоним в тексте запроса ("FROM movies m", "JOIN movies AS m")
+    MOVIES_PATTERN = re.compile(r'\bmovies\b')
+    MOVIES_ALIAS_PATTERN = re.compile(r'\bmovies\s+(?:AS\s+)?([A-Za-z_]\w*)', re.IGNORECASE)
+    CHECKED_STATEMENTS = frozenset({'SELECT', 'UPDATE', 'DELETE', 'INSERT', 'WITH'})
+    FULL_SCAN = 'полный просмотр movies'
+    SQL_KEYWORDS = frozenset({'WHERE', 'JOIN', 'LEFT', 'INNER', 'CROSS', 'ON', 'ORDER', 'GROUP',
+                              'LIMIT', 'SET', 'VALUES', 'RETURNING', 'UNION', 'AND', 'OR', 'AS'})
+    
+    def __init__(self, explain: Callable[[str], List[str]], threshold_ms: float = SLOW_QUERY_MS,
+                 strict: bool = QUERY_PLAN_STRICT):
+        self.explain = explain
+        self.threshold = threshold_ms / 1000
+        self.strict = strict
+        self._local = threading.local()
+        self._plans: OrderedDict = OrderedDict()
+        self._plans_lock = threading.Lock()
+        self.slow_queries = 0
+        self.full_scans = 0
+    
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0 or self.strict
+    
+    def instrument(self, conn: sqlite3.Connection):
+        """Отметки начала запросов подключения (если журнал включен)"""
+        if self.enabled:
+            conn.set_trace_callback(self._trace)
+    
+    def _trace(self, sql: str):
+        statements = getattr(self._local, 'statements', None)
+        if statements is None or len(statements) >= self.MAX_STATEMENTS:
+            return
+        # Шаги триггеров повторяют текст внешнего запроса - это продолжение того же запроса
+        if statements and statements[-1][1] == sql:
+            return
+        statements.append((time.perf_counter(), sql))
+    
+    def begin(self):
+        """Начало вызова метода в текущем потоке"""
+        if self.enabled:
+            self._local.statements = []
+    
+    def finish(self, method: str):
+        """Конец вызова: запись медленных запросов и проверка планов"""
+        statements = getattr(self._local, 'statements', None)
+        if statements is None:
+            return
+        self._local.statements = None
+        end = time.perf_counter()
+        
+        for index, (start, sql) in enumerate(statements):
+            # Служебные запросы FTS5 начинаются с комментария; транзакции и PRAGMA не проверяются
+            if sql.startswith('--') or sql.lstrip()[:6].upper() not in self.CHECKED_STATEMENTS:
+                continue
+            seconds = (statements[index + 1][0] if index + 1 < len(statements) else end) - start
+            if self.threshold and seconds >= self.threshold:
+                self.slow_queries += 1
+                plan = self.explain(sql)
+                problems = self.plan_problems(sql, plan)
+                self.full_scans += any(problem.endswith(self.FULL_SCAN) for problem in problems)
+                logger.warning(
+                    f"Медленный запрос {method}: {seconds * 1000:.1f} мс\n{' '.join(sql.split())[:1000]}\n"
+                    f"План: {'; '.join(plan)}" + (f"\n⚠️ {', '.join(problems)}" if problems else "")
+                )
+            if self.strict and method in self.HOT_METHODS and self.MOVIES_PATTERN.search(sql):
+                self.check_plan(method, sql)
+    
+    def plan_problems(self, sql: str, plan: List[str]) -> List[str]:
+        """Признаки медленного плана: полный просмотр movies и сортировка во временном B-дереве"""
+        names = {'movies'} | {alias for alias in self.MOVIES_ALIAS_PATTERN.findall(sql)
+                              if alias.upper() not in self.SQL_KEYWORDS}
+        problems = []
+        for detail in plan:
+            parts = detail.split()
+            if len(parts) >= 2 and parts[0] == 'SCAN' and parts[1] in names:
+                problems.append(f"{detail}: просмотр всего индекса" if 'USING' in parts
+                                else f"SCAN {parts[1]}: {self.FULL_SCAN}")
+            elif detail.startswith('USE TEMP B-TREE FOR ORDER BY'):
+                problems.append(detail)
+        return problems
+    
+    def check_plan(self, method: str, sql: str):
+        """Строгий режим: QueryPlanError, если запрос частого метода просматривает всю таблицу movies"""
+        key = (method, self.LITERAL_PATTERN.sub('?', ' '.join(sql.split())))
+        with self._plans_lock:
+            checked = self._plans.get(key)
+        if checked is None:
+            plan = self.explain(sql)
+            checked = (plan, self.plan_problems(sql, plan))
+            with self._plans_lock:
+                self._plans[key] = checked
+                while len(self._plans) > self.MAX_PLANS:
+                    self._plans.popitem(last=False)
+        problems = [problem for problem in checked[1] if problem.endswith(self.FULL_SCAN)]
+        if problems:
+            self.full_scans += 1
+            raise QueryPlanError(f"{method}: {', '.join(problems)}\n{' '.join(sql.split())[:1000]}")
+    
+    def plans(self) -> Dict[tuple, Tuple[List[str], List[str]]]:
+        """Проверенные в строгом режиме виды запросов (метод, текст): (план, его проблемы)"""
+        with self._plans_lock:
+            return dict(self._plans)
+    
+    def stats(self) -> Dict:
+        """Счетчики журнала запросов"""
+        return {
+            'slow_queries': self.slow_queries,
+            'full_scans': self.full_scans,
+        }
+
+
 class MovieDatabase:
     """Класс для работы с базой данных фильмов"""
     
-    def __init__(self, db_name: str = DB_NAME):
+    def __init__(self, db_name: str = DB_NAME, pragma_profile: str = DB_PRAGMA_PROFILE,
+                 reader_connections: int = DB_READER_THREADS, movie_cache_bytes: int = MOVIE_CACHE_MAX_BYTES,
+                 slow_query_ms: float = SLOW_QUERY_MS, strict_query_plans: bool = QUERY_PLAN_STRICT):
+        if pragma_profile not in PRAGMA_PROFILES:
+            raise ValueError(f"Неизвестный профиль SQLite: {pragma_profile}. "
+                             f"Доступны: {', '.join(PRAGMA_PROFILES)}")
+        
+        self.db_name = db_name
+        self.pragmas = PRAGMA_PROFILES[pragma_profile]
+        
+        # Поколение данных пользователя: увеличивается при каждом изменении его фильмов
+        # через этот объект. Кэши по пользователю сравнивают поколение, чтобы узнать об устаревании
+        self._user_generations: Dict[int, int] = {}
+        # "Мешки" случайного выбора по (user_id, status), см. get_random_movie
+        self._shuffle_bags: OrderedDict = OrderedDict()
+        self._shuffle_bags_lock = threading.Lock()
+        # Кэш фильмов пользователей: запись действительна, пока не изменились поколение
+        # пользователя и эпоха внешних изменений базы (см. _read_cached)
+        self._movie_cache = LRUCache(movie_cache_bytes) if movie_cache_bytes > 0 else None
+        self._data_version: Optional[int] = None
+        self._data_version_checked = 0.0
+        self._data_version_lock = threading.Lock()
+        self._external_epoch = 0
+        # Запросы пополнения полнотекстовых индексов (см. create_search_index, add_movies_batch)
+        self._index_fills: List[str] = []
+        
+        # Журнал медленных запросов (подключения отмечаются в нем при открытии)
+        self.query_log = QueryLog(self.explain_query, slow_query_ms, strict_query_plans)
+        
+        # Единственное подключение для записи
         self.conn = sqlite3.connect(db_name, check_same_thread=False)
         self.conn.row_factory = sqlite3.Row
+        self._apply_pragmas(self.conn, writer=True)
+        self.query_log.instrument(self.conn)
         self.create_tables()
-        logger.info(f"База данных {db_name} подключена")
+        
+        # Пул подключений только для чтения. В WAL читатели не блокируют писателя и друг друга;
+        # базу в памяти и режим legacy обслуживает подключение писателя
+        self._reader_pool: Optional[queue.Queue] = None
+        if db_name != ':memory:' and self.pragmas['journal_mode'] == 'WAL' and reader_connections > 0:
+            self._reader_pool = queue.Queue()
+            for _ in range(reader_connections):
+                self._reader_pool.put(self._open_reader())
+        
+        logger.info(f"База данных {db_name} подключена (профиль {pragma_profile}, "
+                    f"читателей: {reader_connections if self._reader_pool else 0})")
+    
+    def _apply_pragmas(self, conn: sqlite3.Connection, writer: bool):
+        """Применение профиля настроек к подключению"""
+        for name, value in self.pragmas.items():
+            # Режим журнала и синхронизация задаются писателем для всей базы
+            if not writer and name in ('journal_mode', 'synchronous'):
+                continue
+            conn.execute(f'PRAGMA {name} = {value}')
+    
+    def _open_reader(self) -> sqlite3.Connection:
+        """Открытие подключения только для чтения"""
+        path = os.path.abspath(self.db_name)
+        conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        self._apply_pragmas(conn, writer=False)
+        self.query_log.instrument(conn)
+        return conn
+    
+    @property
+    def has_reader_pool(self) -> bool:
+        """Есть ли отдельные подключения для чтения (без них чтение идет через подключение писателя)"""
+        return self._reader_pool is not None
+    
+    @contextmanager
+    def read_connection(self):
+        """Подключение для чтения из пула (или подключение писателя, если пула нет)"""
+        if self._reader_pool is None:
+            yield self.conn
+            return
+        
+        conn = self._reader_pool.get()
+        try:
+            yield conn
+        finally:
+            self._reader_pool.put(conn)
+    
+    def timed_call(self, name: str, args: tuple, kwargs: dict) -> Tuple:
+        """Вызов метода name: (результат, время выполнения в секундах); запросы проверяет query_log"""
+        self.query_log.begin()
+        start = time.perf_counter()
+        result = getattr(self, name)(*args, **kwargs)
+        seconds = time.perf_counter() - start
+        self.query_log.finish(name)
+        return result, seconds
+    
+    def explain_query(self, sql: str) -> List[str]:
+        """EXPLAIN QUERY PLAN запроса: строки плана"""
+        try:
+            with self.read_connection() as conn:
+                # EXPLAIN не читает базу и не замечает изменения схемы: чтение sqlite_master ее обновляет
+                conn.execute('SELECT 1 FROM sqlite_master LIMIT 1').fetchall()
+                return [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}')]
+        except sqlite3.Error as e:
+            return [f'план недоступен: {e}']
+    
+    def close(self):
+        """Закрытие всех подключений"""
+        if self._reader_pool is not None:
+            while not self._reader_pool.empty():
+                self._reader_pool.get_nowait().close()
+        self.conn.close()
     
     def create_tables(self):
         """Создание таблиц если они не существуют"""
@@ -84,16 +510,534 @@ class MovieDatabase:
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_movies_status ON movies(status)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_movies_genre ON movies(genre)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_movies_year ON movies(year)')
+        # Постраничный вывод: порядок индексов совпадает с сортировкой списков,
+        # поэтому страница - это чтение диапазона индекса от курсора
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_movies_user_page
+            ON movies(user_id, status, priority, added_date DESC, id DESC)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_movies_public_page
+            ON movies(added_date, id) WHERE is_public = 1
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_movies_user_rating
+            ON movies(user_id, status, rating DESC, id) WHERE rating > 0
+        ''')
+        
+        # Статистика пользователей, поддерживаемая триггерами
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'user_stats'")
+        user_stats_exists = cursor.fetchone() is not None
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS user_stats (
+                user_id INTEGER PRIMARY KEY,
+                want_count INTEGER NOT NULL DEFAULT 0,
+                watched_count INTEGER NOT NULL DEFAULT 0,
+                public_count INTEGER NOT NULL DEFAULT 0,
+                rating_sum INTEGER NOT NULL DEFAULT 0,
+                rated_count INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_user_stats_insert AFTER INSERT ON movies
+            BEGIN
+                INSERT OR IGNORE INTO user_stats (user_id) VALUES (NEW.user_id);
+                UPDATE user_stats SET
+                    want_count = want_count + (NEW.status IS 'want_to_watch'),
+                    watched_count = watched_count + (NEW.status IS 'watched'),
+                    public_count = public_count + (NEW.is_public IS 1),
+                    rating_sum = rating_sum + (CASE WHEN NEW.status IS 'watched' THEN COALESCE(NEW.rating, 0) ELSE 0 END),
+                    rated_count = rated_count + (NEW.status IS 'watched' AND NEW.rating IS NOT NULL)
+                WHERE user_id = NEW.user_id;
+            END
+        ''')
+        
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_user_stats_update
+            AFTER UPDATE OF user_id, status, is_public, rating ON movies
+            BEGIN
+                UPDATE user_stats SET
+                    want_count = want_count - (OLD.status IS 'want_to_watch'),
+                    watched_count = watched_count - (OLD.status IS 'watched'),
+                    public_count = public_count - (OLD.is_public IS 1),
+                    rating_sum = rating_sum - (CASE WHEN OLD.status IS 'watched' THEN COALESCE(OLD.rating, 0) ELSE 0 END),
+                    rated_count = rated_count - (OLD.status IS 'watched' AND OLD.rating IS NOT NULL)
+                WHERE user_id = OLD.user_id;
+                INSERT OR IGNORE INTO user_stats (user_id) VALUES (NEW.user_id);
+                UPDATE user_stats SET
+                    want_count = want_count + (NEW.status IS 'want_to_watch'),
+                    watched_count = watched_count + (NEW.status IS 'watched'),
+                    public_count = public_count + (NEW.is_public IS 1),
+                    rating_sum = rating_sum + (CASE WHEN NEW.status IS 'watched' THEN COALESCE(NEW.rating, 0) ELSE 0 END),
+                    rated_count = rated_count + (NEW.status IS 'watched' AND NEW.rating IS NOT NULL)
+                WHERE user_id = NEW.user_id;
+            END
+        ''')
+        
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_user_stats_delete AFTER DELETE ON movies
+            BEGIN
+                UPDATE user_stats SET
+                    want_count = want_count - (OLD.status IS 'want_to_watch'),
+                    watched_count = watched_count - (OLD.status IS 'watched'),
+                    public_count = public_count - (OLD.is_public IS 1),
+                    rating_sum = rating_sum - (CASE WHEN OLD.status IS 'watched' THEN COALESCE(OLD.rating, 0) ELSE 0 END),
+                    rated_count = rated_count - (OLD.status IS 'watched' AND OLD.rating IS NOT NULL)
+                WHERE user_id = OLD.user_id;
+            END
+        ''')
+        
+        # Глобальные счетчики публичных фильмов и рейтинг жанров, поддерживаемые триггерами
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'global_stats'")
+        global_stats_exists = cursor.fetchone() is not None
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS global_stats (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                total_movies INTEGER NOT NULL DEFAULT 0,
+                total_users INTEGER NOT NULL DEFAULT 0,
+                total_want INTEGER NOT NULL DEFAULT 0,
+                total_watched INTEGER NOT NULL DEFAULT 0,
+                rating_sum INTEGER NOT NULL DEFAULT 0,
+                rated_count INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        cursor.execute('INSERT OR IGNORE INTO global_stats (id) VALUES (1)')
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS genre_stats (
+                genre TEXT PRIMARY KEY,
+                movie_count INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_genre_stats_count ON genre_stats(movie_count)')
+        
+        # Постоянные ID жанров для callback_data кнопок (название жанра может не уместиться в 64 байта)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS genres (
+                id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL UNIQUE
+            )
+        ''')
+        
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_global_stats_insert AFTER INSERT ON movies
+            WHEN NEW.is_public IS 1
+            BEGIN
+                UPDATE global_stats SET
+                    total_movies = total_movies + 1,
+                    total_want = total_want + (NEW.status IS 'want_to_watch'),
+                    total_watched = total_watched + (NEW.status IS 'watched'),
+                    rating_sum = rating_sum + (CASE WHEN NEW.status IS 'watched' THEN COALESCE(NEW.rating, 0) ELSE 0 END),
+                    rated_count = rated_count + (NEW.status IS 'watched' AND NEW.rating IS NOT NULL)
+                WHERE id = 1;
+                INSERT OR IGNORE INTO genre_stats (genre) SELECT NEW.genre WHERE NEW.genre != '';
+                UPDATE genre_stats SET movie_count = movie_count + 1 WHERE genre = NEW.genre;
+            END
+        ''')
+        
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_global_stats_update
+            AFTER UPDATE OF status, is_public, rating, genre ON movies
+            WHEN OLD.is_public IS 1 OR NEW.is_public IS 1
+            BEGIN
+                UPDATE global_stats SET
+                    total_movies = total_movies - (OLD.is_public IS 1) + (NEW.is_public IS 1),
+                    total_want = total_want
+                        - (OLD.is_public IS 1 AND OLD.status IS 'want_to_watch')
+                        + (NEW.is_public IS 1 AND NEW.status IS 'want_to_watch'),
+                    total_watched = total_watched
+                        - (OLD.is_public IS 1 AND OLD.status IS 'watched')
+                        + (NEW.is_public IS 1 AND NEW.status IS 'watched'),
+                    rating_sum = rating_sum
+                        - (CASE WHEN OLD.is_public IS 1 AND OLD.status IS 'watched' THEN COALESCE(OLD.rating, 0) ELSE 0 END)
+                        + (CASE WHEN NEW.is_public IS 1 AND NEW.status IS 'watched' THEN COALESCE(NEW.rating, 0) ELSE 0 END),
+                    rated_count = rated_count
+                        - (OLD.is_public IS 1 AND OLD.status IS 'watched' AND OLD.rating IS NOT NULL)
+                        + (NEW.is_public IS 1 AND NEW.status IS 'watched' AND NEW.rating IS NOT NULL)
+                WHERE id = 1;
+                UPDATE genre_stats SET movie_count = movie_count - 1
+                WHERE genre = OLD.genre AND OLD.is_public IS 1;
+                INSERT OR IGNORE INTO genre_stats (genre)
+                SELECT NEW.genre WHERE NEW.is_public IS 1 AND NEW.genre != '';
+                UPDATE genre_stats SET movie_count = movie_count + 1
+                WHERE genre = NEW.genre AND NEW.is_public IS 1;
+            END
+        ''')
+        
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_global_stats_delete AFTER DELETE ON movies
+            WHEN OLD.is_public IS 1
+            BEGIN
+                UPDATE global_stats SET
+                    total_movies = total_movies - 1,
+                    total_want = total_want - (OLD.status IS 'want_to_watch'),
+                    total_watched = total_watched - (OLD.status IS 'watched'),
+                    rating_sum = rating_sum - (CASE WHEN OLD.status IS 'watched' THEN COALESCE(OLD.rating, 0) ELSE 0 END),
+                    rated_count = rated_count - (OLD.status IS 'watched' AND OLD.rating IS NOT NULL)
+                WHERE id = 1;
+                UPDATE genre_stats SET movie_count = movie_count - 1 WHERE genre = OLD.genre;
+            END
+        ''')
+        
+        # Число пользователей с публичными фильмами меняется, когда public_count переходит через ноль
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_global_stats_users AFTER UPDATE OF public_count ON user_stats
+            WHEN (OLD.public_count > 0) != (NEW.public_count > 0)
+            BEGIN
+                UPDATE global_stats SET total_users = total_users + (NEW.public_count > 0) - (OLD.public_count > 0)
+                WHERE id = 1;
+            END
+        ''')
+        
+        # Версия публичных данных: растет при любом изменении, видном на общих экранах
+        # (публичные фильмы, имена их владельцев). По ней сбрасывается кэш готовых экранов
+        cursor.execute('PRAGMA table_info(global_stats)')
+        if 'public_version' not in {row[1] for row in cursor.fetchall()}:
+            cursor.execute('ALTER TABLE global_stats ADD COLUMN public_version INTEGER NOT NULL DEFAULT 0')
+        
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_public_version_insert AFTER INSERT ON movies
+            WHEN NEW.is_public IS 1
+            BEGIN
+                UPDATE global_stats SET public_version = public_version + 1 WHERE id = 1;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_public_version_update
+            AFTER UPDATE OF user_id, title, genre, year, rating, status, is_public ON movies
+            WHEN OLD.is_public IS 1 OR NEW.is_public IS 1
+            BEGIN
+                UPDATE global_stats SET public_version = public_version + 1 WHERE id = 1;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_public_version_delete AFTER DELETE ON movies
+            WHEN OLD.is_public IS 1
+            BEGIN
+                UPDATE global_stats SET public_version = public_version + 1 WHERE id = 1;
+            END
+        ''')
+        # Имя владельца публичных фильмов: новая строка пользователя (фильмы могли появиться раньше нее)
+        # или изменение имени. Повторный /start с тем же именем версию не меняет
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_public_version_users AFTER INSERT ON users
+            WHEN EXISTS (SELECT 1 FROM user_stats WHERE user_id = NEW.user_id AND public_count > 0)
+            BEGIN
+                UPDATE global_stats SET public_version = public_version + 1 WHERE id = 1;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_public_version_user_names
+            AFTER UPDATE OF username, first_name ON users
+            WHEN (OLD.username IS NOT NEW.username OR OLD.first_name IS NOT NEW.first_name)
+                 AND EXISTS (SELECT 1 FROM user_stats WHERE user_id = NEW.user_id AND public_count > 0)
+            BEGIN
+                UPDATE global_stats SET public_version = public_version + 1 WHERE id = 1;
+            END
+        ''')
+        
+        self.conn.commit()
+        
+        # Заполняем статистику для базы, созданной до появления таблиц
+        if not user_stats_exists:
+            self.rebuild_user_stats()
+        if not global_stats_exists:
+            self.reconcile_global_stats()
+        
+        # Отметка пакетной вставки (add_movies_batch): пока в таблице есть строка, триггеры
+        # полнотекстовых индексов пропускают новые фильмы - они индексируются одним запросом.
+        # Отметка живет только внутри транзакции и другим подключениям не видна
+        cursor.execute('CREATE TABLE IF NOT EXISTS bulk_insert (user_id INTEGER)')
+        self.conn.commit()
+        
+        self.fts_enabled = self.create_search_index()
+        self.fuzzy_enabled = self.create_fuzzy_index()
+    
+    def _drop_outdated_trigger(self, name: str, marker: str):
+        """Удаление триггера прежней версии (в его тексте нет marker), чтобы создать его заново"""
+        cursor = self.conn.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = ?", (name,))
+        row = cursor.fetchone()
+        if row and marker not in row[0]:
+            self.conn.execute(f'DROP TRIGGER {name}')
+    
+    def create_search_index(self) -> bool:
+        """Создание полнотекстового индекса FTS5 по названиям и заметкам"""
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'movies_fts'")
+        fts_exists = cursor.fetchone() is not None
+        
+        try:
+            # unicode61 приводит к нижнему регистру любые буквы (в том числе кириллицу).
+            # Таблица без собственного содержимого: тексты хранятся только в movies,
+            # в индекс попадают с заменой "ё" на "е", которую токенизатор не выполняет.
+            # owner и vis - служебные токены владельца и видимости, чтобы фильтровать
+            # по ним внутри индекса, а не после перебора всех совпадений
+            cursor.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS movies_fts USING fts5(
+                    title, notes, owner, vis,
+                    content='',
+                    tokenize='unicode61 remove_diacritics 2',
+                    prefix='2 3 4 5 6'
+                )
+            ''')
+        except sqlite3.OperationalError as e:
+            logger.warning(f"FTS5 недоступен, поиск будет работать через LIKE: {e}")
+            return False
+        
+        values = (
+            "{0}.id, "
+            "replace(replace({0}.title, 'ё', 'е'), 'Ё', 'Е'), "
+            "replace(replace({0}.notes, 'ё', 'е'), 'Ё', 'Е'), "
+            "'u' || {0}.user_id, "
+            "CASE WHEN {0}.is_public IS 1 THEN 'pub' ELSE 'priv' END"
+        )
+        
+        self._drop_outdated_trigger('trg_movies_fts_insert', 'bulk_insert')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_movies_fts_insert AFTER INSERT ON movies
+            WHEN NOT EXISTS (SELECT 1 FROM bulk_insert)
+            BEGIN
+                INSERT INTO movies_fts (rowid, title, notes, owner, vis) VALUES ({values.format('NEW')});
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_movies_fts_delete AFTER DELETE ON movies
+            BEGIN
+                INSERT INTO movies_fts (movies_fts, rowid, title, notes, owner, vis)
+                VALUES ('delete', {values.format('OLD')});
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_movies_fts_update
+            AFTER UPDATE OF title, notes, user_id, is_public ON movies
+            BEGIN
+                INSERT INTO movies_fts (movies_fts, rowid, title, notes, owner, vis)
+                VALUES ('delete', {values.format('OLD')});
+                INSERT INTO movies_fts (rowid, title, notes, owner, vis) VALUES ({values.format('NEW')});
+            END
+        ''')
+        
+        fill = f'''
+            INSERT INTO movies_fts (rowid, title, notes, owner, vis)
+            SELECT {values.format('movies')} FROM movies
+        '''
+        self._index_fills.append(fill)
+        
+        # Индексируем фильмы, добавленные до появления индекса
+        if not fts_exists:
+            cursor.execute(fill)
+        
+        self.conn.commit()
+        return True
+    
+    def create_fuzzy_index(self) -> bool:
+        """Создание триграммного индекса названий для поиска с опечатками"""
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'movies_trgm'")
+        trgm_exists = cursor.fetchone() is not None
+        
+        try:
+            # Токенизатор trigram сам приводит текст к нижнему регистру, "ё" заменяется заранее.
+            # owner - метка владельца вида "<u42>": в угловых скобках, чтобы "<u4>" не находился
+            # внутри "<u42>". Видимость проверяется по таблице movies: публичных фильмов большинство
+            cursor.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS movies_trgm USING fts5(
+                    title, owner,
+                    content='',
+                    tokenize='trigram'
+                )
+            ''')
+        except sqlite3.OperationalError as e:
+            logger.warning(f"Триграммный индекс недоступен, поиск с опечатками отключен: {e}")
+            return False
+        
+        values = (
+            "{0}.id, "
+            "replace(replace({0}.title, 'ё', 'е'), 'Ё', 'Е'), "
+            "'<u' || {0}.user_id || '>'"
+        )
+        
+        self._drop_outdated_trigger('trg_movies_trgm_insert', 'bulk_insert')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_movies_trgm_insert AFTER INSERT ON movies
+            WHEN NOT EXISTS (SELECT 1 FROM bulk_insert)
+            BEGIN
+                INSERT INTO movies_trgm (rowid, title, owner) VALUES ({values.format('NEW')});
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_movies_trgm_delete AFTER DELETE ON movies
+            BEGIN
+                INSERT INTO movies_trgm (movies_trgm, rowid, title, owner) VALUES ('delete', {values.format('OLD')});
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_movies_trgm_update
+            AFTER UPDATE OF title, user_id ON movies
+            BEGIN
+                INSERT INTO movies_trgm (movies_trgm, rowid, title, owner) VALUES ('delete', {values.format('OLD')});
+                INSERT INTO movies_trgm (rowid, title, owner) VALUES ({values.format('NEW')});
+            END
+        ''')
+        
+        fill = f'''
+            INSERT INTO movies_trgm (rowid, title, owner)
+            SELECT {values.format('movies')} FROM movies
+        '''
+        self._index_fills.append(fill)
+        
+        if not trgm_exists:
+            cursor.execute(fill)
         
         self.conn.commit()
+        return True
+    
+    # Статистика пользователей, вычисленная по таблице movies (эталон для user_stats)
+    USER_STATS_AGGREGATE = '''
+        SELECT user_id,
+               SUM(status IS 'want_to_watch') AS want_count,
+               SUM(status IS 'watched') AS watched_count,
+               SUM(is_public IS 1) AS public_count,
+               SUM(CASE WHEN status IS 'watched' THEN COALESCE(rating, 0) ELSE 0 END) AS rating_sum,
+               SUM(status IS 'watched' AND rating IS NOT NULL) AS rated_count
+        FROM movies
+        WHERE user_id IS NOT NULL
+        GROUP BY user_id
+    '''
+    
+    def rebuild_user_stats(self) -> int:
+        """Полный пересчет таблицы user_stats"""
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute('DELETE FROM user_stats')
+            cursor.execute(f'''
+                INSERT INTO user_stats (user_id, want_count, watched_count, public_count, rating_sum, rated_count)
+                {self.USER_STATS_AGGREGATE}
+            ''')
+            self.conn.commit()
+            
+            logger.info(f"Статистика пересчитана для {cursor.rowcount} пользователей")
+            return cursor.rowcount
+        except Exception as e:
+            self.conn.rollback()
+            logger.error(f"Ошибка при пересчете статистики пользователей: {e}")
+            return 0
+    
+    # Глобальная статистика, вычисленная по таблице movies (эталон для global_stats)
+    GLOBAL_STATS_AGGREGATE = '''
+        SELECT COUNT(*),
+               COUNT(DISTINCT user_id),
+               COALESCE(SUM(status IS 'want_to_watch'), 0),
+               COALESCE(SUM(status IS 'watched'), 0),
+               COALESCE(SUM(CASE WHEN status IS 'watched' THEN COALESCE(rating, 0) ELSE 0 END), 0),
+               COALESCE(SUM(status IS 'watched' AND rating IS NOT NULL), 0)
+        FROM movies
+        WHERE is_public IS 1
+    '''
+    
+    GENRE_STATS_AGGREGATE = '''
+        SELECT genre, COUNT(*)
+        FROM movies
+        WHERE is_public IS 1 AND genre IS NOT NULL AND genre != ''
+        GROUP BY genre
+    '''
+    
+    def reconcile_global_stats(self) -> int:
+        """Сверка global_stats и genre_stats с таблицей movies: количество исправленных расхождений"""
+        try:
+            cursor = self.conn.cursor()
+            # Блокируем запись на время сверки, чтобы счетчики и пересчет видели одни и те же данные
+            cursor.execute('BEGIN IMMEDIATE')
+            
+            cursor.execute(self.GLOBAL_STATS_AGGREGATE)
+            expected = tuple(cursor.fetchone())
+            cursor.execute('''
+                SELECT total_movies, total_users, total_want, total_watched, rating_sum, rated_count
+                FROM global_stats WHERE id = 1
+            ''')
+            stored = tuple(cursor.fetchone())
+            fixed = sum(1 for a, b in zip(expected, stored) if a != b)
+            
+            if fixed:
+                cursor.execute('''
+                    UPDATE global_stats SET total_movies = ?, total_users = ?, total_want = ?,
+                                            total_watched = ?, rating_sum = ?, rated_count = ?
+                    WHERE id = 1
+                ''', expected)
+            
+            cursor.execute(f'''
+                SELECT COUNT(*) FROM (
+                    SELECT * FROM ({self.GENRE_STATS_AGGREGATE})
+                    EXCEPT
+                    SELECT genre, movie_count FROM genre_stats WHERE movie_count != 0
+                )
+            ''')
+            genre_drift = cursor.fetchone()[0]
+            cursor.execute(f'''
+                SELECT COUNT(*) FROM genre_stats
+                WHERE movie_count != 0 AND genre NOT IN (SELECT genre FROM ({self.GENRE_STATS_AGGREGATE}))
+            ''')
+            genre_drift += cursor.fetchone()[0]
+            
+            if genre_drift:
+                cursor.execute('DELETE FROM genre_stats')
+                cursor.execute(f'INSERT INTO genre_stats (genre, movie_count) {self.GENRE_STATS_AGGREGATE}')
+            
+            if fixed or genre_drift:
+                cursor.execute('UPDATE global_stats SET public_version = public_version + 1 WHERE id = 1')
+            
+            self.conn.commit()
+            
+            if fixed or genre_drift:
+                logger.warning(f"Глобальная статистика расходилась с данными и исправлена: "
+                               f"счетчиков {fixed}, жанров {genre_drift}")
+            return fixed + genre_drift
+        except Exception as e:
+            self.conn.rollback()
+            logger.error(f"Ошибка при сверке глобальной статистики: {e}")
+            return -1
+    
+    def verify_user_stats(self) -> int:
+        """Проверка user_stats: количество пользователей с расхождениями"""
+        try:
+            with self.read_connection() as conn:
+                cursor = conn.cursor()
+                # Пользователи без фильмов хранятся с нулями и расхождением не считаются
+                cursor.execute(f'''
+                    SELECT COUNT(*) FROM (
+                        SELECT * FROM ({self.USER_STATS_AGGREGATE})
+                        EXCEPT
+                        SELECT user_id, want_count, watched_count, public_count, rating_sum, rated_count
+                        FROM user_stats
+                    )
+                ''')
+                missing_or_wrong = cursor.fetchone()[0]
+                
+                cursor.execute(f'''
+                    SELECT COUNT(*) FROM user_stats s
+                    WHERE (s.want_count, s.watched_count, s.public_count, s.rating_sum, s.rated_count) != (0, 0, 0, 0, 0)
+                      AND s.user_id NOT IN (SELECT user_id FROM movies WHERE user_id IS NOT NULL)
+                ''')
+                return missing_or_wrong + cursor.fetchone()[0]
+        except Exception as e:
+            logger.error(f"Ошибка при проверке статистики пользователей: {e}")
+            return -1
     
     def add_or_update_user(self, user_id: int, username: str = None, first_name: str = None, language_code: str = 'ru'):
         """Добавление или обновление пользователя"""
         cursor = self.conn.cursor()
+        # UPSERT, а не INSERT OR REPLACE: строка не удаляется, поэтому сохраняется created_at,
+        # а триггер версии публичных данных видит прежнее имя
         cursor.execute('''
-            INSERT OR REPLACE INTO users 
+            INSERT INTO users 
             (user_id, username, first_name, language_code, last_activity) 
             VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(user_id) DO UPDATE SET
+                username = excluded.username, first_name = excluded.first_name,
+                language_code = excluded.language_code, last_activity = excluded.last_activity
         ''', (user_id, username or '', first_name or '', language_code))
         self.conn.commit()
     
@@ -106,34 +1050,186 @@ class MovieDatabase:
         ''', (user_id,))
         self.conn.commit()
     
+    def update_users_activity(self, activity: List[Tuple[str, int]]) -> bool:
+        """Пакетное обновление времени активности: [(last_activity, user_id), ...]"""
+        try:
+            cursor = self.conn.cursor()
+            cursor.executemany('UPDATE users SET last_activity = ? WHERE user_id = ?', activity)
+            self.conn.commit()
+            return True
+        except Exception as e:
+            self.conn.rollback()
+            logger.error(f"Ошибка при пакетном обновлении активности: {e}")
+            return False
+    
+    def _bump_user_generation(self, user_id: int):
+        """Отметка об изменении фильмов пользователя (вызывается только из потока-писателя)"""
+        self._user_generations[user_id] = self._user_generations.get(user_id, 0) + 1
+    
+    def user_generation(self, user_id: int) -> int:
+        """Текущее поколение данных пользователя"""
+        return self._user_generations.get(user_id, 0)
+    
+    def _external_changes_epoch(self) -> int:
+        """Счетчик изменений базы другими процессами.
+
+        PRAGMA data_version на подключении писателя меняется только после commit
+        других подключений, а читатели этого объекта ничего не пишут - значит,
+        базу изменил кто-то еще (другой экземпляр бота, ручная правка). Проверка
+        выполняется не чаще раза в DATA_VERSION_CHECK_INTERVAL секунд.
+        """
+        if DATA_VERSION_CHECK_INTERVAL <= 0:
+            return self._external_epoch
+        
+        now = time.monotonic()
+        if now - self._data_version_checked >= DATA_VERSION_CHECK_INTERVAL:
+            with self._data_version_lock:
+                if now - self._data_version_checked >= DATA_VERSION_CHECK_INTERVAL:
+                    self._data_version_checked = now
+                    try:
+                        version = self.conn.execute('PRAGMA data_version').fetchone()[0]
+                    except Exception as e:
+                        logger.error(f"Ошибка при проверке версии базы данных: {e}")
+                        version = None
+                    # Если проверить не удалось, считаем, что база изменилась
+                    if version is None or (self._data_version is not None and version != self._data_version):
+                        self._external_epoch += 1
+                    self._data_version = version
+        return self._external_epoch
+    
+    @staticmethod
+    def _rows_size(value) -> int:
+        """Примерный объем фильма или списка фильмов в памяти (байты)"""
+        movies = value if isinstance(value, list) else [value] if value else []
+        return 64 + sum(200 + sum(len(item) * 2 if isinstance(item, str) else 8 for item in movie.values())
+                        for movie in movies)
+    
+    def _read_cached(self, key: tuple, user_id: int, load: Callable):
+        """Чтение фильмов пользователя через кэш; при промахе данные загружает load()"""
+        if self._movie_cache is None:
+            return load()
+        
+        # Версия берется до запроса: запись, сделанная во время чтения, сделает результат устаревшим
+        version = (self.user_generation(user_id), self._external_changes_epoch())
+        entry = self._movie_cache.get(key, is_valid=lambda value: value[0] == version)
+        if entry is not None:
+            return entry[1]
+        
+        value = load()
+        self._movie_cache.put(key, (version, value), self._rows_size(value))
+        return value
+    
+    def _cache_movie(self, user_id: int, movie: Dict):
+        """Сохранение в кэш фильма, возвращенного запросом изменения (вызывается после смены поколения)"""
+        if self._movie_cache is not None:
+            version = (self.user_generation(user_id), self._external_changes_epoch())
+            self._movie_cache.put(('movie', user_id, movie['id']), (version, dict(movie)), self._rows_size(movie))
+    
+    def movie_cache_stats(self) -> Dict:
+        """Счетчики кэша фильмов"""
+        if self._movie_cache is None:
+            return {}
+        return {**self._movie_cache.stats(), 'external_invalidations': self._external_epoch}
+    
+    # Колонки фильма, которые возвращают get_movie_by_id и методы изменения (RETURNING)
+    MOVIE_COLUMNS = 'id, title, status, is_public, genre, year, priority, notes, rating'
+    
     def add_movie(self, user_id: int, title: str, genre: str = None, year: int = None, 
-                  is_public: bool = True, priority: int = 3, notes: str = None) -> Optional[int]:
-        """Добавление нового фильма"""
+                  is_public: bool = True, priority: int = 3, notes: str = None) -> Optional[Dict]:
+        """Добавление нового фильма: возвращает добавленный фильм или None, если он уже есть"""
         try:
             cursor = self.conn.cursor()
-            cursor.execute('''
+            cursor.execute(f'''
                 INSERT OR IGNORE INTO movies 
                 (user_id, title, genre, year, is_public, priority, notes) 
                 VALUES (?, ?, ?, ?, ?, ?, ?)
+                RETURNING {self.MOVIE_COLUMNS}
             ''', (user_id, title.strip(), genre, year, 1 if is_public else 0, priority, notes))
+            # Строки RETURNING нужно прочитать до commit()
+            rows = cursor.fetchall()
             self.conn.commit()
             
-            if cursor.rowcount > 0:
-                movie_id = cursor.lastrowid
-                logger.info(f"Добавлен фильм: ID={movie_id}, user={user_id}, title='{title}'")
-                return movie_id
+            if rows:
+                movie = dict(rows[0])
+                self._bump_user_generation(user_id)
+                self._cache_movie(user_id, movie)
+                logger.info(f"Добавлен фильм: ID={movie['id']}, user={user_id}, title='{title}'")
+                return movie
             else:
                 return None
         except Exception as e:
+            self.conn.rollback()
             logger.error(f"Ошибка при добавлении фильма: {e}")
             return None
     
+    # Порядок полей фильма в add_movies_batch
+    BATCH_COLUMNS = ('title', 'genre', 'year', 'rating', 'status', 'is_public', 'priority',
+                     'notes', 'added_date', 'watched_date')
+    
+    def add_movies_batch(self, user_id: int, movies: List[Tuple]) -> int:
+        """Добавление пачки фильмов одной транзакцией: возвращает число добавленных.
+
+        movies - кортежи в порядке BATCH_COLUMNS. Фильмы, которые уже есть в списке
+        пользователя (UNIQUE(user_id, title)), пропускаются.
+        """
+        if not movies:
+            return 0
+        
+        try:
+            cursor = self.conn.cursor()
+            # Отметка открывает транзакцию, поэтому все фильмы с ID больше last_id - из этой пачки
+            cursor.execute('INSERT INTO bulk_insert (user_id) VALUES (?)', (user_id,))
+            cursor.execute('SELECT COALESCE(MAX(id), 0) FROM movies')
+            last_id = cursor.fetchone()[0]
+            
+            cursor.executemany('''
+                INSERT OR IGNORE INTO movies 
+                (user_id, title, genre, year, rating, status, is_public, priority, notes, added_date, watched_date) 
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP), ?)
+            ''', [(user_id, *movie) for movie in movies])
+            # rowcount executemany - сумма вставленных строк без учета строк триггеров
+            added = max(cursor.rowcount, 0)
+            
+            # Полнотекстовые индексы пополняются одним запросом на пачку вместо запроса на фильм
+            cursor.execute('DELETE FROM bulk_insert')
+            if added:
+                for fill in self._index_fills:
+                    cursor.execute(f'{fill} WHERE id > ?', (last_id,))
+            self.conn.commit()
+            
+            if added:
+                self._bump_user_generation(user_id)
+            logger.info(f"Пакетное добавление: user={user_id}, добавлено {added} из {len(movies)}")
+            return added
+        except Exception as e:
+            self.conn.rollback()
+            logger.error(f"Ошибка при пакетном добавлении фильмов: {e}")
+            return -1
+    
     def get_user_movies(self, user_id: int, status: str = None, genre: str = None, 
                         year: int = None, priority: int = None, include_private: bool = True, 
-                        limit: int = None) -> List[Dict]:
-        """Получение фильмов пользователя с фильтрацией"""
+                        limit: int = None, after: Tuple = None, before: Tuple = None) -> List[Dict]:
+        """Получение фильмов пользователя с фильтрацией.
+
+        after / before - курсор (priority, added_date, id) фильма, после которого
+        или перед которым начинается страница.
+        """
+        key = ('movies', user_id, status, genre, year, priority, include_private, limit, after, before)
         try:
-            cursor = self.conn.cursor()
+            movies = self._read_cached(key, user_id, lambda: self._select_user_movies(
+                user_id, status, genre, year, priority, include_private, limit, after, before))
+            # Копии: вызывающий код может изменять словари, не затрагивая кэш
+            return [dict(movie) for movie in movies]
+        except Exception as e:
+            logger.error(f"Ошибка при получении фильмов пользователя: {e}")
+            return []
+    
+    def _select_user_movies(self, user_id: int, status: Optional[str], genre: Optional[str],
+                            year: Optional[int], priority: Optional[int], include_private: bool,
+                            limit: Optional[int], after: Optional[Tuple], before: Optional[Tuple]) -> List[Dict]:
+        """Запрос фильмов пользователя для get_user_movies"""
+        with self.read_connection() as conn:
+            cursor = conn.cursor()
             
             query = '''
                 SELECT id, title, status, added_date, is_public, genre, year, priority, notes, rating
@@ -161,39 +1257,232 @@ class MovieDatabase:
             if not include_private:
                 query += ' AND is_public = 1'
             
-            query += ' ORDER BY priority ASC, added_date DESC'
+            # Приоритет сортируется по возрастанию, а дата и ID - по убыванию, поэтому курсор
+            # нельзя сравнить одним кортежем. Условие на priority задает начало диапазона индекса
+            if before:
+                query += '''
+                    AND priority <= ? AND (priority < ? OR (added_date, id) > (?, ?))
+                    ORDER BY priority DESC, added_date ASC, id ASC
+                '''
+                params.extend([before[0], before[0], before[1], before[2]])
+            elif after:
+                query += '''
+                    AND priority >= ? AND (priority > ? OR (added_date, id) < (?, ?))
+                    ORDER BY priority ASC, added_date DESC, id DESC
+                '''
+                params.extend([after[0], after[0], after[1], after[2]])
+            else:
+                query += ' ORDER BY priority ASC, added_date DESC, id DESC'
             
             if limit:
                 query += ' LIMIT ?'
                 params.append(limit)
             
             cursor.execute(query, params)
-            return [dict(row) for row in cursor.fetchall()]
+            movies = [dict(row) for row in cursor.fetchall()]
+            
+            # Страница перед курсором читается в обратном порядке
+            if before:
+                movies.reverse()
+            return movies
+    
+    def get_top_rated_movies(self, user_id: int, limit: int, after: Tuple = None,
+                             before: Tuple = None) -> List[Dict]:
+        """Просмотренные фильмы пользователя с оценкой, от лучших к худшим.
+
+        after / before - курсор (rating, id) фильма, после которого
+        или перед которым начинается страница.
+        """
+        key = ('top_rated', user_id, limit, after, before)
+        try:
+            movies = self._read_cached(key, user_id, lambda: self._select_top_rated(user_id, limit, after, before))
+            return [dict(movie) for movie in movies]
         except Exception as e:
-            logger.error(f"Ошибка при получении фильмов пользователя: {e}")
+            logger.error(f"Ошибка при получении лучших фильмов: {e}")
             return []
     
+    def _select_top_rated(self, user_id: int, limit: int, after: Optional[Tuple],
+                          before: Optional[Tuple]) -> List[Dict]:
+        """Запрос фильмов для get_top_rated_movies"""
+        with self.read_connection() as conn:
+            query = '''
+                SELECT id, title, status, added_date, is_public, genre, year, priority, notes, rating
+                FROM movies
+                WHERE user_id = ? AND status = 'watched' AND rating > 0
+            '''
+            params = [user_id]
+            
+            # Оценка сортируется по убыванию, а ID - по возрастанию (как в idx_movies_user_rating)
+            if before:
+                query += ' AND rating >= ? AND (rating > ? OR id < ?) ORDER BY rating ASC, id DESC'
+                params.extend([before[0], before[0], before[1]])
+            elif after:
+                query += ' AND rating <= ? AND (rating < ? OR id > ?) ORDER BY rating DESC, id ASC'
+                params.extend([after[0], after[0], after[1]])
+            else:
+                query += ' ORDER BY rating DESC, id ASC'
+            query += ' LIMIT ?'
+            params.append(limit)
+            
+            movies = [dict(row) for row in conn.execute(query, params).fetchall()]
+            if before:
+                movies.reverse()
+            return movies
+    
+    # Колонки выгрузки фильмов (их же понимает импорт, см. IMPORT_FIELD_ALIASES)
+    EXPORT_COLUMNS = ('title', 'genre', 'year', 'rating', 'status', 'priority', 'is_public',
+                      'notes', 'added_date', 'watched_date')
+    
+    def export_movies(self, out, fmt: str = 'csv', user_id: int = None, batch: int = 1000) -> int:
+        """Выгрузка фильмов пользователя (или всей таблицы, если user_id не задан) в текстовый файл out.
+
+        Строки читаются с курсора пачками по batch и сразу записываются в out, поэтому
+        память не зависит от размера списка. fmt - 'csv' или 'jsonl'. Возвращает число
+        выгруженных фильмов или -1 при ошибке.
+        """
+        if user_id is not None:
+            columns = self.EXPORT_COLUMNS
+            query = f'''
+                SELECT {', '.join(columns)} FROM movies WHERE user_id = ?
+                ORDER BY priority ASC, added_date DESC, id DESC
+            '''
+            params = (user_id,)
+        else:
+            columns = ('id', 'user_id') + self.EXPORT_COLUMNS
+            query = f"SELECT {', '.join(columns)} FROM movies ORDER BY id"
+            params = ()
+        
+        try:
+            with self.read_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(query, params)
+                
+                writer = csv.writer(out) if fmt == 'csv' else None
+                if writer:
+                    writer.writerow(columns)
+                
+                count = 0
+                while True:
+                    rows = cursor.fetchmany(batch)
+                    if not rows:
+                        break
+                    if writer:
+                        writer.writerows(rows)
+                    else:
+                        out.writelines(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + '\n'
+                                       for row in rows)
+                    count += len(rows)
+                return count
+        except Exception as e:
+            logger.error(f"Ошибка при выгрузке фильмов: {e}")
+            return -1
+    
+    # Порядок значений в строке 'stats' запроса get_movies_overview
+    STATS_FIELDS = ('want_count', 'watched_count', 'public_count', 'rated_count', 'avg_rating',
+                    'want_total', 'watched_total', 'has_genres')
+    
+    def get_movies_overview(self, user_id: int, want_limit: int = 10, watched_limit: int = 10,
+                            genre: str = None, year: int = None) -> Dict:
+        """Данные экрана "Мои фильмы" одним запросом: начало обоих списков, счетчики и наличие жанров"""
+        filters = ''
+        filter_params = []
+        if genre:
+            filters += ' AND genre LIKE ?'
+            filter_params.append(f'%{genre}%')
+        if year:
+            filters += ' AND year = ?'
+            filter_params.append(year)
+        
+        # Без фильтров размеры списков берутся из user_stats, с фильтрами - считаются
+        if filters:
+            want_total = f"(SELECT COUNT(*) FROM movies WHERE user_id = ? AND status = 'want_to_watch'{filters})"
+            watched_total = f"(SELECT COUNT(*) FROM movies WHERE user_id = ? AND status = 'watched'{filters})"
+            total_params = [user_id, *filter_params, user_id, *filter_params]
+        else:
+            want_total, watched_total, total_params = 's.want_count', 's.watched_count', []
+        
+        columns = 'id, title, status, added_date, is_public, genre, year, priority, notes, rating'
+        # Один составной запрос - один снимок базы: списки и счетчики всегда согласованы.
+        # Строка 'stats' занимает те же 11 колонок, значения в ней идут по порядку STATS_FIELDS
+        query = f'''
+            SELECT * FROM (
+                SELECT 'want', {columns} FROM movies
+                WHERE user_id = ? AND status = 'want_to_watch'{filters}
+                ORDER BY priority ASC, added_date DESC, id DESC
+                LIMIT ?
+            )
+            UNION ALL
+            SELECT * FROM (
+                SELECT 'watched', {columns} FROM movies
+                WHERE user_id = ? AND status = 'watched'{filters}
+                ORDER BY priority ASC, added_date DESC, id DESC
+                LIMIT ?
+            )
+            UNION ALL
+            SELECT 'stats',
+                   COALESCE(s.want_count, 0), COALESCE(s.watched_count, 0), COALESCE(s.public_count, 0),
+                   COALESCE(s.rated_count, 0),
+                   CASE WHEN s.rated_count > 0 THEN ROUND(1.0 * s.rating_sum / s.rated_count, 1) END,
+                   COALESCE({want_total}, 0), COALESCE({watched_total}, 0),
+                   EXISTS (SELECT 1 FROM movies WHERE user_id = ? AND genre IS NOT NULL AND genre != ''),
+                   NULL, NULL
+            FROM (SELECT 1) LEFT JOIN user_stats s ON s.user_id = ?
+        '''
+        params = [user_id, *filter_params, want_limit, user_id, *filter_params, watched_limit,
+                  *total_params, user_id, user_id]
+        
+        overview = {'want': [], 'watched': [], 'stats': {
+            'want_count': 0, 'watched_count': 0, 'public_count': 0, 'rated_count': 0, 'avg_rating': None
+        }, 'want_total': 0, 'watched_total': 0, 'has_genres': False}
+        
+        try:
+            with self.read_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(query, params)
+                names = [column[0] for column in cursor.description][1:]
+                
+                for part, *values in cursor.fetchall():
+                    if part == 'stats':
+                        stats = dict(zip(self.STATS_FIELDS, values))
+                        overview['want_total'] = stats.pop('want_total')
+                        overview['watched_total'] = stats.pop('watched_total')
+                        overview['has_genres'] = bool(stats.pop('has_genres'))
+                        overview['stats'] = stats
+                    else:
+                        overview[part].append(dict(zip(names, values)))
+        except Exception as e:
+            logger.error(f"Ошибка при получении обзора фильмов пользователя: {e}")
+        
+        return overview
+    
     def get_movie_by_id(self, user_id: int, movie_id: int) -> Optional[Dict]:
         """Получение фильма по ID"""
         try:
-            cursor = self.conn.cursor()
-            cursor.execute('''
-                SELECT id, title, status, is_public, genre, year, priority, notes, rating
+            movie = self._read_cached(('movie', user_id, movie_id), user_id,
+                                      lambda: self._select_movie_by_id(user_id, movie_id))
+            return dict(movie) if movie else None
+        except Exception as e:
+            logger.error(f"Ошибка при получении фильма по ID: {e}")
+            return None
+    
+    def _select_movie_by_id(self, user_id: int, movie_id: int) -> Optional[Dict]:
+        """Запрос фильма для get_movie_by_id"""
+        with self.read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT {self.MOVIE_COLUMNS}
                 FROM movies 
                 WHERE id = ? AND user_id = ?
             ''', (movie_id, user_id))
             
             row = cursor.fetchone()
             return dict(row) if row else None
-        except Exception as e:
-            logger.error(f"Ошибка при получении фильма по ID: {e}")
-            return None
     
-    def update_movie(self, user_id: int, movie_id: int, **kwargs) -> bool:
-        """Обновление информации о фильме"""
+    def update_movie(self, user_id: int, movie_id: int, **kwargs) -> Optional[Dict]:
+        """Обновление информации о фильме: возвращает фильм после изменения"""
         try:
             if not kwargs:
-                return False
+                return None
             
             cursor = self.conn.cursor()
             
@@ -206,22 +1495,28 @@ class MovieDatabase:
                 UPDATE movies 
                 SET {set_clause}
                 WHERE id = ? AND user_id = ?
+                RETURNING {self.MOVIE_COLUMNS}
             '''
             
             cursor.execute(query, values)
+            rows = cursor.fetchall()
             self.conn.commit()
             
-            success = cursor.rowcount > 0
-            if success:
+            if rows:
+                movie = dict(rows[0])
+                self._bump_user_generation(user_id)
+                self._cache_movie(user_id, movie)
                 logger.info(f"Фильм {movie_id} обновлен: {kwargs}")
+                return movie
             
-            return success
+            return None
         except Exception as e:
+            self.conn.rollback()
             logger.error(f"Ошибка при обновлении фильма: {e}")
-            return False
+            return None
     
-    def mark_as_watched(self, user_id: int, movie_id: int, rating: int = None) -> bool:
-        """Отметка фильма как просмотренного"""
+    def mark_as_watched(self, user_id: int, movie_id: int, rating: int = None) -> Optional[Dict]:
+        """Отметка фильма как просмотренного: возвращает фильм после изменения"""
         try:
             update_data = {
                 'status': 'watched',
@@ -234,79 +1529,101 @@ class MovieDatabase:
             return self.update_movie(user_id, movie_id, **update_data)
         except Exception as e:
             logger.error(f"Ошибка при отметке фильма как просмотренного: {e}")
-            return False
+            return None
     
-    def delete_movie(self, user_id: int, movie_id: int) -> bool:
-        """Удаление фильма"""
+    def delete_movie(self, user_id: int, movie_id: int) -> Optional[Dict]:
+        """Удаление фильма: возвращает удаленный фильм"""
         try:
             cursor = self.conn.cursor()
-            cursor.execute('DELETE FROM movies WHERE id = ? AND user_id = ?', (movie_id, user_id))
+            cursor.execute(f'''
+                DELETE FROM movies WHERE id = ? AND user_id = ?
+                RETURNING {self.MOVIE_COLUMNS}
+            ''', (movie_id, user_id))
+            rows = cursor.fetchall()
             self.conn.commit()
             
-            success = cursor.rowcount > 0
-            if success:
+            if rows:
+                self._bump_user_generation(user_id)
                 logger.info(f"Фильм {movie_id} удален")
-            return success
+                return dict(rows[0])
+            return None
         except Exception as e:
+            self.conn.rollback()
             logger.error(f"Ошибка при удалении фильма: {e}")
-            return False
+            return None
     
-    def toggle_movie_privacy(self, user_id: int, movie_id: int) -> Optional[bool]:
-        """Переключение приватности фильма"""
+    def toggle_movie_privacy(self, user_id: int, movie_id: int) -> Optional[Dict]:
+        """Переключение приватности фильма: возвращает фильм с новым состоянием"""
         try:
             cursor = self.conn.cursor()
             
-            # Получаем текущее состояние
-            cursor.execute('SELECT is_public FROM movies WHERE id = ? AND user_id = ?', (movie_id, user_id))
-            
-            row = cursor.fetchone()
-            if not row:
-                return None
-            
-            current_state = bool(row[0])
-            new_state = not current_state
-            
-            # Обновляем состояние
-            cursor.execute('UPDATE movies SET is_public = ? WHERE id = ? AND user_id = ?', 
-                         (1 if new_state else 0, movie_id, user_id))
+            # Переключение одним запросом: между чтением и записью состояние не может измениться
+            cursor.execute(f'''
+                UPDATE movies SET is_public = CASE WHEN is_public IS 1 THEN 0 ELSE 1 END
+                WHERE id = ? AND user_id = ?
+                RETURNING {self.MOVIE_COLUMNS}
+            ''', (movie_id, user_id))
+            rows = cursor.fetchall()
             self.conn.commit()
             
-            if cursor.rowcount > 0:
-                logger.info(f"Приватность фильма {movie_id} изменена на {'публичный' if new_state else 'приватный'}")
-                return new_state
+            if rows:
+                movie = dict(rows[0])
+                self._bump_user_generation(user_id)
+                self._cache_movie(user_id, movie)
+                logger.info(f"Приватность фильма {movie_id} изменена на "
+                            f"{'публичный' if movie['is_public'] else 'приватный'}")
+                return movie
             
             return None
         except Exception as e:
+            self.conn.rollback()
             logger.error(f"Ошибка при изменении приватности фильма: {e}")
             return None
     
-    def get_public_movies(self, limit: int = 100, genre: str = None, year: int = None) -> List[Dict]:
-        """Получение всех публичных фильмов с фильтрацией"""
+    def get_public_movies(self, limit: int = 100, genre: str = None, year: int = None,
+                          after: Tuple = None, before: Tuple = None) -> List[Dict]:
+        """Получение всех публичных фильмов с фильтрацией.
+
+        after / before - курсор (added_date, id) фильма, после которого
+        или перед которым начинается страница.
+        """
         try:
-            cursor = self.conn.cursor()
-            
-            query = '''
-                SELECT m.id, m.title, m.status, m.added_date, m.genre, m.year, m.rating,
-                       u.user_id, u.username, u.first_name 
-                FROM movies m
-                LEFT JOIN users u ON m.user_id = u.user_id
-                WHERE m.is_public = 1
-            '''
-            params = []
-            
-            if genre:
-                query += ' AND m.genre LIKE ?'
-                params.append(f'%{genre}%')
-            
-            if year:
-                query += ' AND m.year = ?'
-                params.append(year)
-            
-            query += ' ORDER BY m.added_date DESC LIMIT ?'
-            params.append(limit)
-            
-            cursor.execute(query, params)
-            return [dict(row) for row in cursor.fetchall()]
+            with self.read_connection() as conn:
+                cursor = conn.cursor()
+                
+                query = '''
+                    SELECT m.id, m.title, m.status, m.added_date, m.genre, m.year, m.rating,
+                           u.user_id, u.username, u.first_name 
+                    FROM movies m
+                    LEFT JOIN users u ON m.user_id = u.user_id
+                    WHERE m.is_public = 1
+                '''
+                params = []
+                
+                if genre:
+                    query += ' AND m.genre LIKE ?'
+                    params.append(f'%{genre}%')
+                
+                if year:
+                    query += ' AND m.year = ?'
+                    params.append(year)
+                
+                if before:
+                    query += ' AND (m.added_date, m.id) > (?, ?) ORDER BY m.added_date ASC, m.id ASC LIMIT ?'
+                    params.extend(before)
+                elif after:
+                    query += ' AND (m.added_date, m.id) < (?, ?) ORDER BY m.added_date DESC, m.id DESC LIMIT ?'
+                    params.extend(after)
+                else:
+                    query += ' ORDER BY m.added_date DESC, m.id DESC LIMIT ?'
+                params.append(limit)
+                
+                cursor.execute(query, params)
+                movies = [dict(row) for row in cursor.fetchall()]
+                
+                if before:
+                    movies.reverse()
+                return movies
         except Exception as e:
             logger.error(f"Ошибка при получении публичных фильмов: {e}")
             return []
@@ -314,30 +1631,22 @@ class MovieDatabase:
     def get_user_stats(self, user_id: int) -> Dict:
         """Получение статистики пользователя"""
         try:
-            cursor = self.conn.cursor()
-            
-            cursor.execute('''
-                SELECT 
-                    COUNT(CASE WHEN status = 'want_to_watch' THEN 1 END) as want_count,
-                    COUNT(CASE WHEN status = 'watched' THEN 1 END) as watched_count,
-                    COUNT(CASE WHEN is_public = 1 THEN 1 END) as public_count,
-                    AVG(CASE WHEN status = 'watched' AND rating IS NOT NULL THEN rating END) as avg_rating,
-                    COUNT(CASE WHEN status = 'watched' AND rating IS NOT NULL THEN 1 END) as rated_count
-                FROM movies 
-                WHERE user_id = ?
-            ''', (user_id,))
-            
-            row = cursor.fetchone()
-            result = dict(row) if row else {
-                'want_count': 0, 'watched_count': 0, 'public_count': 0,
-                'avg_rating': 0, 'rated_count': 0
-            }
-            
-            # Округляем средний рейтинг
-            if result['avg_rating']:
-                result['avg_rating'] = round(result['avg_rating'], 1)
-            
-            return result
+            with self.read_connection() as conn:
+                cursor = conn.cursor()
+                
+                # Поддерживается триггерами, поэтому это чтение одной строки по ключу
+                cursor.execute('''
+                    SELECT want_count, watched_count, public_count, rated_count,
+                           CASE WHEN rated_count > 0 THEN ROUND(1.0 * rating_sum / rated_count, 1) END as avg_rating
+                    FROM user_stats 
+                    WHERE user_id = ?
+                ''', (user_id,))
+                
+                row = cursor.fetchone()
+                return dict(row) if row else {
+                    'want_count': 0, 'watched_count': 0, 'public_count': 0,
+                    'rated_count': 0, 'avg_rating': None
+                }
         except Exception as e:
             logger.error(f"Ошибка при получении статистики пользователя: {e}")
             return {'want_count': 0, 'watched_count': 0, 'public_count': 0, 'avg_rating': 0, 'rated_count': 0}
@@ -345,47 +1654,54 @@ class MovieDatabase:
     def get_global_stats(self) -> Dict:
         """Получение глобальной статистики"""
         try:
-            cursor = self.conn.cursor()
-            
-            cursor.execute('''
-                SELECT 
-                    COUNT(*) as total_movies,
-                    COUNT(DISTINCT user_id) as total_users,
-                    COUNT(CASE WHEN status = 'want_to_watch' THEN 1 END) as total_want,
-                    COUNT(CASE WHEN status = 'watched' THEN 1 END) as total_watched,
-                    AVG(CASE WHEN status = 'watched' AND rating IS NOT NULL THEN rating END) as global_avg_rating
-                FROM movies 
-                WHERE is_public = 1
-            ''')
-            
-            row = cursor.fetchone()
-            result = dict(row) if row else {
-                'total_movies': 0, 'total_users': 0, 'total_want': 0, 
-                'total_watched': 0, 'global_avg_rating': 0
-            }
-            
-            if result['global_avg_rating']:
-                result['global_avg_rating'] = round(result['global_avg_rating'], 1)
-            
-            return result
+            with self.read_connection() as conn:
+                cursor = conn.cursor()
+                
+                # Счетчики поддерживаются триггерами: одна строка вместо прохода по всем фильмам
+                cursor.execute('''
+                    SELECT total_movies, total_users, total_want, total_watched,
+                           CASE WHEN rated_count > 0 THEN ROUND(1.0 * rating_sum / rated_count, 1) ELSE 0 END
+                               as global_avg_rating
+                    FROM global_stats
+                    WHERE id = 1
+                ''')
+                
+                row = cursor.fetchone()
+                return dict(row) if row else {
+                    'total_movies': 0, 'total_users': 0, 'total_want': 0, 
+                    'total_watched': 0, 'global_avg_rating': 0
+                }
         except Exception as e:
             logger.error(f"Ошибка при получении глобальной статистики: {e}")
             return {'total_movies': 0, 'total_users': 0, 'total_want': 0, 'total_watched': 0, 'global_avg_rating': 0}
     
+    def get_public_version(self) -> int:
+        """Текущая версия публичных данных"""
+        try:
+            with self.read_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT public_version FROM global_stats WHERE id = 1')
+                row = cursor.fetchone()
+                return row[0] if row else 0
+        except Exception as e:
+            logger.error(f"Ошибка при получении версии публичных данных: {e}")
+            # Версия, которой нет в кэше: экран будет построен заново
+            return -1
+    
     def get_top_genres(self, limit: int = 10) -> List[Tuple[str, int]]:
         """Получение самых популярных жанров"""
         try:
-            cursor = self.conn.cursor()
-            cursor.execute('''
-                SELECT genre, COUNT(*) as movie_count
-                FROM movies
-                WHERE is_public = 1 AND genre IS NOT NULL AND genre != ''
-                GROUP BY genre
-                ORDER BY movie_count DESC
-                LIMIT ?
-            ''', (limit,))
-            
-            return [(row[0], row[1]) for row in cursor.fetchall()]
+            with self.read_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT genre, movie_count
+                    FROM genre_stats
+                    WHERE movie_count > 0
+                    ORDER BY movie_count DESC
+                    LIMIT ?
+                ''', (limit,))
+                
+                return [(row[0], row[1]) for row in cursor.fetchall()]
         except Exception as e:
             logger.error(f"Ошибка при получении топ жанров: {e}")
             return []
@@ -393,198 +1709,1629 @@ class MovieDatabase:
     def get_user_genres(self, user_id: int) -> List[Tuple[str, int]]:
         """Получение жанров пользователя"""
         try:
-            cursor = self.conn.cursor()
-            cursor.execute('''
-                SELECT genre, COUNT(*) as count
-                FROM movies
-                WHERE user_id = ? AND genre IS NOT NULL AND genre != ''
-                GROUP BY genre
-                ORDER BY count DESC
-            ''', (user_id,))
-            
-            return [(row[0], row[1]) for row in cursor.fetchall()]
+            with self.read_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT genre, COUNT(*) as count
+                    FROM movies
+                    WHERE user_id = ? AND genre IS NOT NULL AND genre != ''
+                    GROUP BY genre
+                    ORDER BY count DESC
+                ''', (user_id,))
+                
+                return [(row[0], row[1]) for row in cursor.fetchall()]
         except Exception as e:
             logger.error(f"Ошибка при получении жанров пользователя: {e}")
             return []
     
-    def get_random_movie(self, user_id: int, status: str = 'want_to_watch') -> Optional[Dict]:
-        """Получение случайного фильма"""
+    def get_genre_ids(self, genres: List[str]) -> Dict[str, int]:
+        """ID жанров для кнопок; новым жанрам ID назначаются при первом обращении"""
+        if not genres:
+            return {}
         try:
             cursor = self.conn.cursor()
-            cursor.execute('''
-                SELECT id, title, genre, priority
-                FROM movies
-                WHERE user_id = ? AND status = ?
-                ORDER BY RANDOM()
-                LIMIT 1
-            ''', (user_id, status))
-            
-            row = cursor.fetchone()
-            return dict(row) if row else None
+            cursor.executemany('INSERT OR IGNORE INTO genres (name) VALUES (?)', [(genre,) for genre in genres])
+            self.conn.commit()
+            placeholders = ', '.join('?' * len(genres))
+            cursor.execute(f'SELECT name, id FROM genres WHERE name IN ({placeholders})', genres)
+            return dict(cursor.fetchall())
+        except Exception as e:
+            self.conn.rollback()
+            logger.error(f"Ошибка при получении ID жанров: {e}")
+            return {}
+    
+    def get_genre_id(self, name: str) -> Optional[int]:
+        """ID жанра, уже записанного в genres (без добавления, в отличие от get_genre_ids)"""
+        try:
+            with self.read_connection() as conn:
+                row = conn.execute('SELECT id FROM genres WHERE name = ?', (name,)).fetchone()
+                return row[0] if row else None
         except Exception as e:
-            logger.error(f"Ошибка при получении случайного фильма: {e}")
+            logger.error(f"Ошибка при получении ID жанра: {e}")
             return None
     
-    def search_movies(self, user_id: int, query: str, search_in_public: bool = False) -> List[Dict]:
-        """Поиск фильмов по названию"""
+    def get_genre_name(self, genre_id: int) -> Optional[str]:
+        """Название жанра по ID из кнопки"""
         try:
-            cursor = self.conn.cursor()
+            with self.read_connection() as conn:
+                row = conn.execute('SELECT name FROM genres WHERE id = ?', (genre_id,)).fetchone()
+                return row[0] if row else None
+        except Exception as e:
+            logger.error(f"Ошибка при получении жанра по ID: {e}")
+            return None
+    
+    # Сколько пользователей хранят "мешок" случайного выбора (давно не использованные вытесняются)
+    SHUFFLE_BAGS_MAX = 10000
+    
+    def get_random_movie(self, user_id: int, status: str = 'want_to_watch') -> Optional[Dict]:
+        """Получение случайного фильма.
+
+        Фильмы выдаются из "мешка": пока не показаны все фильмы списка, повторов нет,
+        фильмы с высоким приоритетом в каждом круге выпадают раньше. Список загружается
+        один раз и перезагружается только после изменения фильмов пользователя,
+        каждый выбор - извлечение из конца перемешанного списка.
+        """
+        key = (user_id, status)
+        generation = self.user_generation(user_id)
+        
+        with self._shuffle_bags_lock:
+            bag = self._shuffle_bags.get(key)
+            if bag is not None:
+                self._shuffle_bags.move_to_end(key)
+        
+        if bag is None or bag['generation'] != generation:
+            try:
+                with self.read_connection() as conn:
+                    cursor = conn.cursor()
+                    cursor.execute('''
+                        SELECT id, title, genre, priority
+                        FROM movies
+                        WHERE user_id = ? AND status = ?
+                    ''', (user_id, status))
+                    movies = [dict(row) for row in cursor.fetchall()]
+            except Exception as e:
+                logger.error(f"Ошибка при получении случайного фильма: {e}")
+                return None
             
-            if search_in_public:
-                cursor.execute('''
-                    SELECT m.id, m.title, m.status, m.genre, m.year, m.rating,
-                           u.first_name, u.username
-                    FROM movies m
-                    LEFT JOIN users u ON m.user_id = u.user_id
-                    WHERE m.is_public = 1 AND m.title LIKE ?
-                    ORDER BY m.added_date DESC
-                    LIMIT 20
-                ''', (f'%{query}%',))
-            else:
-                cursor.execute('''
-                    SELECT id, title, status, genre, year, rating
-                    FROM movies
-                    WHERE user_id = ? AND title LIKE ?
-                    ORDER BY added_date DESC
-                    LIMIT 20
-                ''', (user_id, f'%{query}%'))
+            # Уже показанные в текущем круге фильмы не повторяются и после изменения списка
+            ids = {movie['id'] for movie in movies}
+            shown = bag['shown'] & ids if bag else set()
+            bag = {'generation': generation, 'movies': movies, 'order': [], 'shown': shown,
+                   'last': bag['last'] if bag else None}
+            with self._shuffle_bags_lock:
+                self._shuffle_bags[key] = bag
+                self._shuffle_bags.move_to_end(key)
+                while len(self._shuffle_bags) > self.SHUFFLE_BAGS_MAX:
+                    self._shuffle_bags.popitem(last=False)
+        
+        with self._shuffle_bags_lock:
+            if not bag['movies']:
+                return None
             
-            return [dict(row) for row in cursor.fetchall()]
+            if not bag['order']:
+                if len(bag['shown']) >= len(bag['movies']):
+                    bag['shown'] = set()
+                bag['order'] = self._weighted_shuffle(
+                    [movie for movie in bag['movies'] if movie['id'] not in bag['shown']], bag['last'])
+            
+            movie = bag['order'].pop()
+            bag['shown'].add(movie['id'])
+            bag['last'] = movie['id']
+            return dict(movie)
+    
+    @staticmethod
+    def _weighted_shuffle(movies: List[Dict], last_id: Optional[int]) -> List[Dict]:
+        """Перемешивание с весом по приоритету (Efraimidis-Spirakis), первым выдается конец списка"""
+        # Ключ u^(1/w): чем больше вес, тем ближе ключ к 1 и тем раньше фильм будет выдан
+        order = sorted(movies, key=lambda movie: random.random() ** (1 / (movie['priority'] or 3)))
+        # Новый круг не начинается с фильма, которым закончился предыдущий
+        if len(order) > 1 and order[-1]['id'] == last_id:
+            order[-1], order[-2] = order[-2], order[-1]
+        return order
+    
+    @staticmethod
+    def build_fts_query(query: str) -> Optional[str]:
+        """Преобразование пользовательского запроса в слова запроса FTS5 (все слова, поиск по префиксу)"""
+        words = re.findall(r'\w+', query.lower().replace('ё', 'е'))
+        if not words:
+            return None
+        # Префиксы длиной 2-6 символов хранятся в индексе, более длинные требуют слияния всех
+        # подходящих слов, поэтому слово обрезается до 6 символов (это заодно отбрасывает окончания).
+        # Однобуквенный префикс совпадает почти со всем словарем - его ищем как слово целиком
+        return ' '.join(f'"{word[:6]}"*' if len(word) > 1 else f'"{word}"' for word in words)
+    
+    def search_movies(self, user_id: int, query: str, search_in_public: bool = False, limit: int = 20) -> List[Dict]:
+        """Поиск фильмов по названию и заметкам с ранжированием по релевантности"""
+        if not self.fts_enabled:
+            return self._search_movies_like(user_id, query, search_in_public)
+        
+        terms = self.build_fts_query(query)
+        if not terms:
+            return []
+        
+        if search_in_public:
+            scope = 'vis : pub'
+            columns = 'm.id, m.title, m.status, m.genre, m.year, m.rating, m.user_id, u.first_name, u.username'
+            # По частым словам совпадений в каталоге очень много: индекс отдает их от новых
+            # к старым, и LIMIT останавливает перебор сразу
+            window = 'ORDER BY rowid DESC LIMIT :limit'
+        else:
+            scope = f'owner : "u{int(user_id)}"'
+            columns = 'm.id, m.title, m.status, m.genre, m.year, m.rating, m.is_public'
+            # Совпадений у одного пользователя немного, а прямой обход индекса быстрее обратного
+            window = ''
+        
+        # Совпадения в названии важнее совпадений только в заметках, внутри группы - сначала новые
+        sql = f'''
+            SELECT {columns}
+            FROM (SELECT rowid FROM movies_fts WHERE movies_fts MATCH :query {window}) f
+            JOIN movies m ON m.id = f.rowid
+            LEFT JOIN users u ON m.user_id = u.user_id
+            ORDER BY f.rowid DESC
+            LIMIT :limit
+        '''
+        
+        try:
+            with self.read_connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute(sql, {'query': f'{scope} AND title : ({terms})', 'limit': limit})
+                movies = [dict(row) for row in cursor.fetchall()]
+                
+                if len(movies) < limit:
+                    # Оператор NOT в FTS5 перебирает все совпадения правой части,
+                    # поэтому уже найденные фильмы отбрасываются здесь
+                    found_ids = {movie['id'] for movie in movies}
+                    cursor.execute(sql, {
+                        'query': f'{scope} AND {{title notes}} : ({terms})',
+                        'limit': limit + len(movies)
+                    })
+                    for row in cursor:
+                        if row['id'] not in found_ids and len(movies) < limit:
+                            movies.append(dict(row))
+                
+                return movies
+        except Exception as e:
+            logger.error(f"Ошибка при поиске фильмов: {e}")
+            return []
+    
+    def _search_movies_like(self, user_id: int, query: str, search_in_public: bool = False) -> List[Dict]:
+        """Поиск по подстроке для сборок SQLite без FTS5"""
+        try:
+            with self.read_connection() as conn:
+                cursor = conn.cursor()
+                
+                if search_in_public:
+                    cursor.execute('''
+                        SELECT m.id, m.title, m.status, m.genre, m.year, m.rating,
+                               m.user_id, u.first_name, u.username
+                        FROM movies m
+                        LEFT JOIN users u ON m.user_id = u.user_id
+                        WHERE m.is_public = 1 AND m.title LIKE ?
+                        ORDER BY m.added_date DESC
+                        LIMIT 20
+                    ''', (f'%{query}%',))
+                else:
+                    cursor.execute('''
+                        SELECT id, title, status, genre, year, rating, is_public
+                        FROM movies
+                        WHERE user_id = ? AND title LIKE ?
+                        ORDER BY added_date DESC
+                        LIMIT 20
+                    ''', (user_id, f'%{query}%'))
+                
+                return [dict(row) for row in cursor.fetchall()]
         except Exception as e:
             logger.error(f"Ошибка при поиске фильмов: {e}")
             return []
 
+    
+    # Нечеткий поиск: минимальное сходство названия с запросом и сколько кандидатов
+    # (самых похожих по триграммам) сравнивается с запросом
+    FUZZY_MIN_SIMILARITY = 0.3
+    FUZZY_CANDIDATES = 200
+    
+    @staticmethod
+    def word_trigrams(text: str) -> List[set]:
+        """Триграммы каждого слова текста (слово дополняется пробелами: два в начале, один в конце)"""
+        words = []
+        for word in re.findall(r'\w+', text.lower().replace('ё', 'е')):
+            padded = f'  {word} '
+            words.append({padded[i:i + 3] for i in range(len(padded) - 2)})
+        return words
+    
+    @staticmethod
+    def _jaccard(a: set, b: set) -> float:
+        return len(a & b) / len(a | b) if a or b else 0.0
+    
+    def fuzzy_search_movies(self, user_id: int, query: str, search_in_public: bool = False,
+                            limit: int = 5, budget_ms: float = FUZZY_SEARCH_BUDGET_MS) -> List[Dict]:
+        """Поиск названий, похожих на запрос (с опечатками), по сходству триграмм"""
+        if not self.fuzzy_enabled:
+            return []
+        
+        query_words = self.word_trigrams(query)
+        # В индексе слова не дополнены пробелами, поэтому кандидатов ищем по триграммам внутри слов,
+        # по порядку: триграммы слова, идущие подряд, - общая с названием часть слова
+        runs = [[word[i:i + 3] for i in range(len(word) - 2)]
+                for word in re.findall(r'\w+', query.lower().replace('ё', 'е')) if len(word) >= 3]
+        if not runs:
+            return []
+        
+        scope = '' if search_in_public else f'owner : "<u{int(user_id)}>" AND '
+        deadline = time.perf_counter() + budget_ms / 1000
+        candidates = []
+        seen = set()
+        
+        try:
+            with self.read_connection() as conn:
+                cursor = conn.cursor()
+                
+                # Запрос, не уложившийся в бюджет, прерывается, используются уже собранные кандидаты.
+                # Подключение писателя (пула читателей нет) не прерывается: бюджет проверяется между запросами
+                interruptible = conn is not self.conn
+                if interruptible:
+                    conn.set_progress_handler(lambda: time.perf_counter() > deadline, 1000)
+                try:
+                    # Сначала названия, у которых с запросом общие длинные отрезки из size триграмм подряд,
+                    # затем все более короткие: целое слово, затем половина слова (опечатка разрывает
+                    # не больше трех соседних триграмм, так что половина слова у похожего названия
+                    # остается целой) и меньше. Лимит - на весь запрос, а не на триграмму: частые
+                    # триграммы не вытесняют похожие названия, среди одинаково похожих первыми идут новые
+                    longest = max(len(run) for run in runs)
+                    for size in sorted({longest, *range(1, max(1, (longest - 2) // 2) + 1)}, reverse=True):
+                        if len(candidates) >= self.FUZZY_CANDIDATES or time.perf_counter() > deadline:
+                            break
+                        windows = sorted({' AND '.join(f'"{trigram}"' for trigram in run[i:i + size])
+                                          for run in runs for i in range(len(run) - size + 1)})
+                        if not windows:
+                            continue
+                        cursor.execute(
+                            'SELECT rowid FROM movies_trgm WHERE movies_trgm MATCH ? ORDER BY rowid DESC LIMIT ?',
+                            (f"{scope}title : ({' OR '.join(f'({window})' for window in windows)})",
+                             self.FUZZY_CANDIDATES)
+                        )
+                        for (movie_id,) in cursor:
+                            if movie_id not in seen and len(candidates) < self.FUZZY_CANDIDATES:
+                                seen.add(movie_id)
+                                candidates.append(movie_id)
+                except sqlite3.OperationalError as e:
+                    if 'interrupted' not in str(e):
+                        raise
+                    logger.warning(f"Нечеткий поиск \"{query}\" не уложился в {budget_ms:.0f} мс")
+                finally:
+                    if interruptible:
+                        conn.set_progress_handler(None, 0)
+                
+                if not candidates:
+                    return []
+                
+                placeholders = ', '.join('?' * len(candidates))
+                if search_in_public:
+                    cursor.execute(f'''
+                        SELECT m.id, m.title, m.status, m.genre, m.year, m.rating,
+                               m.user_id, u.first_name, u.username
+                        FROM movies m
+                        LEFT JOIN users u ON m.user_id = u.user_id
+                        WHERE m.id IN ({placeholders}) AND m.is_public = 1
+                    ''', candidates)
+                else:
+                    cursor.execute(f'''
+                        SELECT id, title, status, genre, year, rating, is_public
+                        FROM movies
+                        WHERE id IN ({placeholders})
+                    ''', candidates)
+                movies = [dict(row) for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"Ошибка при нечетком поиске фильмов: {e}")
+            return []
+        
+        # Сходство - среднее по словам запроса сходство с ближайшим словом названия,
+        # так запрос из одного слова находит и длинные названия. При равенстве выше
+        # названия, похожие на запрос целиком
+        query_all = set().union(*query_words)
+        ranked = []
+        for movie in movies:
+            title_words = self.word_trigrams(movie['title'])
+            if not title_words:
+                continue
+            movie['similarity'] = sum(
+                max(self._jaccard(word, title_word) for title_word in title_words) for word in query_words
+            ) / len(query_words)
+            if movie['similarity'] >= self.FUZZY_MIN_SIMILARITY:
+                ranked.append((movie['similarity'], self._jaccard(query_all, set().union(*title_words)),
+                               movie['id'], movie))
+        
+        ranked.sort(key=lambda item: item[:3], reverse=True)
+        return [movie for *_, movie in ranked[:limit]]
+
+class AsyncMovieDatabase:
+    """Асинхронная обертка над MovieDatabase.
+
+    Повторяет все методы MovieDatabase, но выполняет их вне цикла событий:
+    изменения данных - в единственном потоке-писателе (строго по очереди),
+    чтение - в пуле потоков-читателей. Медленный запрос или commit()
+    больше не останавливает обработку обновлений других пользователей.
+    """
+    
+    # Методы, изменяющие данные
+    WRITE_METHODS = frozenset({
+        'create_tables', 'add_or_update_user', 'update_user_activity', 'update_users_activity',
+        'add_movie', 'add_movies_batch', 'update_movie', 'mark_as_watched', 'delete_movie',
+        'toggle_movie_privacy', 'get_genre_ids',
+        'rebuild_user_stats', 'reconcile_global_stats',
+    })
+    
+    def __init__(self, database: MovieDatabase, reader_threads: int = DB_READER_THREADS):
+        self.sync = database
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer')
+        # Без пула читателей (база в памяти, профиль legacy) чтение идет через подключение писателя,
+        # поэтому выполняется в потоке писателя: подключение не используется двумя потоками сразу
+        # и чтение не видит незавершенную транзакцию
+        if database.has_reader_pool:
+            self._readers = ThreadPoolExecutor(max_workers=max(1, reader_threads), thread_name_prefix='db-reader')
+        else:
+            self._readers = self._writer
+    
+    def __getattr__(self, name: str):
+        """Создание асинхронной версии метода MovieDatabase при первом обращении"""
+        method = getattr(self.sync, name)
+        if name.startswith('_') or not callable(method):
+            return method
+        
+        executor = self._writer if name in self.WRITE_METHODS else self._readers
+        
+        async def call(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            result, seconds = await loop.run_in_executor(executor, self.sync.timed_call, name, args, kwargs)
+            metrics.observe_db(name, seconds, result)
+            return result
+        
+        functools.update_wrapper(call, method)
+        # Кэшируем обертку, чтобы не создавать ее на каждый вызов
+        setattr(self, name, call)
+        return call
+    
+    def close(self):
+        """Остановка потоков базы данных с ожиданием начатых операций"""
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+        self.sync.close()
+        logger.info("Потоки базы данных остановлены")
+
+
+class ActivityBuffer:
+    """Буфер времени последней активности пользователей.
+
+    Вместо UPDATE и commit() на каждую команду и нажатие кнопки запоминает
+    последнее время активности каждого пользователя в памяти и записывает
+    все накопленное одной транзакцией: по таймеру, при переполнении буфера
+    и при остановке бота.
+    """
+    
+    def __init__(self, database: AsyncMovieDatabase, max_size: int = ACTIVITY_BUFFER_SIZE):
+        self.database = database
+        self.max_size = max_size
+        self._pending: Dict[int, str] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self.started_at = time.monotonic()
+        self.touches = 0
+        self.flushes = 0
+    
+    def touch(self, user_id: int):
+        """Отметка активности пользователя (без обращения к базе)"""
+        # CURRENT_TIMESTAMP в SQLite - это UTC, сохраняем тот же формат
+        self._pending[user_id] = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        self.touches += 1
+        
+        if len(self._pending) >= self.max_size and (self._flush_task is None or self._flush_task.done()):
+            self._flush_task = asyncio.create_task(self.flush())
+    
+    async def flush(self) -> int:
+        """Запись накопленной активности в базу одной транзакцией"""
+        if not self._pending:
+            return 0
+        
+        pending, self._pending = self._pending, {}
+        success = await self.database.update_users_activity(
+            [(last_activity, user_id) for user_id, last_activity in pending.items()]
+        )
+        
+        if not success:
+            # Возвращаем данные в буфер, не затирая более свежие отметки
+            for user_id, last_activity in pending.items():
+                self._pending.setdefault(user_id, last_activity)
+            return 0
+        
+        self.flushes += 1
+        stats = self.stats()
+        logger.info(
+            f"Активность {len(pending)} пользователей записана одной транзакцией, "
+            f"сэкономлено коммитов: {stats['saved_commits']} ({stats['saved_commits_per_second']}/с)"
+        )
+        return len(pending)
+    
+    def stats(self) -> Dict:
+        """Статистика работы буфера"""
+        uptime = max(time.monotonic() - self.started_at, 1e-9)
+        saved_commits = max(self.touches - len(self._pending) - self.flushes, 0)
+        return {
+            'pending': len(self._pending),
+            'touches': self.touches,
+            'commits': self.flushes,
+            'saved_commits': saved_commits,
+            'saved_commits_per_second': round(saved_commits / uptime, 2),
+        }
+
+
+class RenderCache:
+    """Кэш готовых экранов (текст и клавиатура), одинаковых для всех пользователей.
+
+    Ключ - экран и его фильтры, к записи привязана версия публичных данных
+    (global_stats.public_version): пока данные не изменились, все пользователи
+    получают один и тот же готовый экран без запросов к базе. Если экран уже
+    строится по запросу другого пользователя, ожидается тот же результат.
+    """
+    
+    def __init__(self, max_bytes: int = RENDER_CACHE_MAX_BYTES):
+        self.cache = LRUCache(max_bytes)
+        self._rendering: Dict[tuple, asyncio.Future] = {}
+        self.coalesced = 0
+    
+    async def get_or_render(self, key: tuple, version: int, render: Callable) -> Tuple:
+        """Экран (text, reply_markup) для версии данных version; при промахе строится через render()"""
+        entry = self.cache.get(key, is_valid=lambda value: value[0] == version)
+        if entry is not None:
+            return entry[1]
+        
+        pending = self._rendering.get((key, version))
+        if pending is not None:
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise
+            # Построение по запросу другого пользователя не удалось - строим сами
+            return await render()
+        
+        future = asyncio.get_running_loop().create_future()
+        self._rendering[(key, version)] = future
+        try:
+            payload = await render()
+        except BaseException:
+            future.cancel()
+            raise
+        finally:
+            del self._rendering[(key, version)]
+        
+        future.set_result(payload)
+        # Отрицательная версия означает ошибку чтения: такой экран не сохраняем
+        if version >= 0:
+            self.cache.put(key, (version, payload), self._payload_size(payload))
+        return payload
+    
+    @staticmethod
+    def _payload_size(payload: Tuple) -> int:
+        text, markup = payload
+        size = len(text.encode('utf-8'))
+        if markup is not None:
+            size += sum(len(button.text.encode('utf-8')) + len((button.callback_data or '').encode('utf-8'))
+                        for row in markup.inline_keyboard for button in row)
+        return size
+    
+    def stats(self) -> Dict:
+        """Счетчики кэша экранов"""
+        return {**self.cache.stats(), 'coalesced': self.coalesced}
+
+
+class UserThrottle:
+    """Ограничение частоты запросов пользователя и отсев повторных нажатий.
+
+    У каждого пользователя "ведро" на burst запросов, которое пополняется со
+    скоростью rate запросов в секунду; запрос при пустом ведре отклоняется.
+    Нажатие той же кнопки в течение debounce секунд после принятого нажатия
+    считается повтором и отклоняется, не расходуя ведро.
+    """
+    
+    # Сколько пользователей отслеживается (давно не писавшие вытесняются с полным ведром)
+    MAX_USERS = 10000
+    
+    def __init__(self, rate: float = USER_RATE_LIMIT, burst: int = USER_RATE_BURST,
+                 debounce: float = CALLBACK_DEBOUNCE_SECONDS):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.debounce = debounce
+        # user_id -> [токены, время пополнения, callback_data и время последнего принятого нажатия,
+        #             было ли уже отправлено предупреждение]
+        self._users: OrderedDict = OrderedDict()
+        self.allowed = 0
+        self.throttled = 0
+        self.debounced = 0
+    
+    def check(self, user_id: int, callback_data: Optional[str] = None) -> Optional[str]:
+        """None, если запрос можно выполнять; иначе причина отказа: 'debounced' или 'throttled'"""
+        now = time.monotonic()
+        state = self._users.get(user_id)
+        if state is None:
+            state = self._users[user_id] = [float(self.burst), now, None, 0.0, False]
+            if len(self._users) > self.MAX_USERS:
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(user_id)
+        
+        if (callback_data is not None and self.debounce > 0 and callback_data == state[2]
+                and now - state[3] < self.debounce):
+            self.debounced += 1
+            return 'debounced'
+        
+        if self.rate > 0:
+            state[0] = min(self.burst, state[0] + (now - state[1]) * self.rate)
+            state[1] = now
+            if state[0] < 1:
+                self.throttled += 1
+                return 'throttled'
+            state[0] -= 1
+        
+        if callback_data is not None:
+            state[2], state[3] = callback_data, now
+        state[4] = False
+        self.allowed += 1
+        return None
+    
+    def should_warn(self, user_id: int) -> bool:
+        """Предупреждать ли об отказе (один раз на серию отклоненных запросов)"""
+        state = self._users.get(user_id)
+        if state is None or state[4]:
+            return False
+        state[4] = True
+        return True
+    
+    def stats(self) -> Dict:
+        """Счетчики ограничения частоты"""
+        return {
+            'users': len(self._users),
+            'allowed': self.allowed,
+            'throttled': self.throttled,
+            'debounced': self.debounced,
+        }
+
+
+# Очереди исходящих запросов: ответы пользователю обслуживаются раньше фоновых сообщений
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+
+class SendScheduler(BaseRateLimiter):
+    """Планировщик исходящих запросов к Bot API с учетом лимитов Telegram.
+
+    Запросы, отправляющие или изменяющие сообщения, ждут своей очереди в чате
+    (token bucket на чат) и в общем лимите бота. Общая очередь упорядочена по
+    приоритету (rate_limit_args: PRIORITY_INTERACTIVE или PRIORITY_BULK), затем
+    по времени постановки. Ответ 429 (RetryAfter) приостанавливает всю отправку
+    на указанное время (в чате запроса, без чата - всю отправку), после чего
+    запрос повторяется.
+    """
+    
+    # Методы Bot API, на которые распространяются лимиты сообщений
+    LIMITED_ENDPOINTS = frozenset({
+        'sendMessage', 'editMessageText', 'editMessageReplyMarkup', 'editMessageCaption',
+        'sendDocument', 'sendPhoto', 'copyMessage', 'forwardMessage',
+    })
+    # Сколько чатов отслеживается (давно не получавшие сообщений вытесняются)
+    MAX_CHATS = 10000
+    
+    def __init__(self, global_rate: float = TELEGRAM_GLOBAL_RATE, chat_rate: float = TELEGRAM_CHAT_RATE,
+                 chat_burst: int = TELEGRAM_CHAT_BURST, group_rate: float = TELEGRAM_GROUP_RATE_PER_MINUTE / 60,
+                 max_retries: int = TELEGRAM_MAX_RETRIES):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = max(chat_burst, 1)
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        # Общий лимит: [токены, время пополнения]; лимит чата - то же на каждый чат
+        self._global = [max(global_rate, 1.0), time.monotonic()]
+        self._chats: OrderedDict = OrderedDict()
+        # Ожидающие общего лимита: куча (приоритет, номер, future)
+        self._waiting: List = []
+        self._sequence = 0
+        self._paused_until = 0.0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self.sent = 0
+        self.chat_delays = 0
+        self.queued = 0
+        self.retries = 0
+        self.failed = 0
+    
+    async def initialize(self):
+        # Вызывается и приложением, и Updater - очередь запускается один раз
+        if self._dispatcher is None:
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.create_task(self._dispatch())
+    
+    async def shutdown(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+            self._dispatcher = None
+        for _, _, future in self._waiting:
+            future.cancel()
+        self._waiting.clear()
+    
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if endpoint not in self.LIMITED_ENDPOINTS:
+            return await callback(*args, **kwargs)
+        
+        priority = PRIORITY_INTERACTIVE if rate_limit_args is None else rate_limit_args
+        chat_id = data.get('chat_id')
+        for attempt in range(self.max_retries + 1):
+            await self._wait_chat(chat_id)
+            await self._wait_global(priority)
+            try:
+                result = await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt == self.max_retries:
+                    self.failed += 1
+                    raise
+                self.retries += 1
+                self._pause(chat_id, float(e.retry_after))
+                logger.warning(f"Telegram просит подождать {e.retry_after} с ({endpoint}, чат {chat_id}), "
+                               f"повтор {attempt + 1} из {self.max_retries}")
+                continue
+            self.sent += 1
+            return result
+    
+    def _pause(self, chat_id, seconds: float):
+        """Пауза после ответа 429: в чате, к которому он относится, или во всей отправке"""
+        now = time.monotonic()
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            self._paused_until = max(self._paused_until, now + seconds)
+            return
+        # Долг в seconds секунд: следующий токен чата появится не раньше конца паузы
+        is_group = not isinstance(chat_id, int) or chat_id < 0
+        rate = self.group_rate if is_group else self.chat_rate
+        bucket[0] = min(bucket[0] + (now - bucket[1]) * rate, 0.0) - seconds * rate
+        bucket[1] = now
+    
+    @staticmethod
+    def _take(bucket: List, rate: float, burst: float, now: float) -> float:
+        """Взять токен из ведра (в долг, если пусто); возвращает, сколько ждать до его появления"""
+        tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+        bucket[0], bucket[1] = tokens - 1, now
+        return 0.0 if tokens >= 1 else (1 - tokens) / rate
+    
+    async def _wait_chat(self, chat_id):
+        """Ожидание очереди в чате: 1 сообщение в секунду в личном чате, 20 в минуту в группе"""
+        if chat_id is None:
+            return
+        # ID групп и каналов отрицательные, каналы также указываются по @имени
+        is_group = not isinstance(chat_id, int) or chat_id < 0
+        rate = self.group_rate if is_group else self.chat_rate
+        if rate <= 0:
+            return
+        
+        now = time.monotonic()
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = [float(self.chat_burst), now]
+            if len(self._chats) > self.MAX_CHATS:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        
+        delay = self._take(bucket, rate, self.chat_burst, now)
+        if delay > 0:
+            self.chat_delays += 1
+            await asyncio.sleep(delay)
+    
+    def _global_delay(self) -> float:
+        """Сколько ждать общего лимита; 0 - токен взят и запрос можно отправлять"""
+        now = time.monotonic()
+        if now < self._paused_until:
+            return self._paused_until - now
+        if self.global_rate <= 0:
+            return 0.0
+        tokens = min(max(self.global_rate, 1.0), self._global[0] + (now - self._global[1]) * self.global_rate)
+        self._global[1] = now
+        if tokens < 1:
+            self._global[0] = tokens
+            return (1 - tokens) / self.global_rate
+        self._global[0] = tokens - 1
+        return 0.0
+    
+    async def _wait_global(self, priority: int):
+        """Ожидание общего лимита в очереди по приоритету"""
+        if not self._waiting and self._global_delay() == 0:
+            return
+        
+        self.queued += 1
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (priority, self._sequence, future))
+        self._sequence += 1
+        self._wakeup.set()
+        await future
+    
+    async def _dispatch(self):
+        """Выпуск ожидающих запросов по мере появления токенов общего лимита"""
+        while True:
+            while self._waiting and self._waiting[0][2].done():
+                heapq.heappop(self._waiting)
+            if not self._waiting:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            
+            delay = self._global_delay()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            heapq.heappop(self._waiting)[2].set_result(None)
+    
+    def stats(self) -> Dict:
+        """Счетчики исходящих запросов"""
+        return {
+            'sent': self.sent,
+            'waiting': len(self._waiting),
+            'queued': self.queued,
+            'chat_delays': self.chat_delays,
+            'retries': self.retries,
+            'failed': self.failed,
+        }
+
+
+class Histogram:
+    """Гистограмма Prometheus: число наблюдений по корзинам для каждого набора меток"""
+    
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...], buckets: Tuple[float, ...]):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        # Метки -> [наблюдений в каждой корзине..., вне корзин (+Inf), сумма значений]
+        self._series: Dict[tuple, list] = {}
+    
+    def observe(self, labels: tuple, value: float):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+    
+    def render(self, lines: List[str]):
+        lines.append(f"# HELP {self.name} {self.help_text}")
+        lines.append(f"# TYPE {self.name} histogram")
+        for labels, series in self._series.items():
+            pairs = format_metric_labels(self.label_names, labels)
+            total = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series):
+                total += count
+                lines.append(f'{self.name}_bucket{{{pairs}{"," if pairs else ""}le="{bound}"}} {total}')
+            pairs = f"{{{pairs}}}" if pairs else ""
+            lines.append(f"{self.name}_sum{pairs} {series[-1]:.6f}")
+            lines.append(f"{self.name}_count{pairs} {total}")
+
+
+# Экранирование значений меток Prometheus
+METRIC_LABEL_ESCAPES = str.maketrans({'\\': '\\\\', '"': '\\"', '\n': '\\n'})
+
+
+def format_metric_labels(names: Tuple[str, ...], values: tuple) -> str:
+    """Метки Prometheus: name="value" через запятую"""
+    return ','.join(f'{name}="{str(value).translate(METRIC_LABEL_ESCAPES)}"' for name, value in zip(names, values))
+
+
+class Metrics:
+    """Метрики работы бота в текстовом формате Prometheus.
+
+    Все замеры записываются в потоке цикла событий (время запроса к базе
+    измеряется в потоке базы, а записывается после возврата результата),
+    поэтому обходятся без блокировок. Счетчики остальных компонентов (кэши,
+    ограничение частоты, очередь отправки, вебхук) читаются их методами
+    stats() только в момент запроса метрик.
+    """
+    
+    UPDATE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    DB_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+    LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+    
+    def __init__(self):
+        self.started_at = time.time()
+        self.updates = Histogram('movie_bot_update_duration_seconds', 'Время обработки обновления',
+                                 ('kind', 'handler'), self.UPDATE_BUCKETS)
+        self.update_errors = Counter()
+        self.db_queries = Histogram('movie_bot_db_query_duration_seconds', 'Время выполнения метода MovieDatabase',
+                                    ('method',), self.DB_BUCKETS)
+        self.db_rows = Counter()
+        self.loop_lag = Histogram('movie_bot_event_loop_lag_seconds', 'Опоздание таймера цикла событий',
+                                  (), self.LAG_BUCKETS)
+        # Префикс -> (функция stats(), ключи-счетчики); остальные ключи - текущие значения
+        self._stats: Dict[str, Tuple[Callable, frozenset]] = {}
+    
+    def observe_update(self, kind: str, handler: str, seconds: float):
+        self.updates.observe((kind, handler), seconds)
+    
+    def observe_error(self, kind: str, handler: str, error: BaseException):
+        self.update_errors[(kind, handler, type(error).__name__)] += 1
+    
+    def observe_db(self, method: str, seconds: float, result):
+        self.db_queries.observe((method,), seconds)
+        if isinstance(result, list):
+            self.db_rows[method] += len(result)
+        elif isinstance(result, dict) and result:
+            self.db_rows[method] += 1
+    
+    def add_stats(self, prefix: str, stats: Callable, counters: Tuple[str, ...] = ()):
+        """Показ словаря stats() компонента как метрик movie_bot_<prefix>_<ключ>"""
+        self._stats[prefix] = (stats, frozenset(counters))
+    
+    async def monitor_loop_lag(self, interval: float = LOOP_LAG_INTERVAL):
+        """Замер задержки цикла событий: насколько позже срока просыпается asyncio.sleep"""
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            self.loop_lag.observe((), max(0.0, loop.time() - start - interval))
+    
+    def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus"""
+        lines = [
+            "# HELP movie_bot_start_time_seconds Время запуска бота (Unix)",
+            "# TYPE movie_bot_start_time_seconds gauge",
+            f"movie_bot_start_time_seconds {self.started_at:.3f}",
+        ]
+        self.updates.render(lines)
+        lines.append("# HELP movie_bot_update_errors_total Ошибки обработчиков обновлений")
+        lines.append("# TYPE movie_bot_update_errors_total counter")
+        for labels, count in self.update_errors.items():
+            pairs = format_metric_labels(('kind', 'handler', 'error'), labels)
+            lines.append(f"movie_bot_update_errors_total{{{pairs}}} {count}")
+        self.db_queries.render(lines)
+        lines.append("# HELP movie_bot_db_rows_total Строк, возвращенных методом MovieDatabase")
+        lines.append("# TYPE movie_bot_db_rows_total counter")
+        for method, count in self.db_rows.items():
+            lines.append(f'movie_bot_db_rows_total{{method="{method}"}} {count}')
+        self.loop_lag.render(lines)
+        
+        for prefix, (stats, counters) in self._stats.items():
+            try:
+                values = stats()
+            except Exception as e:
+                logger.error(f"Ошибка при сборе метрик {prefix}: {e}")
+                continue
+            for key, value in values.items():
+                if not isinstance(value, (int, float)):
+                    continue
+                if key in counters:
+                    name, kind = f"movie_bot_{prefix}_{key}_total", 'counter'
+                else:
+                    name, kind = f"movie_bot_{prefix}_{key}", 'gauge'
+                lines.append(f"# TYPE {name} {kind}")
+                lines.append(f"{name} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+# Инициализация базы данных
+metrics = Metrics()
+db = AsyncMovieDatabase(MovieDatabase())
+activity = ActivityBuffer(db)
+render_cache = RenderCache()
+throttle = UserThrottle()
+send_scheduler = SendScheduler()
+metrics.add_stats('activity', activity.stats, ('touches', 'commits'))
+metrics.add_stats('render_cache', render_cache.stats, ('hits', 'misses', 'evictions', 'coalesced'))
+metrics.add_stats('movie_cache', db.sync.movie_cache_stats, ('hits', 'misses', 'evictions', 'external_invalidations'))
+metrics.add_stats('throttle', throttle.stats, ('allowed', 'throttled', 'debounced'))
+metrics.add_stats('send', send_scheduler.stats, ('sent', 'queued', 'chat_delays', 'retries', 'failed'))
+metrics.add_stats('query_log', db.sync.query_log.stats, ('slow_queries', 'full_scans'))
+
+
+# ========== ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ==========
+# Лимит длины сообщения Telegram - в единицах UTF-16 (эмодзи вне BMP занимают две)
+MESSAGE_MAX_LENGTH = 4096
+# Название длиннее этого числа символов в списках обрезается
+TITLE_DISPLAY_LENGTH = 200
+# Сколько фильмов помещается в список format_movie_list
+MOVIE_LIST_MAX = 50
+
+
+def utf16_len(text: str) -> int:
+    """Длина текста так, как ее считает Telegram"""
+    return len(text.encode('utf-16-le')) // 2
+
+
+def shorten(text: str, limit: int = TITLE_DISPLAY_LENGTH) -> str:
+    """Обрезка строки до limit символов с многоточием"""
+    return text if len(text) <= limit else text[:limit - 1].rstrip() + '…'
+
+
+def _split_long_line(line: str, limit: int) -> Iterator[str]:
+    """Части строки не длиннее limit (UTF-16), разрыв по символам"""
+    if utf16_len(line) <= limit:
+        yield line
+        return
+    
+    piece, size = [], 0
+    for char in line:
+        char_size = 2 if ord(char) > 0xFFFF else 1
+        if size + char_size > limit:
+            yield ''.join(piece)
+            piece, size = [], 0
+        piece.append(char)
+        size += char_size
+    if piece:
+        yield ''.join(piece)
+
+
+def split_message(text: str, limit: int = MESSAGE_MAX_LENGTH) -> List[str]:
+    """Разбиение текста на сообщения не длиннее limit.
+
+    Текст режется по границам строк, строка длиннее лимита - по символам.
+    Для одного и того же текста результат всегда одинаков.
+    """
+    # Любой символ занимает не больше двух единиц UTF-16
+    if len(text) * 2 <= limit or utf16_len(text) <= limit:
+        return [text]
+    
+    chunks, lines, size = [], [], 0
+    for line in text.split('\n'):
+        for piece in _split_long_line(line, limit):
+            piece_size = utf16_len(piece)
+            if lines and size + 1 + piece_size > limit:
+                chunks.append('\n'.join(lines))
+                lines, size = [], 0
+            size += piece_size + (1 if lines else 0)
+            lines.append(piece)
+    if lines:
+        chunks.append('\n'.join(lines))
+    
+    # Telegram не принимает сообщения из одних пробелов и переносов
+    return [chunk for chunk in chunks if chunk.strip()] or [text[:limit // 2]]
+
+
+def truncate_message(text: str, limit: int = MESSAGE_MAX_LENGTH) -> str:
+    """Текст, обрезанный до limit по границе строки (для редактирования одного сообщения)"""
+    suffix = '\n…'
+    if len(text) * 2 <= limit or utf16_len(text) <= limit:
+        return text
+    return split_message(text, limit - utf16_len(suffix))[0] + suffix
+
+
+class MovieBot(ExtBot):
+    """Бот, соблюдающий лимит длины сообщения.
+
+    Текст длиннее MESSAGE_MAX_LENGTH отправляется несколькими сообщениями
+    (клавиатура - у последнего), а при редактировании обрезается: изменить
+    можно только одно сообщение. Обработчикам не нужно следить за длиной.
+    """
+    
+    async def send_message(self, chat_id, text: str, **kwargs):
+        chunks = split_message(text)
+        if len(chunks) > 1:
+            reply_markup = kwargs.pop('reply_markup', None)
+            for chunk in chunks[:-1]:
+                await super().send_message(chat_id, chunk, **kwargs)
+                # Ответом на исходное сообщение оформляется только первая часть
+                kwargs.pop('reply_to_message_id', None)
+            kwargs['reply_markup'] = reply_markup
+        return await super().send_message(chat_id, chunks[-1], **kwargs)
+    
+    async def edit_message_text(self, text: str, **kwargs):
+        return await super().edit_message_text(truncate_message(text), **kwargs)
+
+
+def format_movie_line(index: int, movie: Dict, show_status: bool = True,
+                      show_privacy: bool = False, show_priority: bool = False) -> str:
+    """Строка фильма в списке"""
+    parts = [f"{index}. "]
+    
+    if show_priority and movie.get('priority'):
+        parts.append("⭐" * movie['priority'] + " ")
+    
+    if show_privacy:
+        parts.append("👁️ " if movie.get('is_public', True) else "🔒 ")
+    
+    parts.append(shorten(movie['title']))
+    
+    if movie.get('genre'):
+        parts.append(f" ({movie['genre']})")
+    
+    if movie.get('year'):
+        parts.append(f" [{movie['year']}]")
+    
+    if show_status and movie.get('status') == 'watched':
+        parts.append(" ✅")
+        
+        if movie.get('rating'):
+            parts.append(f" ⭐{movie['rating']}/10")
+    
+    return ''.join(parts)
+
+
+def format_movie_list(movies: List[Dict], show_status: bool = True, 
+                      show_privacy: bool = False, show_priority: bool = False) -> str:
+    """Форматирование списка фильмов"""
+    if not movies:
+        return "Список пуст."
+    
+    lines = [format_movie_line(i, movie, show_status, show_privacy, show_priority)
+             for i, movie in enumerate(movies[:MOVIE_LIST_MAX], 1)]
+    text = '\n'.join(lines) + '\n'
+    
+    if len(movies) > MOVIE_LIST_MAX:
+        text += f"\n... и еще {len(movies) - MOVIE_LIST_MAX} фильмов"
+    
+    return text
+
+
+def format_public_movie_line(movie: Dict, index: int = None) -> str:
+    """Строка публичного фильма с иконкой статуса и именем владельца"""
+    user_name = movie.get('first_name') or f"User_{movie.get('user_id')}"
+    status_icon = "✅" if movie['status'] == 'watched' else "📝"
+    parts = [f"{index}. " if index else "", f"{status_icon} {shorten(movie['title'])}"]
+    
+    if movie.get('genre'):
+        parts.append(f" ({movie['genre']})")
+    
+    if movie.get('year'):
+        parts.append(f" [{movie['year']}]")
+    
+    parts.append(f" — {user_name}\n")
+    return ''.join(parts)
+
+
+def format_top_rated_line(movie: Dict) -> str:
+    """Строка экрана лучших фильмов: оценка, название и жанр"""
+    line = f"⭐{movie['rating']}/10 - {shorten(movie['title'])}\n"
+    if movie.get('genre'):
+        line += f"   ({movie['genre']})\n"
+    return line
+
+
+def format_counts(items: List[Tuple[str, int]], suffix: str = '') -> str:
+    """Список "• название: число" (жанры и т.п.), каждая строка с переносом"""
+    return ''.join([f"• {name}: {count}{suffix}\n" for name, count in items])
+
+
+# Клавиатуры неизменяемы, поэтому одинаковые экземпляры используются повторно
+KEYBOARD_CACHE_SIZE = 4096
+
+
+@functools.lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
+def create_movie_keyboard(movie_id: int, include_back_button: bool = True) -> InlineKeyboardMarkup:
+    """Создание клавиатуры для управления фильмом"""
+    keyboard = [
+        [
+            InlineKeyboardButton("✅ Просмотрен", callback_data=pack_callback(OP_WATCH, movie_id)),
+            InlineKeyboardButton("🔒 Приватность", callback_data=pack_callback(OP_PRIVATE, movie_id))
+        ],
+        [
+            InlineKeyboardButton("⭐ Приоритет", callback_data=pack_callback(OP_PRIORITY, movie_id))
+        ],
+        [
+            InlineKeyboardButton("🗑️ Удалить", callback_data=pack_callback(OP_DELETE, movie_id))
+        ]
+    ]
+    
+    if include_back_button:
+        keyboard.append([InlineKeyboardButton("📋 Вернуться к списку", callback_data=CB_MY_MOVIES)])
+    
+    return InlineKeyboardMarkup(keyboard)
+
+
+@functools.lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
+def create_priority_keyboard(movie_id: int) -> InlineKeyboardMarkup:
+    """Создание клавиатуры для выбора приоритета"""
+    keyboard = [
+        [
+            InlineKeyboardButton("⭐ 1", callback_data=pack_callback(OP_PRIORITY, movie_id, 1)),
+            InlineKeyboardButton("⭐⭐ 2", callback_data=pack_callback(OP_PRIORITY, movie_id, 2)),
+            InlineKeyboardButton("⭐⭐⭐ 3", callback_data=pack_callback(OP_PRIORITY, movie_id, 3))
+        ],
+        [
+            InlineKeyboardButton("⭐⭐⭐⭐ 4", callback_data=pack_callback(OP_PRIORITY, movie_id, 4)),
+            InlineKeyboardButton("⭐⭐⭐⭐⭐ 5", callback_data=pack_callback(OP_PRIORITY, movie_id, 5))
+        ],
+        [
+            InlineKeyboardButton("🔙 Назад", callback_data=pack_callback(OP_MOVIE_CARD, movie_id))
+        ]
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
+
+@functools.lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
+def create_rating_keyboard(movie_id: int) -> InlineKeyboardMarkup:
+    """Создание клавиатуры для оценки фильма"""
+    keyboard = [
+        [
+            InlineKeyboardButton("1 ⭐", callback_data=pack_callback(OP_RATE, movie_id, 1)),
+            InlineKeyboardButton("2 ⭐", callback_data=pack_callback(OP_RATE, movie_id, 2)),
+            InlineKeyboardButton("3 ⭐", callback_data=pack_callback(OP_RATE, movie_id, 3)),
+            InlineKeyboardButton("4 ⭐", callback_data=pack_callback(OP_RATE, movie_id, 4)),
+            InlineKeyboardButton("5 ⭐", callback_data=pack_callback(OP_RATE, movie_id, 5))
+        ],
+        [
+            InlineKeyboardButton("6 ⭐", callback_data=pack_callback(OP_RATE, movie_id, 6)),
+            InlineKeyboardButton("7 ⭐", callback_data=pack_callback(OP_RATE, movie_id, 7)),
+            InlineKeyboardButton("8 ⭐", callback_data=pack_callback(OP_RATE, movie_id, 8)),
+            InlineKeyboardButton("9 ⭐", callback_data=pack_callback(OP_RATE, movie_id, 9)),
+            InlineKeyboardButton("10 ⭐", callback_data=pack_callback(OP_RATE, movie_id, 10))
+        ],
+        [
+            InlineKeyboardButton("Без оценки", callback_data=pack_callback(OP_RATE, movie_id, 0)),
+            InlineKeyboardButton("🔙 Отмена", callback_data=pack_callback(OP_MOVIE_CARD, movie_id))
+        ]
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
+
+@functools.lru_cache(maxsize=1)
+def create_main_keyboard() -> InlineKeyboardMarkup:
+    """Создание основной клавиатуры"""
+    keyboard = [
+        [
+            InlineKeyboardButton("📋 Мои фильмы", callback_data=CB_MY_MOVIES),
+            InlineKeyboardButton("🎲 Случайный", callback_data=CB_RANDOM)
+        ],
+        [
+            InlineKeyboardButton("✅ Просмотренные", callback_data=CB_WATCHED),
+            InlineKeyboardButton("🔍 Поиск", callback_data=CB_SEARCH)
+        ],
+        [
+            InlineKeyboardButton("👁️ Публичный список", callback_data=CB_PUBLIC_LIST),
+            InlineKeyboardButton("📊 Статистика", callback_data=CB_STATS)
+        ],
+        [
+            InlineKeyboardButton("➕ Добавить фильм", callback_data=CB_ADD_MOVIE),
+            InlineKeyboardButton("❓ Помощь", callback_data=CB_HELP)
+        ]
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
+
+
+# Размер страницы в списках с кнопками "◀ / ▶"
+PAGE_SIZE = 10
+
+
+# ---------- Данные кнопок (callback_data) ----------
+# Формат: версия формата, код действия (один символ) и целые аргументы в base36
+# через точку. Например, "1r2n9c.7" - оценка 7 фильму 123456. Telegram ограничивает
+# callback_data 64 байтами, поэтому текст (жанр) передается не строкой, а по ID
+CALLBACK_VERSION = '1'
+BASE36_DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+# Коды действий с аргументами
+OP_FILTER_GENRE = 'f'   # ID жанра
+OP_WATCH = 'v'          # ID фильма
+OP_PRIVATE = 'i'        # ID фильма
+OP_DELETE = 'd'         # ID фильма
+OP_PRIORITY = 'o'       # ID фильма[, приоритет]
+OP_RATE = 'r'           # ID фильма, оценка
+OP_MOVIE_CARD = 'c'     # ID фильма
+OP_PAGE = 'p'           # список, направление[, курсор]
+OP_FILTERED_PAGE = 'P'  # список, направление, ID жанра (0 - нет), год (0 - нет)[, курсор]
+
+
+def to_base36(number: int) -> str:
+    """Целое в base36; отрицательное - со знаком "-", как его читает int(text, 36)"""
+    if number == 0:
+        return '0'
+    if number < 0:
+        return '-' + to_base36(-number)
+    digits = []
+    while number:
+        number, remainder = divmod(number, 36)
+        digits.append(BASE36_DIGITS[remainder])
+    return ''.join(reversed(digits))
+
+
+def pack_callback(op: str, *args: int) -> str:
+    """callback_data кнопки: версия, код действия и аргументы"""
+    return CALLBACK_VERSION + op + '.'.join([to_base36(arg) for arg in args])
+
+
+def unpack_args(text: str) -> List[int]:
+    """Аргументы из callback_data (часть после кода действия)"""
+    return [int(part, 36) for part in text.split('.')] if text else []
+
+
+# Кнопки без аргументов
+CB_MAIN_MENU = pack_callback('m')
+CB_MY_MOVIES = pack_callback('y')
+CB_WATCHED = pack_callback('w')
+CB_RANDOM = pack_callback('x')
+CB_SEARCH = pack_callback('s')
+CB_SEARCH_PUBLIC_MENU = pack_callback('q')
+CB_SEARCH_PUBLIC = pack_callback('Q')
+CB_PUBLIC_LIST = pack_callback('u')
+CB_STATS = pack_callback('t')
+CB_ADD_MOVIE = pack_callback('a')
+CB_HELP = pack_callback('h')
+CB_SHOW_GENRES = pack_callback('g')
+CB_MY_GENRES = pack_callback('G')
+CB_TOP_RATED = pack_callback('T')
+
+# Списки с постраничным просмотром (аргумент OP_PAGE) и направления
+PAGE_LISTS = ('want', 'watched', 'public', 'top')
+PAGE_NEXT, PAGE_PREV = 0, 1
+
+
+def encode_page_cursor(movie: Dict, with_priority: bool = True) -> List[int]:
+    """Курсор страницы для callback_data: [приоритет,] время добавления (Unix, до 1970 года - отрицательное), ID"""
+    added = datetime.strptime(movie['added_date'], '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+    parts = [movie['priority']] if with_priority else []
+    parts += [int(added.timestamp()), movie['id']]
+    return parts
+
+
+def decode_page_cursor(parts: List[int]) -> Optional[Tuple]:
+    """Разбор курсора из callback_data в ключ сортировки базы данных"""
+    if not parts:
+        return None
+    *head, added, movie_id = parts
+    # isoformat, а не strftime('%Y'): год до 1000 должен быть дополнен нулями, как в базе
+    added_date = datetime.fromtimestamp(added, timezone.utc).replace(tzinfo=None).isoformat(' ', 'seconds')
+    return (*head, added_date, movie_id)
+
+
+def list_page_cursor(list_name: str, movie: Dict) -> List[int]:
+    """Курсор фильма в списке list_name: для лучших фильмов - [оценка, ID]"""
+    if list_name == 'top':
+        return [movie['rating'], movie['id']]
+    return encode_page_cursor(movie, list_name != 'public')
+
+
+def unpack_filtered_page_args(text: str) -> List[int]:
+    """Аргументы OP_FILTERED_PAGE: номер списка в PAGE_LISTS, направление, ID жанра, год и курсор"""
+    args = unpack_args(text)
+    if not 0 <= args[0] < len(PAGE_LISTS):
+        raise ValueError(f"Неизвестный список: {args[0]}")
+    return args
+
+
+def unpack_page_args(text: str) -> List[int]:
+    """Аргументы OP_PAGE: номер списка, направление и курсор; фильтры (нули) добавляются как у OP_FILTERED_PAGE"""
+    list_index, direction, *cursor = unpack_filtered_page_args(text)
+    return [list_index, direction, 0, 0, *cursor]
+
+
+def page_callback(list_name: str, direction: int = PAGE_NEXT, cursor: List[int] = (),
+                  genre_id: int = 0, year: int = 0) -> str:
+    """callback_data страницы списка list_name (с фильтром по жанру и году, если они заданы)"""
+    if genre_id or year:
+        return pack_callback(OP_FILTERED_PAGE, PAGE_LISTS.index(list_name), direction, genre_id, year, *cursor)
+    return pack_callback(OP_PAGE, PAGE_LISTS.index(list_name), direction, *cursor)
+
+
+def create_page_buttons(list_name: str, movies: List[Dict], has_prev: bool, has_next: bool,
+                        genre_id: int = 0, year: int = 0) -> List:
+    """Кнопки "◀ / ▶" страницы списка из PAGE_LISTS"""
+    row = []
+    if movies and has_prev:
+        cursor = list_page_cursor(list_name, movies[0])
+        row.append(InlineKeyboardButton("◀", callback_data=page_callback(list_name, PAGE_PREV, cursor,
+                                                                         genre_id, year)))
+    if movies and has_next:
+        cursor = list_page_cursor(list_name, movies[-1])
+        row.append(InlineKeyboardButton("▶", callback_data=page_callback(list_name, PAGE_NEXT, cursor,
+                                                                         genre_id, year)))
+    return row
+
+
+class CallbackRouter:
+    """Таблица обработчиков кнопок.
+
+    Точные значения callback_data ищутся в словаре, остальные - по самому длинному
+    зарегистрированному префиксу в префиксном дереве. Обработчик получает аргументы,
+    разобранные функцией parse из части данных после префикса.
+    """
+    
+    def __init__(self):
+        self._exact: Dict[str, Tuple[Callable, Callable]] = {}
+        self._trie: Dict = {}
+    
+    def exact(self, *values: str):
+        """Регистрация обработчика для точных значений callback_data"""
+        def register(handler: Callable) -> Callable:
+            for value in values:
+                self._exact[value] = (handler, None)
+            return handler
+        return register
+    
+    def prefix(self, prefix: str, parse: Callable = unpack_args):
+        """Регистрация обработчика для данных, начинающихся с prefix"""
+        def register(handler: Callable) -> Callable:
+            node = self._trie
+            for char in prefix:
+                node = node.setdefault(char, {})
+            node[None] = (handler, parse, *self._arity(handler))
+            return handler
+        return register
+    
+    @staticmethod
+    def _arity(handler: Callable) -> Tuple[int, float]:
+        """Наименьшее и наибольшее число аргументов обработчика после update и context"""
+        params = list(inspect.signature(handler).parameters.values())[2:]
+        required = sum(1 for param in params
+                       if param.kind == param.POSITIONAL_OR_KEYWORD and param.default is param.empty)
+        if any(param.kind == param.VAR_POSITIONAL for param in params):
+            return required, float('inf')
+        return required, len(params)
+    
+    def resolve(self, data: str) -> Tuple[Optional[Callable], List]:
+        """Обработчик и аргументы для callback_data; (None, []), если данные не распознаны"""
+        route = self._exact.get(data)
+        if route is not None:
+            return route[0], []
+        
+        node, depth, end = self._trie, 0, 0
+        for char in data:
+            node = node.get(char)
+            if node is None:
+                break
+            depth += 1
+            if None in node:
+                route, end = node[None], depth
+                # Более длинных префиксов за этим узлом нет
+                if len(node) == 1:
+                    break
+        
+        if route is None:
+            return None, []
+        
+        handler, parse, min_args, max_args = route
+        try:
+            args = parse(data[end:])
+        except (ValueError, IndexError):
+            return None, []
+        if not min_args <= len(args) <= max_args:
+            return None, []
+        return handler, args
+
+
+callback_router = CallbackRouter()
+
+
+def legacy_int_args(text: str) -> List[int]:
+    """Аргументы кнопок прежнего формата: "123_5" """
+    return [int(part) for part in text.split('_')]
+
+
+def legacy_genre_args(text: str) -> List[str]:
+    """Аргумент кнопки жанра прежнего формата: название жанра"""
+    return [text]
+
+
+# Маркер пункта списка в начале строки: "-", "•", "*" или номер "1." / "1)"
+LIST_MARKER_PATTERN = re.compile(r'^\s*(?:[-•*–—]|\d{1,3}[.)])\s+')
+
+
+def parse_movie_line(text: str) -> Tuple[str, Optional[str], Optional[int]]:
+    """Разбор строки "Название, жанр, год" (жанр и год необязательны)"""
+    parts = [part.strip() for part in LIST_MARKER_PATTERN.sub('', text).split(',')]
+    title = parts[0]
+    genre = parts[1] if len(parts) > 1 and parts[1] else None
+    year = None
+    
+    if len(parts) > 2:
+        try:
+            year = int(parts[2])
+        except ValueError:
+            year = None
+    
+    return title, genre, year
+
 
-# Инициализация базы данных
-db = MovieDatabase()
+# Названия колонок файла импорта (в нижнем регистре) и соответствующие поля фильма
+IMPORT_FIELD_ALIASES = {
+    'title': 'title', 'name': 'title', 'название': 'title', 'фильм': 'title',
+    'genre': 'genre', 'genres': 'genre', 'жанр': 'genre',
+    'year': 'year', 'год': 'year',
+    'rating': 'rating', 'оценка': 'rating',
+    'status': 'status', 'статус': 'status',
+    'priority': 'priority', 'приоритет': 'priority',
+    'is_public': 'is_public', 'public': 'is_public', 'публичный': 'is_public',
+    'notes': 'notes', 'review': 'notes', 'заметки': 'notes',
+    'added_date': 'added_date', 'date': 'added_date', 'дата': 'added_date',
+    'watched_date': 'watched_date', 'watched date': 'watched_date', 'дата просмотра': 'watched_date',
+}
+# Порядок полей в CSV без заголовка - как при добавлении фильма сообщением
+IMPORT_POSITIONAL_FIELDS = ('title', 'genre', 'year')
+IMPORT_FALSE_VALUES = {'0', 'false', 'no', 'нет', 'private', 'приватный'}
+IMPORT_WATCHED_VALUES = {'watched', 'просмотрен', 'просмотрено', 'yes', 'да', '1', 'true'}
 
 
-# ========== ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ==========
-def format_movie_list(movies: List[Dict], show_status: bool = True, 
-                      show_privacy: bool = False, show_priority: bool = False) -> str:
-    """Форматирование списка фильмов"""
-    if not movies:
-        return "Список пуст."
+IMPORT_DATE_PATTERN = re.compile(r'(\d{4})-(\d{1,2})-(\d{1,2})(?:[ T](\d{1,2}):(\d{2})(?::(\d{2}))?)?')
+# Допустимые даты импорта: раньше 1970 года или позже текущего времени (с запасом на часовые пояса)
+# обычно оказывается дата выхода фильма не в той колонке и нарушает порядок списков
+IMPORT_DATE_MIN = datetime(1970, 1, 1)
+IMPORT_DATE_MAX_AHEAD = timedelta(days=1)
+
+
+def parse_import_date(value) -> Optional[str]:
+    """Дата из файла импорта в формате базы ('%Y-%m-%d %H:%M:%S') или None (тогда - текущее время).
+
+    Даты вне диапазона от IMPORT_DATE_MIN до текущего времени плюс IMPORT_DATE_MAX_AHEAD отбрасываются.
+    """
+    match = IMPORT_DATE_PATTERN.match(str(value).strip()) if value else None
+    if not match:
+        return None
+    try:
+        date = datetime(*(int(part or 0) for part in match.groups()))
+    except ValueError:
+        return None
+    if not IMPORT_DATE_MIN <= date <= datetime.now(timezone.utc).replace(tzinfo=None) + IMPORT_DATE_MAX_AHEAD:
+        return None
+    return date.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def normalize_import_record(record: Dict, watched: bool = False, rating_scale: float = 1) -> Optional[Tuple]:
+    """Запись файла импорта -> кортеж полей MovieDatabase.BATCH_COLUMNS (None, если запись негодна).
+
+    watched - статус по умолчанию (просмотренные в выгрузке Letterboxd), rating_scale -
+    множитель оценки (в Letterboxd оценки от 0.5 до 5).
+    """
+    title = str(record.get('title') or '').strip()
+    if len(title) < 2:
+        return None
     
-    text = ""
-    for i, movie in enumerate(movies[:50], 1):
-        line = f"{i}. "
-        
-        if show_priority and movie.get('priority'):
-            line += f"⭐" * movie['priority'] + " "
-        
-        if show_privacy:
-            line += "👁️ " if movie.get('is_public', True) else "🔒 "
-        
-        line += movie['title']
-        
-        if movie.get('genre'):
-            line += f" ({movie['genre']})"
-        
-        if movie.get('year'):
-            line += f" [{movie['year']}]"
-        
-        if show_status and movie.get('status') == 'watched':
-            line += " ✅"
-            
-            if movie.get('rating'):
-                line += f" ⭐{movie['rating']}/10"
-        
-        text += line + "\n"
+    genre = str(record.get('genre') or '').strip() or None
     
-    if len(movies) > 50:
-        text += f"\n... и еще {len(movies) - 50} фильмов"
+    try:
+        year = int(str(record.get('year')).strip()[:4])
+    except (TypeError, ValueError):
+        year = None
     
-    return text
+    try:
+        rating = round(float(str(record.get('rating')).replace(',', '.')) * rating_scale)
+        rating = min(max(rating, 0), 10)
+    except (TypeError, ValueError):
+        rating = None
+    
+    try:
+        priority = min(max(int(record.get('priority')), 1), 5)
+    except (TypeError, ValueError):
+        priority = 3
+    
+    status = str(record.get('status') or '').strip().lower()
+    if status:
+        watched = status in IMPORT_WATCHED_VALUES
+    watched = watched or bool(rating) or bool(record.get('watched_date'))
+    
+    is_public = 0 if str(record.get('is_public', '')).strip().lower() in IMPORT_FALSE_VALUES else 1
+    notes = str(record.get('notes') or '').strip() or None
+    added_date = parse_import_date(record.get('added_date'))
+    watched_date = (parse_import_date(record.get('watched_date')) or added_date) if watched else None
+    
+    return (title, genre, year, rating, 'watched' if watched else 'want_to_watch', is_public, priority,
+            notes, added_date, watched_date)
 
 
-def create_movie_keyboard(movie_id: int, include_back_button: bool = True) -> InlineKeyboardMarkup:
-    """Создание клавиатуры для управления фильмом"""
-    keyboard = [
-        [
-            InlineKeyboardButton("✅ Просмотрен", callback_data=f"watch_{movie_id}"),
-            InlineKeyboardButton("🔒 Приватность", callback_data=f"private_{movie_id}")
-        ],
-        [
-            InlineKeyboardButton("⭐ Приоритет", callback_data=f"priority_{movie_id}")
-        ],
-        [
-            InlineKeyboardButton("🗑️ Удалить", callback_data=f"delete_{movie_id}")
-        ]
-    ]
+def iter_import_records(stream, file_name: str) -> Iterator[Optional[Tuple]]:
+    """Построчный разбор файла импорта: CSV (в т.ч. выгрузка Letterboxd), JSON Lines или JSON.
+
+    Выдает кортежи для add_movies_batch или None для негодных записей. CSV и JSON Lines
+    читаются по одной строке, JSON-массив - по одному элементу (iter_json_array).
+    """
+    name = (file_name or '').lower()
+    sample = stream.read(4096)
+    stream.seek(0)
+    first_char = sample.lstrip()[:1]
+    
+    if name.endswith(('.jsonl', '.ndjson')) or (first_char == '{' and not name.endswith('.json')):
+        for line in stream:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                yield None
+                continue
+            yield _normalize_json_record(record)
+        return
     
-    if include_back_button:
-        keyboard.append([InlineKeyboardButton("📋 Вернуться к списку", callback_data="my_movies")])
+    if name.endswith('.json') or first_char == '[':
+        # Элементы до ошибки в JSON импортируются, остаток файла считается одной негодной записью
+        try:
+            for record in iter_json_array(stream):
+                yield _normalize_json_record(record)
+        except ValueError:
+            yield None
+        return
     
-    return InlineKeyboardMarkup(keyboard)
-
-
-def create_priority_keyboard(movie_id: int) -> InlineKeyboardMarkup:
-    """Создание клавиатуры для выбора приоритета"""
-    keyboard = [
-        [
-            InlineKeyboardButton("⭐ 1", callback_data=f"priority_{movie_id}_1"),
-            InlineKeyboardButton("⭐⭐ 2", callback_data=f"priority_{movie_id}_2"),
-            InlineKeyboardButton("⭐⭐⭐ 3", callback_data=f"priority_{movie_id}_3")
-        ],
-        [
-            InlineKeyboardButton("⭐⭐⭐⭐ 4", callback_data=f"priority_{movie_id}_4"),
-            InlineKeyboardButton("⭐⭐⭐⭐⭐ 5", callback_data=f"priority_{movie_id}_5")
-        ],
-        [
-            InlineKeyboardButton("🔙 Назад", callback_data=f"movie_back_{movie_id}")
-        ]
-    ]
-    return InlineKeyboardMarkup(keyboard)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.reader(stream, dialect)
+    header = next(reader, None)
+    if header is None:
+        return
+    
+    columns = [IMPORT_FIELD_ALIASES.get(column.strip().lower()) for column in header]
+    # Выгрузка Letterboxd: watchlist.csv - "хочу посмотреть", остальные файлы - просмотренные
+    letterboxd = any(column.strip().lower() == 'letterboxd uri' for column in header)
+    watched = letterboxd and 'watchlist' not in name
+    rating_scale = 2 if letterboxd else 1
+    
+    if 'title' not in columns:
+        # Файл без заголовка: "название, жанр, год"
+        columns = list(IMPORT_POSITIONAL_FIELDS)
+        yield normalize_import_record(dict(zip(columns, header)))
+    
+    for row in reader:
+        if not any(cell.strip() for cell in row):
+            continue
+        record = {field: value for field, value in zip(columns, row) if field}
+        yield normalize_import_record(record, watched, rating_scale)
 
 
-def create_rating_keyboard(movie_id: int) -> InlineKeyboardMarkup:
-    """Создание клавиатуры для оценки фильма"""
-    keyboard = [
-        [
-            InlineKeyboardButton("1 ⭐", callback_data=f"rate_{movie_id}_1"),
-            InlineKeyboardButton("2 ⭐", callback_data=f"rate_{movie_id}_2"),
-            InlineKeyboardButton("3 ⭐", callback_data=f"rate_{movie_id}_3"),
-            InlineKeyboardButton("4 ⭐", callback_data=f"rate_{movie_id}_4"),
-            InlineKeyboardButton("5 ⭐", callback_data=f"rate_{movie_id}_5")
-        ],
-        [
-            InlineKeyboardButton("6 ⭐", callback_data=f"rate_{movie_id}_6"),
-            InlineKeyboardButton("7 ⭐", callback_data=f"rate_{movie_id}_7"),
-            InlineKeyboardButton("8 ⭐", callback_data=f"rate_{movie_id}_8"),
-            InlineKeyboardButton("9 ⭐", callback_data=f"rate_{movie_id}_9"),
-            InlineKeyboardButton("10 ⭐", callback_data=f"rate_{movie_id}_10")
-        ],
-        [
-            InlineKeyboardButton("Без оценки", callback_data=f"rate_{movie_id}_0"),
-            InlineKeyboardButton("🔙 Отмена", callback_data=f"movie_back_{movie_id}")
-        ]
-    ]
-    return InlineKeyboardMarkup(keyboard)
+def iter_json_array(stream, read_size: int = 64 * 1024) -> Iterator:
+    """Элементы JSON-массива из текстового потока по одному.
 
+    Поток читается кусками по read_size, в памяти остаются только непрочитанный
+    остаток куска и текущий элемент. Документ, который не является массивом,
+    выдается одним элементом. Ошибка в JSON - ValueError.
+    """
+    decoder = json.JSONDecoder()
+    buffer = stream.read(read_size).lstrip()
+    if not buffer.startswith('['):
+        yield json.loads(buffer + stream.read())
+        return
+    
+    pos, eof, need_comma = 1, False, False
+    while True:
+        while pos < len(buffer) and buffer[pos] in ' \t\r\n':
+            pos += 1
+        if pos == len(buffer):
+            if eof:
+                raise ValueError("Незавершенный JSON-массив")
+            data = stream.read(read_size)
+            buffer, pos, eof = data, 0, not data
+            continue
+        
+        if buffer[pos] == ']':
+            return
+        if need_comma:
+            if buffer[pos] != ',':
+                raise ValueError(f"Ожидалась запятая между элементами JSON-массива: {buffer[pos:pos + 20]!r}")
+            pos, need_comma = pos + 1, False
+            continue
+        
+        # Элемент, обрезанный концом куска, разбирается заново после дочитывания; кусок
+        # растет вдвое, чтобы большой элемент не разбирался заново на каждые read_size символов.
+        # Элемент принимается, только если за ним разделитель: обрезанное число ("12." из "12.5")
+        # разбирается без ошибки
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+                if eof or (end < len(buffer) and buffer[end] in ' \t\r\n,]'):
+                    break
+            except ValueError:
+                if eof:
+                    raise
+            data = stream.read(max(read_size, len(buffer) - pos))
+            buffer, pos, eof = buffer[pos:] + data, 0, not data
+        
+        yield value
+        pos, need_comma = end, True
+        if pos >= read_size:
+            buffer, pos = buffer[pos:], 0
 
-def create_main_keyboard() -> InlineKeyboardMarkup:
-    """Создание основной клавиатуры"""
-    keyboard = [
-        [
-            InlineKeyboardButton("📋 Мои фильмы", callback_data="my_movies"),
-            InlineKeyboardButton("🎲 Случайный", callback_data="random_movie")
-        ],
-        [
-            InlineKeyboardButton("✅ Просмотренные", callback_data="watched"),
-            InlineKeyboardButton("🔍 Поиск", callback_data="search_movies")
-        ],
-        [
-            InlineKeyboardButton("👁️ Публичный список", callback_data="public_list"),
-            InlineKeyboardButton("📊 Статистика", callback_data="stats")
-        ],
-        [
-            InlineKeyboardButton("➕ Добавить фильм", callback_data="add_movie"),
-            InlineKeyboardButton("❓ Помощь", callback_data="help")
-        ]
-    ]
-    return InlineKeyboardMarkup(keyboard)
 
+def _normalize_json_record(record) -> Optional[Tuple]:
+    """Запись JSON: объект с полями фильма или просто название"""
+    if isinstance(record, str):
+        return normalize_import_record({'title': record})
+    if not isinstance(record, dict):
+        return None
+    return normalize_import_record({IMPORT_FIELD_ALIASES.get(key.strip().lower()): value
+                                    for key, value in record.items() if isinstance(key, str)})
 
 # ========== ОСНОВНЫЕ КОМАНДЫ БОТА ==========
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -592,8 +3339,8 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     
     # Регистрация/обновление пользователя
-    db.add_or_update_user(user.id, user.username, user.first_name, user.language_code)
-    db.update_user_activity(user.id)
+    await db.add_or_update_user(user.id, user.username, user.first_name, user.language_code)
+    activity.touch(user.id)
     
     welcome_text = f"""
 🎬 Добро пожаловать, {user.first_name}!
@@ -635,12 +3382,15 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 /watched - Просмотренные фильмы
 /random - Случайный фильм из списка
 /stats - Статистика
+/import - Импорт списка из файла
+/export - Выгрузка списка в файл (/export json - в JSON Lines)
 /help - Эта справка
 
 **Формат добавления фильма:**
 "Название фильма"
 "Название, жанр"
 "Название, жанр, год"
+Несколько фильмов - по одному в строке
 
 **Примеры:**
 Интерстеллар
@@ -663,11 +3413,11 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def add_movie_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /add и текстовых сообщений"""
     user = update.effective_user
-    db.update_user_activity(user.id)
+    activity.touch(user.id)
     
-    # Получение текста
+    # Получение текста (после /add - с сохранением переносов строк)
     if context.args:
-        text = ' '.join(context.args)
+        text = update.message.text.split(maxsplit=1)[1]
     elif update.message.text and not update.message.text.startswith('/'):
         text = update.message.text
     else:
@@ -681,17 +3431,14 @@ async def add_movie_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
     
-    # Парсинг входных данных
-    parts = [part.strip() for part in text.split(',')]
-    title = parts[0]
-    genre = parts[1] if len(parts) > 1 else None
-    year = None
+    # Несколько строк - список фильмов, по одному в строке
+    lines = [line for line in text.splitlines() if line.strip()]
+    if len(lines) > 1:
+        await add_movie_list(update, user.id, lines)
+        return
     
-    if len(parts) > 2:
-        try:
-            year = int(parts[2])
-        except ValueError:
-            year = None
+    # Парсинг входных данных
+    title, genre, year = parse_movie_line(text)
     
     if not title or len(title) < 2:
         await update.message.reply_text(
@@ -700,13 +3447,10 @@ async def add_movie_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
     
-    # Добавление фильма
-    movie_id = db.add_movie(user.id, title, genre, year)
+    # Добавление фильма: база сразу возвращает добавленную строку
+    movie_info = await db.add_movie(user.id, title, genre, year)
     
-    if movie_id:
-        # Получаем информацию о фильме для подтверждения
-        movie_info = db.get_movie_by_id(user.id, movie_id)
-        
+    if movie_info:
         response_text = (
             f"✅ Фильм добавлен!\n\n"
             f"🎬 **{movie_info['title']}**\n"
@@ -727,7 +3471,7 @@ async def add_movie_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         await update.message.reply_text(
             response_text,
-            reply_markup=create_movie_keyboard(movie_id)
+            reply_markup=create_movie_keyboard(movie_info['id'])
         )
     else:
         await update.message.reply_text(
@@ -736,10 +3480,220 @@ async def add_movie_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
 
+async def import_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /import"""
+    activity.touch(update.effective_user.id)
+    
+    await update.message.reply_text(
+        "📥 **Импорт списка фильмов**\n\n"
+        "Отправьте файл со списком, и я добавлю все фильмы сразу.\n\n"
+        "Поддерживаются:\n"
+        "• CSV с колонками title, genre, year, rating, status, priority, notes\n"
+        "  (или без заголовка: название, жанр, год)\n"
+        "• JSON или JSON Lines с теми же полями\n"
+        "• Выгрузка Letterboxd: watchlist.csv, watched.csv, ratings.csv, diary.csv\n\n"
+        "Фильмы, которые уже есть в вашем списке, пропускаются.",
+        reply_markup=create_main_keyboard()
+    )
+
+
+async def import_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Импорт фильмов из присланного файла"""
+    user = update.effective_user
+    activity.touch(user.id)
+    document = update.message.document
+    
+    if document.file_size and document.file_size > IMPORT_MAX_BYTES:
+        await update.message.reply_text(
+            f"❌ Файл слишком большой (максимум {IMPORT_MAX_BYTES // (1024 * 1024)} МБ).",
+            reply_markup=create_main_keyboard()
+        )
+        return
+    
+    if context.user_data.get('import_running'):
+        await update.message.reply_text("⏳ Предыдущий импорт еще не завершен, подождите.")
+        return
+    
+    context.user_data['import_running'] = True
+    progress = await update.message.reply_text("⏳ Загружаю файл...")
+    try:
+        # Небольшие файлы остаются в памяти, большие сбрасываются на диск
+        with tempfile.SpooledTemporaryFile(max_size=1024 * 1024) as buffer:
+            telegram_file = await document.get_file()
+            await telegram_file.download_to_memory(out=buffer)
+            buffer.seek(0)
+            stream = io.TextIOWrapper(buffer, encoding='utf-8-sig', errors='replace', newline='')
+            result = await import_movies(user.id, iter_import_records(stream, document.file_name), progress)
+    except Exception as e:
+        logger.error(f"Ошибка при импорте файла {document.file_name}: {e}")
+        await progress.edit_text("❌ Не удалось прочитать файл. Проверьте формат и попробуйте еще раз.")
+        return
+    finally:
+        context.user_data['import_running'] = False
+    
+    text = "✅ Импорт завершен!\n\n" if not result['failed'] else "⚠️ Импорт прерван из-за ошибки базы данных.\n\n"
+    text += f"• Добавлено фильмов: {result['added']}\n"
+    text += f"• Уже были в списке: {result['duplicates']}\n"
+    if result['invalid']:
+        text += f"• Пропущено строк с ошибками: {result['invalid']}\n"
+    
+    await progress.edit_text(text, reply_markup=create_main_keyboard())
+
+
+async def import_movies(user_id: int, records: Iterator[Optional[Tuple]], progress) -> Dict:
+    """Запись разобранных фильмов пачками по IMPORT_CHUNK_ROWS с обновлением сообщения progress.
+
+    Файл разбирается в пуле потоков по пачке за раз: чтение и разбор большого файла
+    не останавливают цикл событий. Пачки разбираются по очереди, поэтому records
+    не используется двумя потоками сразу.
+    """
+    result = {'added': 0, 'duplicates': 0, 'invalid': 0, 'failed': False}
+    records = iter(records)
+    last_update = time.monotonic()
+    loop = asyncio.get_running_loop()
+    
+    def read_chunk() -> List[Tuple]:
+        chunk = []
+        for record in records:
+            if record is None:
+                result['invalid'] += 1
+                continue
+            chunk.append(record)
+            if len(chunk) >= IMPORT_CHUNK_ROWS:
+                break
+        return chunk
+    
+    while True:
+        chunk = await loop.run_in_executor(None, read_chunk)
+        if not chunk:
+            return result
+        
+        added = await db.add_movies_batch(user_id, chunk)
+        if added < 0:
+            result['failed'] = True
+            return result
+        result['added'] += added
+        result['duplicates'] += len(chunk) - added
+        
+        if time.monotonic() - last_update >= IMPORT_PROGRESS_INTERVAL:
+            last_update = time.monotonic()
+            try:
+                await progress.get_bot().edit_message_text(
+                    f"⏳ Импортирую... обработано {result['added'] + result['duplicates']}, "
+                    f"добавлено {result['added']}",
+                    chat_id=progress.chat_id,
+                    message_id=progress.message_id,
+                    rate_limit_args=PRIORITY_BULK
+                )
+            except Exception as e:
+                logger.warning(f"Не удалось обновить ход импорта: {e}")
+
+
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /export: список пользователя файлом CSV или JSON Lines"""
+    user = update.effective_user
+    activity.touch(user.id)
+    
+    fmt = 'jsonl' if context.args and context.args[0].lower() in ('json', 'jsonl') else 'csv'
+    await send_movies_export(update.message, fmt, user.id, f"movies_{user.id}.{fmt}")
+
+
+async def dump_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Выгрузка всей таблицы фильмов (только для администраторов)"""
+    user = update.effective_user
+    if user.id not in ADMIN_IDS:
+        await update.message.reply_text("❌ Команда доступна только администраторам.")
+        return
+    
+    fmt = 'jsonl' if context.args and context.args[0].lower() in ('json', 'jsonl') else 'csv'
+    file_name = f"movies_dump_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{fmt}.gz"
+    await send_movies_export(update.message, fmt, None, file_name, compress=True)
+
+
+async def send_movies_export(message, fmt: str, user_id: Optional[int], file_name: str, compress: bool = False):
+    """Выгрузка фильмов во временный файл и отправка его документом.
+
+    Файл до 1 МБ остается в памяти, больший сбрасывается на диск. Выгрузку,
+    которую Telegram не примет по размеру, администратор получает рядом с базой.
+    """
+    with tempfile.SpooledTemporaryFile(max_size=1024 * 1024) as buffer:
+        raw = gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=6) if compress else buffer
+        # BOM в CSV нужен Excel, чтобы правильно показать кириллицу; импорт его пропускает
+        stream = io.TextIOWrapper(raw, encoding='utf-8-sig' if fmt == 'csv' else 'utf-8', newline='')
+        count = await db.export_movies(stream, fmt, user_id)
+        stream.flush()
+        stream.detach()
+        if compress:
+            raw.close()
+        
+        if count < 0:
+            await message.reply_text("❌ Не удалось выгрузить фильмы. Попробуйте позже.")
+            return
+        
+        if count == 0:
+            await message.reply_text(
+                "📭 Фильмов для выгрузки нет.",
+                reply_markup=create_main_keyboard()
+            )
+            return
+        
+        size = buffer.tell()
+        buffer.seek(0)
+        
+        if size > EXPORT_MAX_UPLOAD_BYTES:
+            if user_id is not None:
+                await message.reply_text("❌ Список слишком большой для отправки файлом.")
+                return
+            path = os.path.join(os.path.dirname(os.path.abspath(DB_NAME)), file_name)
+            with open(path, 'wb') as target:
+                shutil.copyfileobj(buffer, target)
+            await message.reply_text(f"💾 Выгрузка ({size / (1024 * 1024):.1f} МБ) больше лимита Telegram "
+                                     f"и сохранена на сервере: {path}")
+            return
+        
+        # Файл - фоновое сообщение: в общей очереди ответы на кнопки отправляются раньше него
+        await message.get_bot().send_document(
+            message.chat_id,
+            document=buffer,
+            filename=file_name,
+            caption=f"📤 Фильмов в выгрузке: {count}",
+            rate_limit_args=PRIORITY_BULK
+        )
+
+
+async def add_movie_list(update: Update, user_id: int, lines: List[str]):
+    """Добавление списка фильмов из многострочного сообщения одной транзакцией"""
+    movies = []
+    rejected = 0
+    for line in lines:
+        title, genre, year = parse_movie_line(line)
+        movie = normalize_import_record({'title': title, 'genre': genre, 'year': year})
+        if movie is None:
+            rejected += 1
+        else:
+            movies.append(movie)
+    
+    added = await db.add_movies_batch(user_id, movies) if movies else 0
+    if added < 0:
+        await update.message.reply_text(
+            "❌ Не удалось добавить фильмы. Попробуйте позже.",
+            reply_markup=create_main_keyboard()
+        )
+        return
+    
+    text = f"✅ Добавлено фильмов: {added} из {len(lines)}\n"
+    if len(movies) > added:
+        text += f"• Уже были в списке: {len(movies) - added}\n"
+    if rejected:
+        text += f"• Не распознано строк: {rejected} (название короче 2 символов)\n"
+    
+    await update.message.reply_text(text, reply_markup=create_main_keyboard())
+
+
 async def show_my_movies_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать все фильмы пользователя"""
     user = update.effective_user
-    db.update_user_activity(user.id)
+    activity.touch(user.id)
     
     # Получаем фильмы с фильтрацией по аргументам
     status_filter = None
@@ -758,11 +3712,12 @@ async def show_my_movies_command(update: Update, context: ContextTypes.DEFAULT_T
             else:
                 genre_filter = arg
     
-    want_movies = db.get_user_movies(user.id, status='want_to_watch', genre=genre_filter, year=year_filter)
-    watched_movies = db.get_user_movies(user.id, status='watched', genre=genre_filter, year=year_filter)
-    
-    # Получаем статистику
-    stats = db.get_user_stats(user.id)
+    # Первая страница каждого списка (и один фильм сверх нее - признак следующей страницы),
+    # счетчики и наличие жанров - одним запросом
+    overview = await db.get_movies_overview(user.id, PAGE_SIZE + 1, PAGE_SIZE + 1, genre_filter, year_filter)
+    want_movies, watched_movies = overview['want'], overview['watched']
+    want_count, watched_count = overview['want_total'], overview['watched_total']
+    stats = overview['stats']
     
     # Формируем ответ
     text = f"🎬 **Ваши фильмы**\n\n"
@@ -772,14 +3727,20 @@ async def show_my_movies_command(update: Update, context: ContextTypes.DEFAULT_T
     if year_filter:
         text += f"📅 Фильтр: {year_filter} год\n"
     
-    text += f"📝 **Хочу посмотреть ({len(want_movies)}):**\n"
-    text += format_movie_list(want_movies[:10], show_status=False, show_privacy=True, show_priority=True)
+    text += f"📝 **Хочу посмотреть ({want_count}):**\n"
+    text += format_movie_list(want_movies[:PAGE_SIZE], show_status=False, show_privacy=True, show_priority=True)
     
-    text += f"\n✅ **Просмотрено ({len(watched_movies)}):**\n"
-    text += format_movie_list(watched_movies[:10], show_status=True, show_privacy=True)
+    text += f"\n✅ **Просмотрено ({watched_count}):**\n"
+    text += format_movie_list(watched_movies[:PAGE_SIZE], show_status=True, show_privacy=True)
     
-    if len(want_movies) > 10 or len(watched_movies) > 10:
-        text += f"\n📄 Для просмотра всех фильмов используйте поиск или кнопки управления."
+    # Фильтры передаются в кнопки страниц: жанр - ID из таблицы genres, год - числом.
+    # Произвольный текст фильтра в genres не записывается: для жанра без ID листания нет
+    has_more = len(want_movies) > PAGE_SIZE or len(watched_movies) > PAGE_SIZE
+    genre_id = 0
+    if has_more and genre_filter:
+        genre_id = await db.get_genre_id(genre_filter) or 0
+        if not genre_id:
+            text += f"\n📄 Показаны первые {PAGE_SIZE} фильмов. Чтобы листать список, выберите жанр в «Мои жанры».\n"
     
     text += f"\n📊 **Статистика:**\n"
     text += f"• Всего: {stats['want_count'] + stats['watched_count']}\n"
@@ -792,22 +3753,33 @@ async def show_my_movies_command(update: Update, context: ContextTypes.DEFAULT_T
     # Создаем клавиатуру
     keyboard = [
         [
-            InlineKeyboardButton("🎲 Случайный", callback_data="random_movie"),
-            InlineKeyboardButton("🔍 Поиск", callback_data="search_movies")
+            InlineKeyboardButton("🎲 Случайный", callback_data=CB_RANDOM),
+            InlineKeyboardButton("🔍 Поиск", callback_data=CB_SEARCH)
         ]
     ]
     
+    if has_more and (genre_id or not genre_filter):
+        page_row = []
+        if len(want_movies) > PAGE_SIZE:
+            cursor = encode_page_cursor(want_movies[PAGE_SIZE - 1])
+            page_row.append(InlineKeyboardButton("📝 Далее ▶", callback_data=page_callback(
+                'want', PAGE_NEXT, cursor, genre_id, year_filter or 0)))
+        if len(watched_movies) > PAGE_SIZE:
+            cursor = encode_page_cursor(watched_movies[PAGE_SIZE - 1])
+            page_row.append(InlineKeyboardButton("✅ Далее ▶", callback_data=page_callback(
+                'watched', PAGE_NEXT, cursor, genre_id, year_filter or 0)))
+        keyboard.append(page_row)
+    
     # Добавляем жанры пользователя
-    user_genres = db.get_user_genres(user.id)
-    if user_genres:
-        keyboard.append([InlineKeyboardButton("🏷️ Мои жанры", callback_data="my_genres")])
+    if overview['has_genres']:
+        keyboard.append([InlineKeyboardButton("🏷️ Мои жанры", callback_data=CB_MY_GENRES)])
     
     keyboard.extend([
         [
-            InlineKeyboardButton("➕ Добавить фильм", callback_data="add_movie"),
-            InlineKeyboardButton("📊 Статистика", callback_data="stats")
+            InlineKeyboardButton("➕ Добавить фильм", callback_data=CB_ADD_MOVIE),
+            InlineKeyboardButton("📊 Статистика", callback_data=CB_STATS)
         ],
-        [InlineKeyboardButton("👁️ Публичный список", callback_data="public_list")]
+        [InlineKeyboardButton("👁️ Публичный список", callback_data=CB_PUBLIC_LIST)]
     ])
     
     await update.message.reply_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
@@ -816,53 +3788,16 @@ async def show_my_movies_command(update: Update, context: ContextTypes.DEFAULT_T
 async def show_watched_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать просмотренные фильмы"""
     user = update.effective_user
-    db.update_user_activity(user.id)
-    
-    watched_movies = db.get_user_movies(user.id, status='watched')
-    stats = db.get_user_stats(user.id)
-    
-    text = f"✅ **Просмотренные фильмы ({stats['watched_count']})**\n\n"
-    
-    if watched_movies:
-        # Сортируем по рейтингу или дате просмотра
-        watched_movies_sorted = sorted(
-            watched_movies, 
-            key=lambda x: (x.get('rating') or 0, x.get('added_date') or ''), 
-            reverse=True
-        )
-        
-        text += format_movie_list(watched_movies_sorted[:15], show_status=False, show_privacy=True)
-        
-        if stats['rated_count'] > 0:
-            text += f"\n⭐ **Средняя ваша оценка:** {stats['avg_rating']}/10"
-    else:
-        text += "У вас еще нет просмотренных фильмов.\nДобавьте фильмы и отметьте их как просмотренные!"
-    
-    # Создаем клавиатуру
-    keyboard = []
-    
-    if stats['rated_count'] > 0:
-        keyboard.append([
-            InlineKeyboardButton("🏆 Топ по оценкам", callback_data="top_rated")
-        ])
-    
-    keyboard.extend([
-        [
-            InlineKeyboardButton("📋 Все фильмы", callback_data="my_movies"),
-            InlineKeyboardButton("➕ Добавить фильм", callback_data="add_movie")
-        ]
-    ])
+    activity.touch(user.id)
     
-    await update.message.reply_text(
-        text,
-        reply_markup=InlineKeyboardMarkup(keyboard)
-    )
+    text, reply_markup = await render_watched(user.id)
+    await update.message.reply_text(text, reply_markup=reply_markup)
 
 
 async def show_public_list_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать публичный список фильмов"""
     user = update.effective_user
-    db.update_user_activity(user.id)
+    activity.touch(user.id)
     
     # Фильтрация по аргументам
     genre_filter = None
@@ -875,9 +3810,22 @@ async def show_public_list_command(update: Update, context: ContextTypes.DEFAULT
             else:
                 genre_filter = arg
     
-    public_movies = db.get_public_movies(limit=30, genre=genre_filter, year=year_filter)
-    global_stats = db.get_global_stats()
-    top_genres = db.get_top_genres(limit=5)
+    # Экран одинаков для всех пользователей: готовый текст берется из кэша,
+    # пока публичные данные не изменились
+    text, reply_markup = await render_cache.get_or_render(
+        ('public_list_command', genre_filter, year_filter),
+        await db.get_public_version(),
+        functools.partial(render_public_overview, genre_filter, year_filter)
+    )
+    
+    await update.message.reply_text(text, reply_markup=reply_markup)
+
+
+async def render_public_overview(genre_filter: Optional[str], year_filter: Optional[int]) -> Tuple:
+    """Построение экрана /public: последние публичные фильмы по пользователям и общая статистика"""
+    public_movies = await db.get_public_movies(limit=30, genre=genre_filter, year=year_filter)
+    global_stats = await db.get_global_stats()
+    top_genres = await db.get_top_genres(limit=5)
     
     text = "👁️ **Публичный список фильмов**\n\n"
     
@@ -908,18 +3856,20 @@ async def show_public_list_command(update: Update, context: ContextTypes.DEFAULT
                 user_movies[user_name]['want'].append(movie_desc)
         
         # Формируем список
+        lines = []
         for user_name, movies in list(user_movies.items())[:10]:
             total = len(movies['want']) + len(movies['watched'])
             if total > 0:
-                text += f"👤 **{user_name}** (всего: {total})\n"
+                lines.append(f"👤 **{user_name}** (всего: {total})\n")
                 
                 if movies['want']:
-                    text += f"  📝 Хочет: {len(movies['want'])}\n"
+                    lines.append(f"  📝 Хочет: {len(movies['want'])}\n")
                 
                 if movies['watched']:
-                    text += f"  ✅ Просмотрено: {len(movies['watched'])}\n"
+                    lines.append(f"  ✅ Просмотрено: {len(movies['watched'])}\n")
                 
-                text += "\n"
+                lines.append("\n")
+        text += ''.join(lines)
     else:
         text += "Пока нет публичных фильмов.\nБудьте первым - добавьте фильм!"
     
@@ -929,27 +3879,27 @@ async def show_public_list_command(update: Update, context: ContextTypes.DEFAULT
     
     if top_genres:
         text += f"\n🏷️ **Популярные жанры:**\n"
-        for genre, count in top_genres[:5]:
-            text += f"• {genre}: {count}\n"
+        text += format_counts(top_genres[:5])
     
     keyboard = [
         [
-            InlineKeyboardButton("🏷️ Жанры", callback_data="show_genres"),
-            InlineKeyboardButton("🔍 Поиск", callback_data="search_public")
+            InlineKeyboardButton("🏷️ Жанры", callback_data=CB_SHOW_GENRES),
+            InlineKeyboardButton("🔍 Поиск", callback_data=CB_SEARCH_PUBLIC)
         ],
+        [InlineKeyboardButton("📄 Все фильмы по порядку", callback_data=page_callback('public'))],
         [
-            InlineKeyboardButton("📋 Мои фильмы", callback_data="my_movies"),
-            InlineKeyboardButton("➕ Добавить", callback_data="add_movie")
+            InlineKeyboardButton("📋 Мои фильмы", callback_data=CB_MY_MOVIES),
+            InlineKeyboardButton("➕ Добавить", callback_data=CB_ADD_MOVIE)
         ]
     ]
     
-    await update.message.reply_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+    return text, InlineKeyboardMarkup(keyboard)
 
 
 async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Поиск фильмов"""
     user = update.effective_user
-    db.update_user_activity(user.id)
+    activity.touch(user.id)
     
     if not context.args:
         await update.message.reply_text(
@@ -965,19 +3915,25 @@ async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     query = ' '.join(context.args)
-    movies = db.search_movies(user.id, query, search_in_public=False)
+    movies = await db.search_movies(user.id, query, search_in_public=False)
     
     text = f"🔍 **Результаты поиска по запросу: \"{query}\"**\n\n"
     
     if movies:
         text += format_movie_list(movies, show_status=True, show_privacy=True)
     else:
-        text += "Ничего не найдено.\nПопробуйте другой запрос."
+        # Точных совпадений нет - возможно, в запросе опечатка
+        suggestions = await db.fuzzy_search_movies(user.id, query, search_in_public=False)
+        if suggestions:
+            text += "Точных совпадений нет. Возможно, вы имели в виду:\n\n"
+            text += format_movie_list(suggestions, show_status=True, show_privacy=True)
+        else:
+            text += "Ничего не найдено.\nПопробуйте другой запрос."
     
     keyboard = [
         [
-            InlineKeyboardButton("🔍 Поиск в публичном", callback_data="search_public_menu"),
-            InlineKeyboardButton("📋 Мои фильмы", callback_data="my_movies")
+            InlineKeyboardButton("🔍 Поиск в публичном", callback_data=CB_SEARCH_PUBLIC_MENU),
+            InlineKeyboardButton("📋 Мои фильмы", callback_data=CB_MY_MOVIES)
         ]
     ]
     
@@ -987,38 +3943,33 @@ async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def search_public_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Поиск в публичном списке"""
     user = update.effective_user
-    db.update_user_activity(user.id)
+    activity.touch(user.id)
     
     if not context.args:
         await update.message.reply_text(
             "🔍 **Поиск в публичном списке**\n\n"
             "Напишите запрос для поиска фильмов среди публичных списков всех пользователей.",
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="public_list")]])
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data=CB_PUBLIC_LIST)]])
         )
         return
     
     query = ' '.join(context.args)
-    movies = db.search_movies(user.id, query, search_in_public=True)
+    movies = await db.search_movies(user.id, query, search_in_public=True)
     
     text = f"🔍 **Результаты поиска в публичном списке: \"{query}\"**\n\n"
     
+    if not movies:
+        # Точных совпадений нет - возможно, в запросе опечатка
+        movies = await db.fuzzy_search_movies(user.id, query, search_in_public=True)
+        if movies:
+            text += "Точных совпадений нет. Возможно, вы имели в виду:\n\n"
+    
     if movies:
-        for movie in movies[:15]:
-            user_name = movie.get('first_name') or f"User_{movie.get('user_id')}"
-            status_icon = "✅" if movie['status'] == 'watched' else "📝"
-            text += f"{status_icon} {movie['title']}"
-            
-            if movie.get('genre'):
-                text += f" ({movie['genre']})"
-            
-            if movie.get('year'):
-                text += f" [{movie['year']}]"
-            
-            text += f" — {user_name}\n"
+        text += ''.join([format_public_movie_line(movie) for movie in movies[:15]])
     else:
         text += "Ничего не найдено."
     
-    keyboard = [[InlineKeyboardButton("🔙 К публичному списку", callback_data="public_list")]]
+    keyboard = [[InlineKeyboardButton("🔙 К публичному списку", callback_data=CB_PUBLIC_LIST)]]
     
     await update.message.reply_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
 
@@ -1026,9 +3977,9 @@ async def search_public_command(update: Update, context: ContextTypes.DEFAULT_TY
 async def random_movie_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Выбор случайного фильма"""
     user = update.effective_user
-    db.update_user_activity(user.id)
+    activity.touch(user.id)
     
-    movie = db.get_random_movie(user.id, 'want_to_watch')
+    movie = await db.get_random_movie(user.id, 'want_to_watch')
     
     if movie:
         text = f"🎲 **Случайный фильм для просмотра:**\n\n"
@@ -1044,14 +3995,14 @@ async def random_movie_command(update: Update, context: ContextTypes.DEFAULT_TYP
         
         keyboard = [
             [
-                InlineKeyboardButton("✅ Да, смотрю!", callback_data=f"watch_{movie['id']}"),
-                InlineKeyboardButton("🎲 Другой фильм", callback_data="random_movie")
+                InlineKeyboardButton("✅ Да, смотрю!", callback_data=pack_callback(OP_WATCH, movie['id'])),
+                InlineKeyboardButton("🎲 Другой фильм", callback_data=CB_RANDOM)
             ],
-            [InlineKeyboardButton("📋 К списку", callback_data="my_movies")]
+            [InlineKeyboardButton("📋 К списку", callback_data=CB_MY_MOVIES)]
         ]
     else:
         text = "У вас нет фильмов в списке «Хочу посмотреть».\nДобавьте фильмы с помощью команды /add"
-        keyboard = [[InlineKeyboardButton("➕ Добавить фильм", callback_data="add_movie")]]
+        keyboard = [[InlineKeyboardButton("➕ Добавить фильм", callback_data=CB_ADD_MOVIE)]]
     
     if update.callback_query:
         await update.callback_query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
@@ -1062,13 +4013,14 @@ async def random_movie_command(update: Update, context: ContextTypes.DEFAULT_TYP
 async def show_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать статистику"""
     user = update.effective_user
-    db.update_user_activity(user.id)
+    activity.touch(user.id)
     
     # Получаем статистику
-    user_stats = db.get_user_stats(user.id)
-    global_stats = db.get_global_stats()
-    user_genres = db.get_user_genres(user.id)
-    top_genres = db.get_top_genres(limit=5)
+    user_stats = await db.get_user_stats(user.id)
+    user_genres = await db.get_user_genres(user.id)
+    global_text, _ = await render_cache.get_or_render(
+        ('stats_global',), await db.get_public_version(), render_global_stats
+    )
     
     text = "📊 **Статистика**\n\n"
     
@@ -1083,305 +4035,421 @@ async def show_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
     
     if user_genres:
         text += f"\n🏷️ **Ваши любимые жанры:**\n"
-        for genre, count in user_genres[:5]:
-            text += f"• {genre}: {count}\n"
-    
-    text += f"\n🌍 **Глобальная статистика:**\n"
-    text += f"• Публичных фильмов: {global_stats['total_movies']}\n"
-    text += f"• Участников: {global_stats['total_users']}\n"
-    
-    if global_stats['global_avg_rating'] > 0:
-        text += f"• Средняя оценка: {global_stats['global_avg_rating']}/10\n"
+        text += format_counts(user_genres[:5])
     
-    if top_genres:
-        text += f"\n🏷️ **Популярные жанры:**\n"
-        for genre, count in top_genres:
-            text += f"• {genre}: {count}\n"
+    text += global_text
     
     keyboard = [
         [
-            InlineKeyboardButton("📋 Мои фильмы", callback_data="my_movies"),
-            InlineKeyboardButton("👁️ Публичный список", callback_data="public_list")
+            InlineKeyboardButton("📋 Мои фильмы", callback_data=CB_MY_MOVIES),
+            InlineKeyboardButton("👁️ Публичный список", callback_data=CB_PUBLIC_LIST)
         ],
         [
-            InlineKeyboardButton("🏆 Топ фильмов", callback_data="top_rated"),
-            InlineKeyboardButton("🎲 Случайный", callback_data="random_movie")
+            InlineKeyboardButton("🏆 Топ фильмов", callback_data=CB_TOP_RATED),
+            InlineKeyboardButton("🎲 Случайный", callback_data=CB_RANDOM)
         ]
     ]
     
     await update.message.reply_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
 
 
-# ========== ОБРАБОТЧИК КНОПОК ==========
-async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик нажатий на кнопки"""
-    query = update.callback_query
-    await query.answer()
+async def render_global_stats() -> Tuple:
+    """Общая часть экрана /stats: глобальная статистика и популярные жанры"""
+    global_stats = await db.get_global_stats()
+    top_genres = await db.get_top_genres(limit=5)
     
-    user = update.effective_user
-    data = query.data
+    text = f"\n🌍 **Глобальная статистика:**\n"
+    text += f"• Публичных фильмов: {global_stats['total_movies']}\n"
+    text += f"• Участников: {global_stats['total_users']}\n"
     
-    db.update_user_activity(user.id)
-    logger.info(f"Кнопка: {data}, пользователь: {user.id}")
+    if global_stats['global_avg_rating'] > 0:
+        text += f"• Средняя оценка: {global_stats['global_avg_rating']}/10\n"
     
-    # Основное меню
-    if data == "main_menu":
-        await query.edit_message_text(
-            "🎬 **Главное меню**\n\nВыберите действие:",
-            reply_markup=create_main_keyboard()
-        )
+    if top_genres:
+        text += f"\n🏷️ **Популярные жанры:**\n"
+        text += format_counts(top_genres)
     
-    # Мои фильмы
-    elif data == "my_movies":
-        await handle_my_movies(query, user.id)
+    return text, None
+
+
+async def admin_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Служебная статистика работы бота (только для администраторов)"""
+    user = update.effective_user
+    if user.id not in ADMIN_IDS:
+        await update.message.reply_text("❌ Команда доступна только администраторам.")
+        return
     
-    # Просмотренные
-    elif data == "watched":
-        await handle_watched(query, user.id)
+    activity_stats = activity.stats()
+    
+    text = "🛠️ **Служебная статистика**\n\n"
+    text += "🕒 **Буфер активности:**\n"
+    text += f"• Отметок активности: {activity_stats['touches']}\n"
+    text += f"• Ожидают записи: {activity_stats['pending']}\n"
+    text += f"• Выполнено коммитов: {activity_stats['commits']}\n"
+    text += f"• Сэкономлено коммитов: {activity_stats['saved_commits']} "
+    text += f"({activity_stats['saved_commits_per_second']}/с)\n"
+    
+    cache_stats = render_cache.stats()
+    text += "\n🗂️ **Кэш экранов:**\n"
+    text += f"• Экранов: {cache_stats['entries']}, "
+    text += f"{cache_stats['bytes'] / 1024:.1f} из {cache_stats['max_bytes'] / 1024:.0f} КБ\n"
+    text += f"• Попаданий: {cache_stats['hits']}, промахов: {cache_stats['misses']} "
+    text += f"(доля попаданий {cache_stats['hit_ratio']:.1%})\n"
+    text += f"• Вытеснено: {cache_stats['evictions']}, совмещено построений: {cache_stats['coalesced']}\n"
+    
+    throttle_stats = throttle.stats()
+    text += "\n🚦 **Ограничение частоты:**\n"
+    text += f"• Принято запросов: {throttle_stats['allowed']}, "
+    text += f"пользователей в учете: {throttle_stats['users']}\n"
+    text += f"• Отклонено по лимиту: {throttle_stats['throttled']}, "
+    text += f"повторных нажатий: {throttle_stats['debounced']}\n"
+    
+    send_stats = send_scheduler.stats()
+    text += "\n📤 **Исходящие сообщения:**\n"
+    text += f"• Отправлено: {send_stats['sent']}, ждут в очереди: {send_stats['waiting']}\n"
+    text += f"• Ожидали общего лимита: {send_stats['queued']}, лимита чата: {send_stats['chat_delays']}\n"
+    text += f"• Повторов после 429: {send_stats['retries']}, не отправлено: {send_stats['failed']}\n"
+    
+    webhook_server = context.bot_data.get('webhook_server')
+    if webhook_server is not None:
+        webhook_stats = webhook_server.stats()
+        text += "\n🌐 **Вебхук:**\n"
+        text += f"• Принято обновлений: {webhook_stats['received']}, в очереди: {webhook_stats['queue_size']}\n"
+        text += f"• Очередь была полна (503): {webhook_stats['queue_full']}, "
+        text += f"неверный секрет: {webhook_stats['rejected']}, ошибок разбора: {webhook_stats['bad_requests']}\n"
+        text += f"• Закрыто по тайм-ауту: {webhook_stats['timeouts']}\n"
+    
+    movie_cache_stats = await db.movie_cache_stats()
+    if movie_cache_stats:
+        text += "\n🎞️ **Кэш фильмов пользователей:**\n"
+        text += f"• Записей: {movie_cache_stats['entries']}, "
+        text += f"{movie_cache_stats['bytes'] / 1024:.1f} из {movie_cache_stats['max_bytes'] / 1024:.0f} КБ\n"
+        text += f"• Попаданий: {movie_cache_stats['hits']}, промахов: {movie_cache_stats['misses']} "
+        text += f"(доля попаданий {movie_cache_stats['hit_ratio']:.1%})\n"
+        text += f"• Вытеснено: {movie_cache_stats['evictions']}, "
+        text += f"внешних изменений базы: {movie_cache_stats['external_invalidations']}\n"
+    
+    query_log = db.sync.query_log
+    if query_log.enabled:
+        query_stats = query_log.stats()
+        text += "\n🐢 **Запросы к базе:**\n"
+        text += f"• Медленнее {query_log.threshold * 1000:.0f} мс: {query_stats['slow_queries']}, "
+        text += f"с полным просмотром movies: {query_stats['full_scans']}\n"
+    
+    await update.message.reply_text(text)
+
+
+async def rebuild_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Проверка и пересчет статистики пользователей (только для администраторов)"""
+    user = update.effective_user
+    if user.id not in ADMIN_IDS:
+        await update.message.reply_text("❌ Команда доступна только администраторам.")
+        return
     
-    # Случайный фильм
-    elif data == "random_movie":
-        await random_movie_command(update, context)
+    mismatched = await db.verify_user_stats()
+    if mismatched == 0:
+        await update.message.reply_text("✅ Статистика пользователей согласована, пересчет не нужен.")
+        return
     
-    # Поиск
-    elif data == "search_movies":
-        await query.edit_message_text(
-            "🔍 **Поиск в вашем списке**\n\n"
-            "Отправьте сообщение с названием фильма для поиска.\n\n"
-            "Пример: матрица",
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="my_movies")]])
-        )
+    users_count = await db.rebuild_user_stats()
+    text = "🛠️ **Пересчет статистики**\n\n"
+    text += f"• Расхождений найдено: {mismatched if mismatched > 0 else 'ошибка проверки'}\n"
+    text += f"• Пересчитано пользователей: {users_count}\n"
+    text += f"• Расхождений после пересчета: {await db.verify_user_stats()}"
     
-    elif data == "search_public_menu":
-        await query.edit_message_text(
-            "🔍 **Поиск в публичном списке**\n\n"
-            "Отправьте сообщение с названием фильма для поиска среди публичных фильмов всех пользователей.",
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="public_list")]])
-        )
+    await update.message.reply_text(text)
+
+
+# ========== ОГРАНИЧЕНИЕ ЧАСТОТЫ ЗАПРОСОВ ==========
+async def throttle_updates(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Отсев слишком частых запросов и повторных нажатий до остальных обработчиков (группа -1)"""
+    user = update.effective_user
+    if user is None or not (update.message or update.callback_query):
+        return
     
-    elif data == "search_public":
-        await query.edit_message_text(
-            "🔍 **Поиск в публичном списке**\n\n"
-            "Отправьте сообщение с названием фильма для поиска.",
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="public_list")]])
-        )
+    query = update.callback_query
+    reason = throttle.check(user.id, query.data if query else None)
+    if reason is None:
+        return
+    
+    if query:
+        # Ответ на нажатие обязателен, иначе кнопка "зависает"; повтор отвечается молча
+        if reason == 'throttled' and throttle.should_warn(user.id):
+            await query.answer("⏳ Слишком часто. Подождите секунду.")
+        else:
+            await query.answer()
+    elif throttle.should_warn(user.id):
+        await update.message.reply_text("⏳ Слишком много запросов. Подождите немного и повторите.")
+    
+    raise ApplicationHandlerStop
+
+
+# ========== ОБРАБОТЧИК КНОПОК ==========
+async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик нажатий на кнопки: обработчик выбирается по таблице callback_router"""
+    query = update.callback_query
+    await query.answer()
     
-    # Публичный список
-    elif data == "public_list":
-        await handle_public_list(query)
+    user = update.effective_user
+    data = query.data
     
-    # Статистика
-    elif data == "stats":
-        await handle_stats(query, user.id)
+    activity.touch(user.id)
+    logger.info(f"Кнопка: {data}, пользователь: {user.id}")
     
-    # Добавить фильм
-    elif data == "add_movie":
+    handler, args = callback_router.resolve(data or '')
+    if handler is None:
+        # Если callback_data не распознан
         await query.edit_message_text(
-            "📝 **Добавление фильма**\n\n"
-            "Отправьте название фильма.\n\n"
-            "Можно указать жанр и год через запятую:\n"
-            "• Инцепция\n"
-            "• Инцепция, фантастика\n"
-            "• Инцепция, фантастика, 2010",
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 На главную", callback_data="main_menu")]])
+            "❌ Неизвестная команда. Возвращаюсь в главное меню.",
+            reply_markup=create_main_keyboard()
         )
+        return
     
-    # Помощь
-    elif data == "help":
-        await handle_help(query)
+    await handler(update, context, *args)
+
+
+# Кнопки прежнего формата (в уже отправленных сообщениях) обрабатываются теми же функциями
+callback_router.exact(CB_RANDOM, 'random_movie')(random_movie_command)
+
+
+@callback_router.exact(CB_MAIN_MENU, 'main_menu')
+async def handle_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработка кнопки 'Главное меню'"""
+    await update.callback_query.edit_message_text(
+        "🎬 **Главное меню**\n\nВыберите действие:",
+        reply_markup=create_main_keyboard()
+    )
+
+
+@callback_router.exact(CB_SEARCH, 'search_movies')
+async def handle_search_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработка кнопки 'Поиск'"""
+    await update.callback_query.edit_message_text(
+        "🔍 **Поиск в вашем списке**\n\n"
+        "Отправьте сообщение с названием фильма для поиска.\n\n"
+        "Пример: матрица",
+        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data=CB_MY_MOVIES)]])
+    )
+
+
+@callback_router.exact(CB_SEARCH_PUBLIC_MENU, 'search_public_menu')
+async def handle_search_public_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработка кнопки 'Поиск в публичном'"""
+    await update.callback_query.edit_message_text(
+        "🔍 **Поиск в публичном списке**\n\n"
+        "Отправьте сообщение с названием фильма для поиска среди публичных фильмов всех пользователей.",
+        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data=CB_PUBLIC_LIST)]])
+    )
+
+
+@callback_router.exact(CB_SEARCH_PUBLIC, 'search_public')
+async def handle_search_public(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработка кнопки 'Поиск' публичного списка"""
+    await update.callback_query.edit_message_text(
+        "🔍 **Поиск в публичном списке**\n\n"
+        "Отправьте сообщение с названием фильма для поиска.",
+        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data=CB_PUBLIC_LIST)]])
+    )
+
+
+@callback_router.exact(CB_ADD_MOVIE, 'add_movie')
+async def handle_add_movie_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработка кнопки 'Добавить фильм'"""
+    await update.callback_query.edit_message_text(
+        "📝 **Добавление фильма**\n\n"
+        "Отправьте название фильма.\n\n"
+        "Можно указать жанр и год через запятую:\n"
+        "• Инцепция\n"
+        "• Инцепция, фантастика\n"
+        "• Инцепция, фантастика, 2010",
+        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 На главную", callback_data=CB_MAIN_MENU)]])
+    )
+
+
+@callback_router.exact(CB_SHOW_GENRES, 'show_genres')
+async def handle_show_genres(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработка кнопки 'Жанры' публичного списка"""
+    text, reply_markup = await render_cache.get_or_render(
+        ('show_genres',), await db.get_public_version(), render_top_genres
+    )
+    await update.callback_query.edit_message_text(text, reply_markup=reply_markup)
+
+
+@callback_router.exact(CB_MY_GENRES, 'my_genres')
+async def handle_my_genres(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработка кнопки 'Мои жанры'"""
+    user_genres = await db.get_user_genres(update.effective_user.id)
     
-    # Жанры
-    elif data == "show_genres":
-        top_genres = db.get_top_genres(limit=10)
-        
-        text = "🏷️ **Популярные жанры:**\n\n"
-        for genre, count in top_genres:
-            text += f"• {genre}: {count} фильмов\n"
+    text = "🏷️ **Ваши жанры:**\n\n"
+    if user_genres:
+        text += format_counts(user_genres, ' фильмов')
         
-        keyboard = [
-            [InlineKeyboardButton("👁️ Публичный список", callback_data="public_list")],
-            [InlineKeyboardButton("🔙 Назад", callback_data="public_list")]
-        ]
+        genre_ids = await db.get_genre_ids([genre for genre, _ in user_genres[:6]])
+        keyboard = []
+        for genre, _ in user_genres[:6]:
+            if genre in genre_ids:
+                keyboard.append([InlineKeyboardButton(
+                    genre, callback_data=pack_callback(OP_FILTER_GENRE, genre_ids[genre])
+                )])
         
-        await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+        keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data=CB_MY_MOVIES)])
+    else:
+        text += "У вас пока нет фильмов с указанными жанрами."
+        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data=CB_MY_MOVIES)]]
     
-    elif data == "my_genres":
-        user_genres = db.get_user_genres(user.id)
-        
-        text = "🏷️ **Ваши жанры:**\n\n"
-        if user_genres:
-            for genre, count in user_genres:
-                text += f"• {genre}: {count} фильмов\n"
-            
-            keyboard = []
-            for genre, _ in user_genres[:6]:
-                keyboard.append([InlineKeyboardButton(genre, callback_data=f"filter_genre_{genre}")])
-            
-            keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="my_movies")])
-        else:
-            text += "У вас пока нет фильмов с указанными жанрами."
-            keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="my_movies")]]
-        
-        await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+    await update.callback_query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+
+
+@callback_router.prefix(CALLBACK_VERSION + OP_FILTER_GENRE)
+@callback_router.prefix('filter_genre_', legacy_genre_args)
+async def handle_filter_genre(update: Update, context: ContextTypes.DEFAULT_TYPE, genre):
+    """Фильмы пользователя в жанре (ID жанра или, в кнопках прежнего формата, название)"""
+    if isinstance(genre, int):
+        genre = await db.get_genre_name(genre)
+    if genre is None:
+        await update.callback_query.edit_message_text("❌ Жанр не найден.")
+        return
     
-    # Фильтрация по жанру
-    elif data.startswith("filter_genre_"):
-        genre = data.replace("filter_genre_", "")
-        want_movies = db.get_user_movies(user.id, status='want_to_watch', genre=genre)
-        watched_movies = db.get_user_movies(user.id, status='watched', genre=genre)
-        
-        text = f"🏷️ **Фильмы в жанре: {genre}**\n\n"
-        text += f"📝 **Хочу посмотреть ({len(want_movies)}):**\n"
-        text += format_movie_list(want_movies[:10], show_status=False, show_priority=True)
-        
-        text += f"\n✅ **Просмотрено ({len(watched_movies)}):**\n"
-        text += format_movie_list(watched_movies[:10], show_status=True)
-        
-        keyboard = [
-            [InlineKeyboardButton("🔙 К жанрам", callback_data="my_genres")],
-            [InlineKeyboardButton("📋 Все фильмы", callback_data="my_movies")]
-        ]
-        
-        await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+    overview = await db.get_movies_overview(update.effective_user.id, 10, 10, genre=genre)
     
-    # Топ по оценкам
-    elif data == "top_rated":
-        watched_movies = db.get_user_movies(user.id, status='watched')
-        
-        # Фильтруем фильмы с оценкой и сортируем
-        rated_movies = [m for m in watched_movies if m.get('rating')]
-        rated_movies_sorted = sorted(rated_movies, key=lambda x: x.get('rating', 0), reverse=True)
-        
-        text = "🏆 **Ваши лучшие фильмы:**\n\n"
-        
-        if rated_movies_sorted:
-            for i, movie in enumerate(rated_movies_sorted[:10], 1):
-                text += f"{i}. ⭐{movie['rating']}/10 - {movie['title']}\n"
-                if movie.get('genre'):
-                    text += f"   ({movie['genre']})\n"
-        else:
-            text += "У вас пока нет оцененных фильмов.\nОтмечайте фильмы как просмотренные и ставьте оценки!"
-        
-        keyboard = [
-            [InlineKeyboardButton("✅ Просмотренные", callback_data="watched")],
-            [InlineKeyboardButton("📋 Все фильмы", callback_data="my_movies")]
-        ]
-        
-        await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+    text = f"🏷️ **Фильмы в жанре: {genre}**\n\n"
+    text += f"📝 **Хочу посмотреть ({overview['want_total']}):**\n"
+    text += format_movie_list(overview['want'], show_status=False, show_priority=True)
     
-    # Управление фильмом
-    elif data.startswith("watch_"):
-        await handle_watch_button(query, user.id, data)
+    text += f"\n✅ **Просмотрено ({overview['watched_total']}):**\n"
+    text += format_movie_list(overview['watched'], show_status=True)
     
-    elif data.startswith("private_"):
-        await handle_private_button(query, user.id, data)
+    keyboard = [
+        [InlineKeyboardButton("🔙 К жанрам", callback_data=CB_MY_GENRES)],
+        [InlineKeyboardButton("📋 Все фильмы", callback_data=CB_MY_MOVIES)]
+    ]
     
-    elif data.startswith("delete_"):
-        await handle_delete_button(query, user.id, data)
+    await update.callback_query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+
+
+@callback_router.exact(CB_TOP_RATED, 'top_rated')
+async def handle_top_rated(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработка кнопки 'Топ по оценкам': первая страница лучших фильмов"""
+    rated_movies = await db.get_top_rated_movies(update.effective_user.id, PAGE_SIZE + 1)
     
-    elif data.startswith("priority_"):
-        parts = data.split("_")
-        movie_id = int(parts[1])
-        
-        if len(parts) == 3:
-            # Выбор конкретного приоритета
-            priority = int(parts[2])
-            
-            success = db.update_movie(user.id, movie_id, priority=priority)
-            if success:
-                movie = db.get_movie_by_id(user.id, movie_id)
-                text = f"✅ Приоритет фильма \"{movie['title']}\" изменен на {'⭐' * priority}\n\n"
-                text += "Что дальше?"
-                
-                await query.edit_message_text(
-                    text,
-                    reply_markup=create_movie_keyboard(movie_id)
-                )
-        else:
-            # Меню выбора приоритета
-            movie = db.get_movie_by_id(user.id, movie_id)
-            
-            if movie:
-                text = f"⭐ **Установите приоритет для фильма:**\n\n"
-                text += f"🎬 {movie['title']}\n"
-                text += f"Текущий приоритет: {'⭐' * movie.get('priority', 3)}\n\n"
-                text += "1 ⭐ - низкий приоритет\n"
-                text += "5 ⭐ - высокий приоритет"
-                
-                await query.edit_message_text(
-                    text,
-                    reply_markup=create_priority_keyboard(movie_id)
-                )
+    text = "🏆 **Ваши лучшие фильмы:**\n\n"
     
-    elif data.startswith("rate_"):
-        parts = data.split("_")
-        movie_id = int(parts[1])
-        rating = int(parts[2])
-        
-        if rating > 0:
-            success = db.mark_as_watched(user.id, movie_id, rating=rating)
-            if success:
-                movie = db.get_movie_by_id(user.id, movie_id)
-                text = f"✅ Фильм \"{movie['title']}\" отмечен как просмотренный с оценкой ⭐{rating}/10!\n\n"
-                text += "Спасибо за оценку!"
-            else:
-                text = "❌ Не удалось поставить оценку."
-        else:
-            success = db.mark_as_watched(user.id, movie_id)
-            if success:
-                movie = db.get_movie_by_id(user.id, movie_id)
-                text = f"✅ Фильм \"{movie['title']}\" отмечен как просмотренный без оценки.\n\n"
-            else:
-                text = "❌ Не удалось отметить фильм как просмотренный."
-        
-        keyboard = [
-            [
-                InlineKeyboardButton("📋 Мои фильмы", callback_data="my_movies"),
-                InlineKeyboardButton("✅ Просмотренные", callback_data="watched")
-            ]
-        ]
-        
-        await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+    if rated_movies:
+        text += ''.join([format_top_rated_line(movie) for movie in rated_movies[:PAGE_SIZE]])
+    else:
+        text += "У вас пока нет оцененных фильмов.\nОтмечайте фильмы как просмотренные и ставьте оценки!"
     
-    elif data.startswith("movie_back_"):
-        movie_id = int(data.split("_")[2])
-        movie = db.get_movie_by_id(user.id, movie_id)
-        
+    keyboard = [
+        create_page_buttons('top', rated_movies[:PAGE_SIZE], False, len(rated_movies) > PAGE_SIZE),
+        [InlineKeyboardButton("✅ Просмотренные", callback_data=CB_WATCHED)],
+        [InlineKeyboardButton("📋 Все фильмы", callback_data=CB_MY_MOVIES)]
+    ]
+    
+    await update.callback_query.edit_message_text(text, reply_markup=InlineKeyboardMarkup([row for row in keyboard if row]))
+
+
+@callback_router.prefix(CALLBACK_VERSION + OP_PRIORITY)
+@callback_router.prefix('priority_', legacy_int_args)
+async def handle_priority_button(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                                 movie_id: int, priority: int = None):
+    """Меню выбора приоритета или, если приоритет передан, его установка"""
+    query = update.callback_query
+    user_id = update.effective_user.id
+    
+    if priority is not None:
+        # Выбор конкретного приоритета
+        movie = await db.update_movie(user_id, movie_id, priority=priority)
         if movie:
-            text = f"🎬 **{movie['title']}**\n\n"
-            
-            if movie.get('genre'):
-                text += f"🏷️ Жанр: {movie['genre']}\n"
-            
-            if movie.get('year'):
-                text += f"📅 Год: {movie['year']}\n"
-            
-            if movie.get('notes'):
-                text += f"📝 Заметки: {movie['notes']}\n"
-            
-            text += f"📊 Статус: {'Просмотрен ✅' if movie['status'] == 'watched' else 'Хочу посмотреть'}\n"
-            text += f"⭐ Приоритет: {'⭐' * movie.get('priority', 3)}\n"
-            text += f"👁️ Видимость: {'Публичный' if movie['is_public'] else 'Приватный'}\n\n"
-            text += "Используйте кнопки для управления:"
+            text = f"✅ Приоритет фильма \"{movie['title']}\" изменен на {'⭐' * priority}\n\n"
+            text += "Что дальше?"
             
             await query.edit_message_text(
                 text,
                 reply_markup=create_movie_keyboard(movie_id)
             )
-    
     else:
-        # Если callback_data не распознан
-        await query.edit_message_text(
-            "❌ Неизвестная команда. Возвращаюсь в главное меню.",
-            reply_markup=create_main_keyboard()
+        # Меню выбора приоритета
+        movie = await db.get_movie_by_id(user_id, movie_id)
+        
+        if movie:
+            text = f"⭐ **Установите приоритет для фильма:**\n\n"
+            text += f"🎬 {movie['title']}\n"
+            text += f"Текущий приоритет: {'⭐' * movie.get('priority', 3)}\n\n"
+            text += "1 ⭐ - низкий приоритет\n"
+            text += "5 ⭐ - высокий приоритет"
+            
+            await query.edit_message_text(
+                text,
+                reply_markup=create_priority_keyboard(movie_id)
+            )
+
+
+@callback_router.prefix(CALLBACK_VERSION + OP_RATE)
+@callback_router.prefix('rate_', legacy_int_args)
+async def handle_rate_button(update: Update, context: ContextTypes.DEFAULT_TYPE, movie_id: int, rating: int):
+    """Оценка фильма (0 - без оценки) и отметка о просмотре"""
+    user_id = update.effective_user.id
+    
+    if rating > 0:
+        movie = await db.mark_as_watched(user_id, movie_id, rating=rating)
+        if movie:
+            text = f"✅ Фильм \"{movie['title']}\" отмечен как просмотренный с оценкой ⭐{rating}/10!\n\n"
+            text += "Спасибо за оценку!"
+        else:
+            text = "❌ Не удалось поставить оценку."
+    else:
+        movie = await db.mark_as_watched(user_id, movie_id)
+        if movie:
+            text = f"✅ Фильм \"{movie['title']}\" отмечен как просмотренный без оценки.\n\n"
+        else:
+            text = "❌ Не удалось отметить фильм как просмотренный."
+    
+    keyboard = [
+        [
+            InlineKeyboardButton("📋 Мои фильмы", callback_data=CB_MY_MOVIES),
+            InlineKeyboardButton("✅ Просмотренные", callback_data=CB_WATCHED)
+        ]
+    ]
+    
+    await update.callback_query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+
+
+@callback_router.prefix(CALLBACK_VERSION + OP_MOVIE_CARD)
+@callback_router.prefix('movie_back_', legacy_int_args)
+async def handle_movie_card(update: Update, context: ContextTypes.DEFAULT_TYPE, movie_id: int):
+    """Карточка фильма (кнопки 'Назад' и 'Отмена' клавиатур фильма)"""
+    movie = await db.get_movie_by_id(update.effective_user.id, movie_id)
+    
+    if movie:
+        text = f"🎬 **{movie['title']}**\n\n"
+        
+        if movie.get('genre'):
+            text += f"🏷️ Жанр: {movie['genre']}\n"
+        
+        if movie.get('year'):
+            text += f"📅 Год: {movie['year']}\n"
+        
+        if movie.get('notes'):
+            text += f"📝 Заметки: {movie['notes']}\n"
+        
+        text += f"📊 Статус: {'Просмотрен ✅' if movie['status'] == 'watched' else 'Хочу посмотреть'}\n"
+        text += f"⭐ Приоритет: {'⭐' * movie.get('priority', 3)}\n"
+        text += f"👁️ Видимость: {'Публичный' if movie['is_public'] else 'Приватный'}\n\n"
+        text += "Используйте кнопки для управления:"
+        
+        await update.callback_query.edit_message_text(
+            text,
+            reply_markup=create_movie_keyboard(movie_id)
         )
 
 
-async def handle_my_movies(query, user_id):
+@callback_router.exact(CB_MY_MOVIES, 'my_movies')
+async def handle_my_movies(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка кнопки 'Мои фильмы'"""
-    want_movies = db.get_user_movies(user_id, status='want_to_watch', limit=5)
-    watched_movies = db.get_user_movies(user_id, status='watched', limit=3)
-    stats = db.get_user_stats(user_id)
+    query = update.callback_query
+    user_id = update.effective_user.id
+    overview = await db.get_movies_overview(user_id, want_limit=5, watched_limit=0)
+    want_movies, stats = overview['want'], overview['stats']
     
     text = f"🎬 **Ваши фильмы**\n\n"
     text += f"📝 Хочу посмотреть: {stats['want_count']} фильмов\n"
@@ -1389,103 +4457,112 @@ async def handle_my_movies(query, user_id):
     
     if want_movies:
         text += "🎬 **Последние добавленные:**\n"
-        for movie in want_movies:
-            text += f"• {movie['title']}"
-            if movie.get('priority'):
-                text += f" {'⭐' * movie['priority']}"
-            text += "\n"
+        text += ''.join([f"• {shorten(movie['title'])}"
+                         f"{' ' + '⭐' * movie['priority'] if movie.get('priority') else ''}\n"
+                         for movie in want_movies])
     
     text += "\nВыберите действие:"
     
     # Создаем клавиатуру
     keyboard = [
         [
-            InlineKeyboardButton("🎲 Случайный фильм", callback_data="random_movie"),
-            InlineKeyboardButton("🔍 Поиск", callback_data="search_movies")
+            InlineKeyboardButton("🎲 Случайный фильм", callback_data=CB_RANDOM),
+            InlineKeyboardButton("🔍 Поиск", callback_data=CB_SEARCH)
         ]
     ]
     
     # Быстрые действия для фильмов
+    quick_row = []
     if want_movies:
-        keyboard.append([InlineKeyboardButton("🏷️ Мои жанры", callback_data="my_genres")])
+        quick_row.append(InlineKeyboardButton("📝 Весь список", callback_data=page_callback('want')))
+    if overview['has_genres']:
+        quick_row.append(InlineKeyboardButton("🏷️ Мои жанры", callback_data=CB_MY_GENRES))
+    if quick_row:
+        keyboard.append(quick_row)
     
     keyboard.extend([
         [
-            InlineKeyboardButton("✅ Просмотренные", callback_data="watched"),
-            InlineKeyboardButton("👁️ Публичный список", callback_data="public_list")
+            InlineKeyboardButton("✅ Просмотренные", callback_data=CB_WATCHED),
+            InlineKeyboardButton("👁️ Публичный список", callback_data=CB_PUBLIC_LIST)
         ],
         [
-            InlineKeyboardButton("➕ Добавить фильм", callback_data="add_movie"),
-            InlineKeyboardButton("📊 Статистика", callback_data="stats")
+            InlineKeyboardButton("➕ Добавить фильм", callback_data=CB_ADD_MOVIE),
+            InlineKeyboardButton("📊 Статистика", callback_data=CB_STATS)
         ]
     ])
     
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
 
 
-async def handle_watched(query, user_id):
+@callback_router.exact(CB_WATCHED, 'watched')
+async def handle_watched(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка кнопки 'Просмотренные'"""
-    watched_movies = db.get_user_movies(user_id, status='watched', limit=15)
-    stats = db.get_user_stats(user_id)
+    text, reply_markup = await render_watched(update.effective_user.id)
+    await update.callback_query.edit_message_text(text, reply_markup=reply_markup)
+
+
+async def render_watched(user_id: int) -> Tuple:
+    """Построение экрана просмотренных фильмов: первая страница, средняя оценка и кнопки"""
+    watched_movies = await db.get_user_movies(user_id, status='watched', limit=PAGE_SIZE + 1)
+    stats = await db.get_user_stats(user_id)
     
     text = f"✅ **Просмотренные фильмы ({stats['watched_count']})**\n\n"
     
     if watched_movies:
-        for i, movie in enumerate(watched_movies, 1):
-            text += f"{i}. {movie['title']}"
+        lines = []
+        for i, movie in enumerate(watched_movies[:PAGE_SIZE], 1):
+            parts = [f"{i}. {shorten(movie['title'])}"]
             if movie.get('rating'):
-                text += f" ⭐{movie['rating']}/10"
+                parts.append(f" ⭐{movie['rating']}/10")
             if movie.get('genre'):
-                text += f" ({movie['genre']})"
-            text += "\n"
+                parts.append(f" ({movie['genre']})")
+            lines.append(''.join(parts) + "\n")
+        text += ''.join(lines)
         
-        if stats['watched_count'] > 15:
-            text += f"\n... и еще {stats['watched_count'] - 15} фильмов"
+        if stats['rated_count'] > 0:
+            text += f"\n⭐ **Средняя ваша оценка:** {stats['avg_rating']}/10"
     else:
-        text += "Пока нет просмотренных фильмов."
+        text += "У вас еще нет просмотренных фильмов.\nДобавьте фильмы и отметьте их как просмотренные!"
     
     # Создаем клавиатуру
-    keyboard = []
+    keyboard = [create_page_buttons('watched', watched_movies[:PAGE_SIZE], False, len(watched_movies) > PAGE_SIZE)]
     
     if stats['rated_count'] > 0:
-        keyboard.append([InlineKeyboardButton("🏆 Топ по оценкам", callback_data="top_rated")])
+        keyboard.append([InlineKeyboardButton("🏆 Топ по оценкам", callback_data=CB_TOP_RATED)])
     
     keyboard.extend([
         [
-            InlineKeyboardButton("📋 Все фильмы", callback_data="my_movies"),
-            InlineKeyboardButton("➕ Добавить фильм", callback_data="add_movie")
+            InlineKeyboardButton("📋 Все фильмы", callback_data=CB_MY_MOVIES),
+            InlineKeyboardButton("➕ Добавить фильм", callback_data=CB_ADD_MOVIE)
         ]
     ])
     
-    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+    return text, InlineKeyboardMarkup([row for row in keyboard if row])
 
 
-async def handle_public_list(query):
+@callback_router.exact(CB_PUBLIC_LIST, 'public_list')
+async def handle_public_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка кнопки 'Публичный список'"""
-    public_movies = db.get_public_movies(limit=15)
-    global_stats = db.get_global_stats()
-    top_genres = db.get_top_genres(limit=3)
+    query = update.callback_query
+    text, reply_markup = await render_cache.get_or_render(
+        ('public_list',), await db.get_public_version(), render_public_list
+    )
+    await query.edit_message_text(text, reply_markup=reply_markup)
+
+
+async def render_public_list() -> Tuple:
+    """Построение экрана публичного списка: последние фильмы, статистика и жанры"""
+    public_movies = await db.get_public_movies(limit=PAGE_SIZE + 1)
+    global_stats = await db.get_global_stats()
+    top_genres = await db.get_top_genres(limit=3)
     
     text = "👁️ **Публичный список фильмов**\n\n"
     
     if public_movies:
         text += "🎬 **Последние добавленные:**\n"
         
-        for i, movie in enumerate(public_movies[:10], 1):
-            user_name = movie['first_name'] or f"User_{movie['user_id']}"
-            status_icon = "✅" if movie['status'] == 'watched' else "📝"
-            text += f"{i}. {status_icon} {movie['title']}"
-            
-            if movie.get('genre'):
-                text += f" ({movie['genre']})"
-            
-            if movie.get('year'):
-                text += f" [{movie['year']}]"
-            
-            text += f" — {user_name}\n"
-        
-        if len(public_movies) > 10:
-            text += f"\n... и еще {len(public_movies) - 10} фильмов\n"
+        text += ''.join([format_public_movie_line(movie, i)
+                         for i, movie in enumerate(public_movies[:PAGE_SIZE], 1)])
     else:
         text += "Пока нет публичных фильмов.\n"
     
@@ -1495,27 +4572,112 @@ async def handle_public_list(query):
     
     if top_genres:
         text += f"\n🏷️ **Популярные жанры:**\n"
-        for genre, count in top_genres:
-            text += f"• {genre}: {count}\n"
+        text += format_counts(top_genres)
     
     keyboard = [
+        create_page_buttons('public', public_movies[:PAGE_SIZE], False, len(public_movies) > PAGE_SIZE),
         [
-            InlineKeyboardButton("🏷️ Все жанры", callback_data="show_genres"),
-            InlineKeyboardButton("🔍 Поиск", callback_data="search_public_menu")
+            InlineKeyboardButton("🏷️ Все жанры", callback_data=CB_SHOW_GENRES),
+            InlineKeyboardButton("🔍 Поиск", callback_data=CB_SEARCH_PUBLIC_MENU)
         ],
         [
-            InlineKeyboardButton("📋 Мои фильмы", callback_data="my_movies"),
-            InlineKeyboardButton("➕ Добавить", callback_data="add_movie")
+            InlineKeyboardButton("📋 Мои фильмы", callback_data=CB_MY_MOVIES),
+            InlineKeyboardButton("➕ Добавить", callback_data=CB_ADD_MOVIE)
         ]
     ]
     
-    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+    return text, InlineKeyboardMarkup([row for row in keyboard if row])
+
+
+async def render_top_genres() -> Tuple:
+    """Построение экрана популярных жанров"""
+    top_genres = await db.get_top_genres(limit=10)
+    
+    text = "🏷️ **Популярные жанры:**\n\n"
+    text += format_counts(top_genres, ' фильмов')
+    
+    keyboard = [
+        [InlineKeyboardButton("👁️ Публичный список", callback_data=CB_PUBLIC_LIST)],
+        [InlineKeyboardButton("🔙 Назад", callback_data=CB_PUBLIC_LIST)]
+    ]
+    
+    return text, InlineKeyboardMarkup(keyboard)
+
+
+@callback_router.prefix(CALLBACK_VERSION + OP_PAGE, unpack_page_args)
+@callback_router.prefix(CALLBACK_VERSION + OP_FILTERED_PAGE, unpack_filtered_page_args)
+async def handle_movie_page(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                            list_index: int, direction: int, genre_id: int, year: int, *cursor: int):
+    """Страница списка PAGE_LISTS[list_index] по курсору: после него (PAGE_NEXT) или до него (PAGE_PREV).
+
+    genre_id / year - фильтр списка (0 - без фильтра).
+    """
+    query = update.callback_query
+    user_id = update.effective_user.id
+    list_name = PAGE_LISTS[list_index]
+    key = (tuple(cursor) or None) if list_name == 'top' else decode_page_cursor(cursor)
+    genre = await db.get_genre_name(genre_id) if genre_id else None
+    filters = {'genre': genre, 'year': year or None}
+    
+    # Берем на один фильм больше страницы, чтобы узнать, есть ли фильмы дальше
+    page_args = {'before': key} if direction == PAGE_PREV else {'after': key}
+    if list_name == 'public':
+        movies = await db.get_public_movies(limit=PAGE_SIZE + 1, **filters, **page_args)
+    elif list_name == 'top':
+        movies = await db.get_top_rated_movies(user_id, PAGE_SIZE + 1, **page_args)
+    else:
+        status = 'watched' if list_name == 'watched' else 'want_to_watch'
+        movies = await db.get_user_movies(user_id, status=status, limit=PAGE_SIZE + 1, **filters, **page_args)
+    
+    if direction == PAGE_PREV:
+        has_prev, has_next = len(movies) > PAGE_SIZE, True
+        movies = movies[-PAGE_SIZE:]
+    else:
+        has_prev, has_next = key is not None, len(movies) > PAGE_SIZE
+        movies = movies[:PAGE_SIZE]
+    
+    filter_text = ''
+    if genre:
+        filter_text += f"🏷️ Фильтр: {genre}\n"
+    if year:
+        filter_text += f"📅 Фильтр: {year} год\n"
+    
+    if list_name == 'public':
+        text = "👁️ **Публичные фильмы**\n\n" + filter_text
+        text += ''.join([format_public_movie_line(movie) for movie in movies])
+        
+        if not movies:
+            text += "Пока нет публичных фильмов.\n"
+        back_button = InlineKeyboardButton("🔙 К публичному списку", callback_data=CB_PUBLIC_LIST)
+    elif list_name == 'top':
+        text = "🏆 **Ваши лучшие фильмы:**\n\n"
+        text += ''.join([format_top_rated_line(movie) for movie in movies])
+        back_button = InlineKeyboardButton("✅ Просмотренные", callback_data=CB_WATCHED)
+    else:
+        # Счетчики из статистики относятся ко всему списку, поэтому с фильтром не выводятся
+        stats = await db.get_user_stats(user_id)
+        if list_name == 'watched':
+            count = '' if filter_text else f" ({stats['watched_count']})"
+            text = f"✅ **Просмотренные фильмы{count}**\n\n" + filter_text
+            text += format_movie_list(movies, show_status=True, show_privacy=True)
+        else:
+            count = '' if filter_text else f" ({stats['want_count']})"
+            text = f"📝 **Хочу посмотреть{count}**\n\n" + filter_text
+            text += format_movie_list(movies, show_status=False, show_privacy=True, show_priority=True)
+        back_button = InlineKeyboardButton("📋 Мои фильмы", callback_data=CB_MY_MOVIES)
+    
+    keyboard = [create_page_buttons(list_name, movies, has_prev, has_next, genre_id, year), [back_button]]
+    
+    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup([row for row in keyboard if row]))
 
 
-async def handle_stats(query, user_id):
+@callback_router.exact(CB_STATS, 'stats')
+async def handle_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка кнопки 'Статистика'"""
-    user_stats = db.get_user_stats(user_id)
-    global_stats = db.get_global_stats()
+    query = update.callback_query
+    user_id = update.effective_user.id
+    user_stats = await db.get_user_stats(user_id)
+    global_stats = await db.get_global_stats()
     
     text = "📊 **Статистика**\n\n"
     
@@ -1530,16 +4692,18 @@ async def handle_stats(query, user_id):
     
     keyboard = [
         [
-            InlineKeyboardButton("📋 Мои фильмы", callback_data="my_movies"),
-            InlineKeyboardButton("👁️ Публичный список", callback_data="public_list")
+            InlineKeyboardButton("📋 Мои фильмы", callback_data=CB_MY_MOVIES),
+            InlineKeyboardButton("👁️ Публичный список", callback_data=CB_PUBLIC_LIST)
         ]
     ]
     
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
 
 
-async def handle_help(query):
+@callback_router.exact(CB_HELP, 'help')
+async def handle_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка кнопки 'Помощь'"""
+    query = update.callback_query
     help_text = """
 📚 **Управление фильмами:**
 
@@ -1565,16 +4729,19 @@ async def handle_help(query):
 """
     
     keyboard = [
-        [InlineKeyboardButton("📋 На главную", callback_data="main_menu")]
+        [InlineKeyboardButton("📋 На главную", callback_data=CB_MAIN_MENU)]
     ]
     
     await query.edit_message_text(help_text, reply_markup=InlineKeyboardMarkup(keyboard))
 
 
-async def handle_watch_button(query, user_id, data):
+@callback_router.prefix(CALLBACK_VERSION + OP_WATCH)
+@callback_router.prefix('watch_', legacy_int_args)
+async def handle_watch_button(update: Update, context: ContextTypes.DEFAULT_TYPE, movie_id: int):
     """Обработка кнопки 'Просмотрен'"""
-    movie_id = int(data.split('_')[1])
-    movie = db.get_movie_by_id(user_id, movie_id)
+    query = update.callback_query
+    user_id = update.effective_user.id
+    movie = await db.get_movie_by_id(user_id, movie_id)
     
     if movie and movie['status'] == 'want_to_watch':
         # Показываем клавиатуру для оценки
@@ -1590,41 +4757,44 @@ async def handle_watch_button(query, user_id, data):
         await query.edit_message_text("❌ Этот фильм уже просмотрен или не найден.")
 
 
-async def handle_private_button(query, user_id, data):
+@callback_router.prefix(CALLBACK_VERSION + OP_PRIVATE)
+@callback_router.prefix('private_', legacy_int_args)
+async def handle_private_button(update: Update, context: ContextTypes.DEFAULT_TYPE, movie_id: int):
     """Обработка кнопки 'Приватность'"""
-    movie_id = int(data.split('_')[1])
-    new_state = db.toggle_movie_privacy(user_id, movie_id)
+    query = update.callback_query
+    user_id = update.effective_user.id
+    movie = await db.toggle_movie_privacy(user_id, movie_id)
     
-    if new_state is not None:
-        movie = db.get_movie_by_id(user_id, movie_id)
-        if movie:
-            status_text = "публичным" if new_state else "приватным"
-            icon = "👁️" if new_state else "🔒"
-            
-            text = f"✅ Фильм \"{movie['title']}\" теперь {status_text}!\n\nСтатус: {icon} {'Публичный' if new_state else 'Приватный'}"
-            
-            await query.edit_message_text(
-                text,
-                reply_markup=create_movie_keyboard(movie_id)
-            )
-        else:
-            await query.edit_message_text("❌ Фильм не найден.")
+    if movie:
+        new_state = bool(movie['is_public'])
+        status_text = "публичным" if new_state else "приватным"
+        icon = "👁️" if new_state else "🔒"
+        
+        text = f"✅ Фильм \"{movie['title']}\" теперь {status_text}!\n\nСтатус: {icon} {'Публичный' if new_state else 'Приватный'}"
+        
+        await query.edit_message_text(
+            text,
+            reply_markup=create_movie_keyboard(movie_id)
+        )
     else:
         await query.edit_message_text("❌ Не удалось изменить приватность фильма.")
 
 
-async def handle_delete_button(query, user_id, data):
+@callback_router.prefix(CALLBACK_VERSION + OP_DELETE)
+@callback_router.prefix('delete_', legacy_int_args)
+async def handle_delete_button(update: Update, context: ContextTypes.DEFAULT_TYPE, movie_id: int):
     """Обработка кнопки 'Удалить'"""
-    movie_id = int(data.split('_')[1])
-    success = db.delete_movie(user_id, movie_id)
+    query = update.callback_query
+    user_id = update.effective_user.id
+    movie = await db.delete_movie(user_id, movie_id)
     
-    if success:
-        text = "🗑️ Фильм удален из вашего списка!"
+    if movie:
+        text = f"🗑️ Фильм \"{movie['title']}\" удален из вашего списка!"
         
         keyboard = [
             [
-                InlineKeyboardButton("📋 Мои фильмы", callback_data="my_movies"),
-                InlineKeyboardButton("➕ Добавить фильм", callback_data="add_movie")
+                InlineKeyboardButton("📋 Мои фильмы", callback_data=CB_MY_MOVIES),
+                InlineKeyboardButton("➕ Добавить фильм", callback_data=CB_ADD_MOVIE)
             ]
         ]
         
@@ -1633,7 +4803,396 @@ async def handle_delete_button(query, user_id, data):
         await query.edit_message_text("❌ Не удалось удалить фильм.")
 
 
+# ========== МЕТРИКИ ==========
+class MovieApplication(Application):
+    """Application, записывающее в metrics время обработки и ошибки каждого обновления.
+
+    Метки - вид обновления (command, callback, message) и обработчик: имя
+    команды или функции-обработчика кнопки. Неизвестные команды и кнопки
+    попадают в unknown, чтобы число рядов метрик оставалось ограниченным.
+    """
+    
+    @functools.cached_property
+    def command_names(self) -> frozenset:
+        """Команды, для которых зарегистрированы обработчики"""
+        return frozenset(command for handlers in self.handlers.values() for handler in handlers
+                         if isinstance(handler, CommandHandler) for command in handler.commands)
+    
+    def update_labels(self, update: object) -> Tuple[str, str]:
+        """Вид обновления и обработчик для меток метрик"""
+        if not isinstance(update, Update):
+            return 'other', type(update).__name__
+        query = update.callback_query
+        if query is not None:
+            handler, _ = callback_router.resolve(query.data or '')
+            return 'callback', handler.__name__ if handler else 'unknown'
+        message = update.message
+        if message is None:
+            return 'other', 'other'
+        if message.text and message.text.startswith('/'):
+            parts = message.text[1:].split(maxsplit=1)
+            command = parts[0].split('@', 1)[0].lower() if parts else ''
+            return 'command', command if command in self.command_names else 'unknown'
+        return 'message', 'document' if message.document else 'text' if message.text else 'other'
+    
+    async def process_update(self, update: object):
+        start = time.perf_counter()
+        try:
+            await super().process_update(update)
+        finally:
+            metrics.observe_update(*self.update_labels(update), time.perf_counter() - start)
+    
+    async def process_error(self, update: Optional[object], error: Exception, job=None, coroutine=None) -> bool:
+        if update is not None:
+            metrics.observe_error(*self.update_labels(update), error)
+        else:
+            metrics.observe_error('job', job.name if job else 'unknown', error)
+        return await super().process_error(update, error, job, coroutine)
+
+
+class MetricsServer:
+    """HTTP-сервер метрик: GET /metrics отдает metrics.render() в формате Prometheus"""
+    
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+    # Сколько ждать запрос целиком (строку запроса и заголовки), секунды
+    READ_TIMEOUT = 10
+    
+    def __init__(self, registry: Metrics):
+        self.registry = registry
+        self._server: Optional[asyncio.AbstractServer] = None
+    
+    async def start(self, host: str, port: int) -> int:
+        """Запуск сервера; возвращает порт, на котором он слушает"""
+        self._server = await asyncio.start_server(self._serve, host, port)
+        return self._server.sockets[0].getsockname()[1]
+    
+    async def stop(self):
+        if self._server is None:
+            return
+        self._server.close()
+        await self._server.wait_closed()
+        self._server = None
+    
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Один запрос на соединение (как у большинства сборщиков метрик)"""
+        try:
+            # Молчащий или медленный клиент не держит соединение: запрос читается за READ_TIMEOUT
+            request_line = await asyncio.wait_for(self._read_request(reader), self.READ_TIMEOUT)
+            method, path, _ = request_line.decode('latin-1').split(' ', 2)
+            if method in ('GET', 'HEAD') and path.split('?', 1)[0] == '/metrics':
+                status, content_type, body = '200 OK', self.CONTENT_TYPE, self.registry.render().encode()
+            else:
+                status, content_type, body = '404 Not Found', 'text/plain', b'Not Found'
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                         f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode()
+                         + (body if method != 'HEAD' else b''))
+            await writer.drain()
+        except (ConnectionError, ValueError, asyncio.TimeoutError):
+            pass
+        finally:
+            writer.close()
+    
+    @staticmethod
+    async def _read_request(reader: asyncio.StreamReader) -> bytes:
+        """Строка запроса; заголовки пропускаются (тело у GET и HEAD не ожидается)"""
+        request_line = await reader.readline()
+        while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+            pass
+        return request_line
+
+
+async def start_metrics(application: Application):
+    """Запуск замера задержки цикла событий и (если задан METRICS_PORT) сервера метрик"""
+    application.bot_data['loop_lag_task'] = asyncio.create_task(metrics.monitor_loop_lag())
+    if METRICS_PORT:
+        server = MetricsServer(metrics)
+        port = await server.start(METRICS_LISTEN, METRICS_PORT)
+        application.bot_data['metrics_server'] = server
+        logger.info(f"Метрики Prometheus: http://{METRICS_LISTEN}:{port}/metrics")
+
+
+async def stop_metrics(application: Application):
+    task = application.bot_data.pop('loop_lag_task', None)
+    if task is not None:
+        task.cancel()
+    server = application.bot_data.pop('metrics_server', None)
+    if server is not None:
+        await server.stop()
+
+
+# ========== ВЕБХУК ==========
+class WebhookServer:
+    """Прием обновлений от Telegram (вебхук) встроенным HTTP-сервером на asyncio.
+
+    Проверяет секрет из заголовка X-Telegram-Bot-Api-Secret-Token, кладет
+    обновление в очередь приложения и сразу отвечает 200 - обработка идет
+    отдельно. Если очередь остается заполненной дольше enqueue_timeout,
+    отвечает 503: Telegram повторит доставку позже. GET - проверка доступности.
+    """
+    
+    # Предельный размер тела запроса (обновления Telegram намного меньше)
+    MAX_BODY_BYTES = 1024 * 1024
+    SECRET_HEADER = 'x-telegram-bot-api-secret-token'
+    REASONS = {200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found',
+               405: 'Method Not Allowed', 413: 'Payload Too Large', 503: 'Service Unavailable'}
+    
+    def __init__(self, application: Application, path: str, secret_token: str,
+                 enqueue_timeout: float = WEBHOOK_ENQUEUE_TIMEOUT, idle_timeout: float = WEBHOOK_IDLE_TIMEOUT,
+                 read_timeout: float = WEBHOOK_READ_TIMEOUT):
+        self.application = application
+        self.path = path
+        self.secret_token = secret_token.encode()
+        self.enqueue_timeout = enqueue_timeout
+        self.idle_timeout = idle_timeout
+        self.read_timeout = read_timeout
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._connections = set()
+        self.received = 0
+        self.rejected = 0
+        self.queue_full = 0
+        self.bad_requests = 0
+        self.timeouts = 0
+    
+    async def start(self, host: str, port: int) -> int:
+        """Запуск сервера; возвращает порт, на котором он слушает"""
+        self._server = await asyncio.start_server(self._serve, host, port)
+        return self._server.sockets[0].getsockname()[1]
+    
+    async def stop(self):
+        if self._server is None:
+            return
+        self._server.close()
+        for writer in list(self._connections):
+            writer.close()
+        await self._server.wait_closed()
+        self._server = None
+    
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Соединение HTTP/1.1: запросы обрабатываются по очереди, пока клиент держит соединение.
+
+        Молчащий или слишком медленный клиент не держит соединение вечно: начало запроса
+        ждется не дольше idle_timeout, заголовки и тело читаются не дольше read_timeout каждое.
+        """
+        self._connections.add(writer)
+        try:
+            while True:
+                request_line = await asyncio.wait_for(reader.readline(), self.idle_timeout)
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = await asyncio.wait_for(self._read_headers(reader), self.read_timeout)
+                
+                length = int(headers.get('content-length') or 0)
+                if length > self.MAX_BODY_BYTES:
+                    self.bad_requests += 1
+                    await self._respond(writer, 413, close=True)
+                    break
+                body = await asyncio.wait_for(reader.readexactly(length), self.read_timeout)
+                
+                status = await self._handle(method, path, headers, body)
+                close = headers.get('connection', '').lower() == 'close'
+                await self._respond(writer, status, close=close)
+                if close:
+                    break
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+    
+    @staticmethod
+    async def _read_headers(reader: asyncio.StreamReader) -> Dict[str, str]:
+        """Заголовки запроса до пустой строки; имена в нижнем регистре"""
+        headers = {}
+        while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        return headers
+    
+    async def _handle(self, method: str, path: str, headers: Dict[str, str], body: bytes) -> int:
+        """HTTP-статус ответа на запрос"""
+        if method == 'GET':
+            return 200
+        if method != 'POST':
+            return 405
+        if path.split('?', 1)[0] != self.path:
+            return 404
+        if not hmac.compare_digest(headers.get(self.SECRET_HEADER, '').encode(), self.secret_token):
+            self.rejected += 1
+            return 403
+        
+        try:
+            update = Update.de_json(json.loads(body), self.application.bot)
+        except (ValueError, TypeError, KeyError) as e:
+            logger.warning(f"Вебхук: не удалось разобрать обновление: {e}")
+            update = None
+        if update is None:
+            self.bad_requests += 1
+            return 400
+        
+        try:
+            await asyncio.wait_for(self.application.update_queue.put(update), self.enqueue_timeout)
+        except asyncio.TimeoutError:
+            self.queue_full += 1
+            return 503
+        self.received += 1
+        return 200
+    
+    async def _respond(self, writer: asyncio.StreamWriter, status: int, close: bool = False):
+        body = self.REASONS[status].encode()
+        head = f"HTTP/1.1 {status} {self.REASONS[status]}\r\nContent-Type: text/plain\r\nContent-Length: {len(body)}\r\n"
+        if close:
+            head += "Connection: close\r\n"
+        writer.write((head + "\r\n").encode() + body)
+        await writer.drain()
+    
+    def stats(self) -> Dict:
+        """Счетчики вебхука"""
+        return {
+            'received': self.received,
+            'rejected': self.rejected,
+            'queue_full': self.queue_full,
+            'bad_requests': self.bad_requests,
+            'timeouts': self.timeouts,
+            'queue_size': self.application.update_queue.qsize(),
+        }
+
+
+async def run_webhook(application: Application):
+    """Работа в режиме вебхука до сигнала остановки (SIGINT, SIGTERM)"""
+    if not WEBHOOK_URL:
+        raise ValueError("Для BOT_MODE=webhook нужна переменная окружения WEBHOOK_URL")
+    
+    secret_token = WEBHOOK_SECRET_TOKEN or secrets.token_urlsafe(32)
+    server = WebhookServer(application, urlparse(WEBHOOK_URL).path or '/', secret_token)
+    application.bot_data['webhook_server'] = server
+    metrics.add_stats('webhook', server.stats, ('received', 'rejected', 'queue_full', 'bad_requests', 'timeouts'))
+    
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for stop_signal in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(stop_signal, stop.set)
+    
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        port = await server.start(WEBHOOK_LISTEN, WEBHOOK_PORT)
+        # Вебхук не удаляется при остановке: обновления, пришедшие во время перезапуска,
+        # Telegram доставит после него, поэтому накопившиеся обновления не сбрасываются
+        await application.bot.set_webhook(
+            WEBHOOK_URL,
+            secret_token=secret_token,
+            allowed_updates=Update.ALL_TYPES,
+            max_connections=WEBHOOK_MAX_CONNECTIONS
+        )
+        logger.info(f"Вебхук {WEBHOOK_URL} слушает {WEBHOOK_LISTEN}:{port}")
+        await stop.wait()
+    finally:
+        await server.stop()
+        if application.running:
+            await application.stop()
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
 # ========== ГЛАВНАЯ ФУНКЦИЯ ==========
+async def flush_activity_job(context: ContextTypes.DEFAULT_TYPE):
+    """Периодическая запись буфера активности"""
+    await activity.flush()
+
+
+async def reconcile_stats_job(context: ContextTypes.DEFAULT_TYPE):
+    """Периодическая сверка глобальной статистики"""
+    await db.reconcile_global_stats()
+
+
+async def on_startup(application: Application):
+    """Запуск метрик после инициализации приложения"""
+    await start_metrics(application)
+
+
+async def on_shutdown(application: Application):
+    """Остановка метрик и корректное завершение работы с базой данных"""
+    await stop_metrics(application)
+    await activity.flush()
+    db.close()
+
+
+def build_application(bot: Optional[ExtBot] = None) -> Application:
+    """Application со всеми обработчиками и периодическими задачами бота.
+
+    bot - готовый экземпляр бота (например, с другим адресом Bot API в бенчмарках);
+    по умолчанию MovieBot по настройкам из переменных окружения.
+    """
+    # Создаем Application
+    if bot is None:
+        bot = MovieBot(TOKEN, base_url=BOT_API_BASE_URL, base_file_url=BOT_API_BASE_FILE_URL,
+                       request=HTTPXRequest(connection_pool_size=256), rate_limiter=send_scheduler)
+    application = (
+        Application.builder()
+        .application_class(MovieApplication)
+        .bot(bot)
+        .update_queue(asyncio.Queue(maxsize=UPDATE_QUEUE_SIZE))
+        .concurrent_updates(CONCURRENT_UPDATES)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
+    
+    # Ограничение частоты запросов: проверяется раньше всех остальных обработчиков
+    application.add_handler(TypeHandler(Update, throttle_updates), group=-1)
+    
+    # Регистрируем обработчики команд
+    application.add_handler(CommandHandler("start", start_command))
+    application.add_handler(CommandHandler("help", help_command))
+    application.add_handler(CommandHandler("add", add_movie_command))
+    application.add_handler(CommandHandler("my", show_my_movies_command))
+    application.add_handler(CommandHandler("watched", show_watched_command))
+    application.add_handler(CommandHandler("public", show_public_list_command))
+    application.add_handler(CommandHandler("search", search_command))
+    application.add_handler(CommandHandler("search_public", search_public_command))
+    application.add_handler(CommandHandler("random", random_movie_command))
+    application.add_handler(CommandHandler("stats", show_stats_command))
+    application.add_handler(CommandHandler("admin_stats", admin_stats_command))
+    application.add_handler(CommandHandler("rebuild_stats", rebuild_stats_command))
+    application.add_handler(CommandHandler("import", import_command))
+    application.add_handler(CommandHandler("export", export_command))
+    application.add_handler(CommandHandler("dump", dump_command))
+    
+    # Обработчик файлов (импорт списков фильмов)
+    application.add_handler(MessageHandler(filters.Document.ALL, import_document))
+    
+    # Обработчик текстовых сообщений (для добавления фильмов)
+    application.add_handler(MessageHandler(
+        filters.TEXT & ~filters.COMMAND, 
+        add_movie_command
+    ))
+    
+    # Обработчик кнопок
+    application.add_handler(CallbackQueryHandler(button_handler))
+    
+    # Периодическая запись активности пользователей
+    application.job_queue.run_repeating(
+        flush_activity_job,
+        interval=ACTIVITY_FLUSH_INTERVAL,
+        first=ACTIVITY_FLUSH_INTERVAL
+    )
+    
+    # Периодическая сверка глобальной статистики
+    application.job_queue.run_repeating(
+        reconcile_stats_job,
+        interval=STATS_RECONCILE_INTERVAL,
+        first=STATS_RECONCILE_INTERVAL
+    )
+    
+    return application
+
+
 def main():
     """Основная функция запуска бота"""
     print("=" * 50)
@@ -1651,29 +5210,7 @@ def main():
     print("Инициализация бота...")
     
     try:
-        # Создаем Application
-        application = Application.builder().token(TOKEN).build()
-        
-        # Регистрируем обработчики команд
-        application.add_handler(CommandHandler("start", start_command))
-        application.add_handler(CommandHandler("help", help_command))
-        application.add_handler(CommandHandler("add", add_movie_command))
-        application.add_handler(CommandHandler("my", show_my_movies_command))
-        application.add_handler(CommandHandler("watched", show_watched_command))
-        application.add_handler(CommandHandler("public", show_public_list_command))
-        application.add_handler(CommandHandler("search", search_command))
-        application.add_handler(CommandHandler("search_public", search_public_command))
-        application.add_handler(CommandHandler("random", random_movie_command))
-        application.add_handler(CommandHandler("stats", show_stats_command))
-        
-        # Обработчик текстовых сообщений (для добавления фильмов)
-        application.add_handler(MessageHandler(
-            filters.TEXT & ~filters.COMMAND, 
-            add_movie_command
-        ))
-        
-        # Обработчик кнопок
-        application.add_handler(CallbackQueryHandler(button_handler))
+        application = build_application()
         
         print("✅ Бот инициализирован успешно!")
         print("✅ База данных создана/подключена")
@@ -1685,10 +5222,13 @@ def main():
         print("=" * 50)
         
         # Запускаем бота
-        application.run_polling(
-            allowed_updates=Update.ALL_TYPES,
-            drop_pending_updates=True  # Важно для перезапусков
-        )
+        if BOT_MODE == 'webhook':
+            asyncio.run(run_webhook(application))
+        else:
+            application.run_polling(
+                allowed_updates=Update.ALL_TYPES,
+                drop_pending_updates=True  # Важно для перезапусков
+            )
         
     except Exception as e:
         logger.error(f"Ошибка при запуске бота: {e}")